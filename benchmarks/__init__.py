@@ -0,0 +1,7 @@
+"""Offline benchmarks for dip-retrieve, dip-metadata and dip-upload.
+
+Run with `python -m benchmarks.run` from the repository root. Everything the
+commands talk to is replaced by a local stand-in: synthetic DIPs, a fake
+Storage Service, a fake AtoM API and a paramiko SSH server playing both the
+jump server and the AtoM server.
+"""
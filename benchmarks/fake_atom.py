@@ -0,0 +1,125 @@
+"""Local stand-in for the AtoM REST API used by dip-metadata.
+
+Accepts digital object creation requests and answers description lookups
+with the objects created so far, after a configurable delay per request to
+stand in for AtoM's own processing time. An optional share of requests is
+answered with 429 so backoff is exercised too, and the first creation
+requests can be made to fail or stall after the object is created, as when
+AtoM's web server times out on a slow request.
+"""
+import http.server
+import json
+import random
+import socketserver
+import threading
+import time
+
+
+class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class FakeAtom:
+    """Threaded HTTP server answering AtoM API requests."""
+
+    def __init__(
+        self, latency=0.02, throttle_rate=0.0, seed=0, after_create=(), stall_seconds=1.0
+    ):
+        """
+        :param latency: Seconds to wait before answering each request (float)
+        :param throttle_rate: Share of creation requests answered with 429 (float)
+        :param seed: Seed for choosing throttled requests (int)
+        :param after_create: What to do after creating the object for the
+            first creation requests, in order: an HTTP status to answer
+            with, or "stall" to wait stall_seconds before answering (list)
+        :param stall_seconds: Seconds a stalled request waits (float)
+        """
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.after_create = list(after_create)
+        self.stall_seconds = stall_seconds
+        self.created = 0
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._children = {}
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._server = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}/".format(self._server.server_address[1])
+
+    def start(self):
+        atom = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; with Nagle's
+            # algorithm the body waits for the client's delayed ACK, adding
+            # 40 ms to every request on a reused connection.
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, body, status=200, headers=None):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _wait(self):
+                with atom._lock:
+                    atom._in_flight += 1
+                    atom.max_in_flight = max(atom.max_in_flight, atom._in_flight)
+                time.sleep(atom.latency)
+                with atom._lock:
+                    atom._in_flight -= 1
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                self._wait()
+                with atom._lock:
+                    throttled = atom._random.random() < atom.throttle_rate
+                    fault = None
+                    if not throttled:
+                        atom.created += 1
+                        atom._children.setdefault(
+                            body.get("information_object_slug"), []
+                        ).append(body.get("name") or body.get("title"))
+                        if atom.after_create:
+                            fault = atom.after_create.pop(0)
+                if throttled:
+                    return self._send_json({}, 429, {"Retry-After": "0"})
+                if fault == "stall":
+                    time.sleep(atom.stall_seconds)
+                elif fault is not None:
+                    return self._send_json({}, fault)
+                self._send_json({"slug": "digital-object-{}".format(atom.created)}, 201)
+
+            def do_GET(self):
+                slug = self.path.split("?")[0].rstrip("/").rsplit("/", 1)[-1]
+                self._wait()
+                with atom._lock:
+                    children = list(atom._children.get(slug, []))
+                self._send_json(
+                    {
+                        "slug": slug,
+                        "title": slug,
+                        "children": [{"title": title, "slug": title} for title in children],
+                    }
+                )
+
+        self._server = _Server(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
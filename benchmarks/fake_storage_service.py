@@ -0,0 +1,200 @@
+"""Local stand-in for the Storage Service API used by dip-retrieve.
+
+Serves the package listing that aip2dips pages through, package downloads
+with Range support, single-file extraction and package contents, for DIPs
+added from local directories. Each DIP is packed into a tarball once, when
+it is added, so serving it costs no more than reading a file.
+
+Setting drop_after makes package downloads cut the connection after that
+many bytes of each response, for testing resumed downloads.
+"""
+import hashlib
+import http.server
+import json
+import os
+import re
+import socket
+import socketserver
+import tarfile
+import threading
+import uuid
+from urllib.parse import parse_qs, urlparse
+
+READ_SIZE = 1024 * 1024
+PACKAGE_PATH = re.compile(r"^/api/v2/file/([0-9a-f-]+)/(download|extract_file|contents)/$")
+
+
+class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class FakeStorageService:
+    """Threaded HTTP server answering Storage Service API requests."""
+
+    def __init__(self, work_dir, drop_after=None):
+        """
+        :param work_dir: Directory to keep package tarballs in (str)
+        :param drop_after: Bytes of each download response to send before
+            cutting the connection, or None to send them all (int)
+        """
+        self.work_dir = work_dir
+        self.packages = {}
+        self.requests = 0
+        self.drop_after = drop_after
+        self.drops = 0
+        # Range header of each download request, or None without one.
+        self.ranges = []
+        self._server = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self._server.server_address[1])
+
+    def add_dip(self, dip_path):
+        """Pack a DIP directory and list it as an uploaded DIP.
+
+        :param dip_path: Path to DIP directory (str)
+
+        :returns: DIP UUID (str)
+        """
+        dip_uuid = str(uuid.uuid4())
+        basename = os.path.basename(dip_path.rstrip("/"))
+        tar_path = os.path.join(self.work_dir, dip_uuid + ".tar")
+        with tarfile.open(tar_path, "w") as archive:
+            archive.add(dip_path, basename)
+
+        hasher = hashlib.sha256()
+        with open(tar_path, "rb") as tarball:
+            for chunk in iter(lambda: tarball.read(READ_SIZE), b""):
+                hasher.update(chunk)
+        with tarfile.open(tar_path) as archive:
+            contents = [member.name for member in archive if member.isfile()]
+
+        self.packages[dip_uuid] = {
+            "package": {
+                "uuid": dip_uuid,
+                "current_path": "/var/archivematica/DIPsStore/{}".format(basename),
+                "package_type": "DIP",
+                "status": "UPLOADED",
+                "size": os.path.getsize(tar_path),
+                "checksum": hasher.hexdigest(),
+                "checksum_algorithm": "sha256",
+            },
+            "tar_path": tar_path,
+            "contents": contents,
+        }
+        return dip_uuid
+
+    def start(self):
+        service = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, body, status=200):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                service.requests += 1
+                parsed = urlparse(self.path)
+                query = parse_qs(parsed.query)
+                if parsed.path == "/api/v2/file/":
+                    return self._listing(query)
+                match = PACKAGE_PATH.match(parsed.path)
+                if not match or match.group(1) not in service.packages:
+                    return self._send_json({"error": "not found"}, 404)
+                entry = service.packages[match.group(1)]
+                if match.group(2) == "download":
+                    return self._download(entry)
+                if match.group(2) == "contents":
+                    return self._send_json(
+                        {"files": [{"path": path} for path in entry["contents"]]}
+                    )
+                return self._extract(entry, query.get("relative_path_to_file", [""])[0])
+
+            def _listing(self, query):
+                packages = [
+                    entry["package"]
+                    for entry in service.packages.values()
+                    if entry["package"]["package_type"]
+                    == query.get("package_type", ["DIP"])[0]
+                ]
+                limit = int(query.get("limit", ["20"])[0])
+                offset = int(query.get("offset", ["0"])[0])
+                next_path = None
+                if offset + limit < len(packages):
+                    next_path = "/api/v2/file/?package_type=DIP&limit={}&offset={}".format(
+                        limit, offset + limit
+                    )
+                self._send_json(
+                    {
+                        "meta": {"next": next_path, "total_count": len(packages)},
+                        "objects": packages[offset:offset + limit],
+                    }
+                )
+
+            def _download(self, entry):
+                size = os.path.getsize(entry["tar_path"])
+                service.ranges.append(self.headers.get("Range"))
+                start = 0
+                match = re.match(r"bytes=(\d+)-", self.headers.get("Range", ""))
+                if match:
+                    start = int(match.group(1))
+                    if start >= size:
+                        self.send_response(416)
+                        self.send_header("Content-Range", "bytes */{}".format(size))
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header(
+                        "Content-Range", "bytes {}-{}/{}".format(start, size - 1, size)
+                    )
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Type", "application/x-tar")
+                self.send_header("Content-Length", str(size - start))
+                self.end_headers()
+                length = size - start
+                if service.drop_after is not None:
+                    length = min(length, service.drop_after)
+                remaining = length
+                with open(entry["tar_path"], "rb") as tarball:
+                    tarball.seek(start)
+                    while remaining:
+                        chunk = tarball.read(min(READ_SIZE, remaining))
+                        self.wfile.write(chunk)
+                        remaining -= len(chunk)
+                if length < size - start:
+                    # Cut the connection mid-body, as a flaky network would.
+                    service.drops += 1
+                    self.wfile.flush()
+                    self.close_connection = True
+                    self.connection.shutdown(socket.SHUT_RDWR)
+
+            def _extract(self, entry, relative_path):
+                with tarfile.open(entry["tar_path"]) as archive:
+                    try:
+                        data = archive.extractfile(relative_path).read()
+                    except (KeyError, AttributeError):
+                        return self._send_json({"error": "not found"}, 404)
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._server = _Server(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
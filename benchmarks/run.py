@@ -0,0 +1,432 @@
+"""Time dip-retrieve, dip-metadata and dip-upload against local stand-ins.
+
+For each scale, synthetic DIPs are generated into a temporary directory and
+served by a fake Storage Service, a fake AtoM API and a local SSH server, and
+a config file pointing at them is written to a temporary HOME. Each scenario
+then runs its command in a child process, --repeat times, and the median wall
+time, throughput and peak resident memory are reported. The
+metadata-throttled scenarios upload to a second fake AtoM, configured as the
+development server, that answers a share of requests with 429, at a low and
+the default --max-in-flight, so the adaptive concurrency limit is measured
+backing off and recovering. Results are compared
+against a stored baseline, and the run exits with status 1 if any scenario is
+slower or larger than the baseline by more than --tolerance, or fails.
+
+benchmarks/baseline.json in the repository was recorded at the default
+scales with --save-baseline. Times depend on the machine, so record a new
+one with --save-baseline before comparing on another machine.
+"""
+import argparse
+import configparser
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_atom import FakeAtom
+from benchmarks.fake_storage_service import FakeStorageService
+from benchmarks.ssh_server import SSHServer
+from benchmarks.synthetic import make_dip
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(REPO_ROOT, "benchmarks", "baseline.json")
+USERNAME = "benchmark"
+# Wall time differences below this are startup noise, whatever the ratio.
+MIN_SECONDS_DIFFERENCE = 0.25
+# The same for the startup scenarios, which only measure startup.
+MIN_STARTUP_SECONDS_DIFFERENCE = 0.05
+
+# Share of requests the throttled fake AtoM answers with 429.
+THROTTLE_RATE = 0.1
+
+# Number of DIPs, object files per DIP and mean object size in KiB.
+SCALES = {
+    "small": {"dips": 1, "objects": 20, "mean_kb": 64},
+    "medium": {"dips": 2, "objects": 200, "mean_kb": 256},
+    "large": {"dips": 4, "objects": 1000, "mean_kb": 512},
+}
+
+
+def _retrieve(env, stream=False):
+    args = ["--no-cache", "--target-dir", env["retrieved"]]
+    if stream:
+        args.append("--stream")
+    return "dip_retrieve", args + [dip["aip_uuid"] for dip in env["dips"]]
+
+
+def _metadata(env, max_in_flight=None):
+    args = ["--no-journal", "--no-mets-cache"]
+    if max_in_flight is not None:
+        # The development AtoM is the throttled one.
+        args += ["--dev", "--max-in-flight", str(max_in_flight)]
+    return "dip_metadata", args + [dip["path"] for dip in env["dips"]]
+
+
+def _upload(env, method):
+    args = ["--no-agent", "--transfer", method]
+    return "dip_upload", args + [dip["path"] for dip in env["dips"]]
+
+
+SCENARIOS = {
+    "retrieve": _retrieve,
+    "retrieve-stream": lambda env: _retrieve(env, stream=True),
+    "metadata": _metadata,
+    "metadata-throttled-2": lambda env: _metadata(env, max_in_flight=2),
+    "metadata-throttled-8": lambda env: _metadata(env, max_in_flight=8),
+    "upload-scp": lambda env: _upload(env, "scp"),
+    "upload-tar": lambda env: _upload(env, "tar"),
+    "upload-sftp": lambda env: _upload(env, "sftp"),
+    "startup-help": lambda env: ("cli", ["--help"]),
+    "startup-upload-help": lambda env: ("cli", ["upload", "--help"]),
+}
+
+# Scenarios that move no data, timing how soon dip-mungers can answer.
+STARTUP_SCENARIOS = ("startup-help", "startup-upload-help")
+
+
+def _make_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--scales",
+        help="Comma-separated scales to run: {} (default: small,medium)".format(
+            ", ".join(SCALES)
+        ),
+        default="small,medium",
+    )
+    parser.add_argument(
+        "--scenarios",
+        help="Comma-separated scenarios to run (default: all): {}".format(
+            ", ".join(SCENARIOS)
+        ),
+        default=",".join(SCENARIOS),
+    )
+    parser.add_argument(
+        "--repeat",
+        help="Number of runs per scenario; the median is reported (default: 3)",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--atom-latency",
+        help="Seconds the fake AtoM API waits before each response (default: 0.02)",
+        type=float,
+        default=0.02,
+    )
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument(
+        "--baseline",
+        help="Baseline results to compare against (default: {})".format(
+            os.path.relpath(DEFAULT_BASELINE, REPO_ROOT)
+        ),
+        default=DEFAULT_BASELINE,
+    )
+    parser.add_argument(
+        "--save-baseline",
+        help="Save these results as the baseline instead of comparing",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--tolerance",
+        help="Allowed slowdown or memory growth over the baseline, as a "
+        "fraction (default: 0.25)",
+        type=float,
+        default=0.25,
+    )
+    parser.add_argument(
+        "--keep",
+        help="Keep the temporary directory with DIPs and command logs",
+        action="store_true",
+    )
+
+    return parser
+
+
+def _write_config(path, ssh_port, storage_service_url, atom_url, throttled_atom_url):
+    config = configparser.ConfigParser()
+    # Keep key case, as in the shipped example config.
+    config.optionxform = str
+    config.read(os.path.join(REPO_ROOT, "dip-mungers-config.ini"))
+    config["GENERAL"]["USERNAME"] = USERNAME
+    config["GENERAL"]["JUMP_SERVER_HOSTNAME"] = "127.0.0.1"
+    config["GENERAL"]["JUMP_SERVER_PORT"] = str(ssh_port)
+    config["STORAGE_SERVICE"]["PROD_URL"] = storage_service_url
+    config["ATOM"]["PROD_URL"] = atom_url
+    config["ATOM"]["DEV_URL"] = throttled_atom_url
+    with open(path, "w") as config_file:
+        config.write(config_file)
+
+
+def setup_scale(work_dir, scale, atom_latency):
+    """Generate a scale's DIPs and start the stand-in services.
+
+    :param work_dir: Directory to generate everything in (str)
+    :param scale: Entry from SCALES (dict)
+    :param atom_latency: Seconds the fake AtoM waits per request (float)
+
+    :returns: Environment dictionary for the scenarios
+    """
+    home = os.path.join(work_dir, "home")
+    os.makedirs(home)
+    dips = []
+    for index in range(scale["dips"]):
+        dip_path, aip_uuid, size = make_dip(
+            os.path.join(work_dir, "dips"),
+            scale["objects"],
+            mean_kb=scale["mean_kb"],
+            slugs=max(1, scale["objects"] // 100),
+            seed=index,
+            name="transfer{}".format(index),
+        )
+        dips.append(
+            {"path": dip_path, "aip_uuid": aip_uuid, "bytes": size, "objects": scale["objects"]}
+        )
+
+    storage_service_dir = os.path.join(work_dir, "storage-service")
+    os.makedirs(storage_service_dir)
+    storage_service = FakeStorageService(storage_service_dir).start()
+    for dip in dips:
+        storage_service.add_dip(dip["path"])
+    atom = FakeAtom(latency=atom_latency).start()
+    throttled_atom = FakeAtom(latency=atom_latency, throttle_rate=THROTTLE_RATE).start()
+    ssh_server = SSHServer(os.path.join(work_dir, "server")).start()
+
+    _write_config(
+        os.path.join(home, ".dip-mungers"),
+        ssh_server.port,
+        storage_service.url,
+        atom.url,
+        throttled_atom.url,
+    )
+    return {
+        "home": home,
+        "dips": dips,
+        "retrieved": os.path.join(work_dir, "retrieved"),
+        "remote_home": os.path.join(ssh_server.root, "home", USERNAME),
+        "logs": os.path.join(work_dir, "logs"),
+        "services": [storage_service, atom, throttled_atom, ssh_server],
+    }
+
+
+def _reset(env):
+    """Clear what an earlier run left behind, so every run starts cold."""
+    for path in (env["retrieved"], env["remote_home"], os.path.join(env["home"], ".cache")):
+        shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(env["retrieved"])
+    os.makedirs(env["remote_home"])
+
+
+def run_command(module, args, env, log_path):
+    """Run a command in a child process and measure it.
+
+    :param module: Module under dip_mungers to run (str)
+    :param args: Command-line arguments (list)
+    :param env: Environment dictionary from setup_scale
+    :param log_path: File to write the command's output to (str)
+
+    :returns: Tuple of (exit status, wall seconds, peak RSS in bytes)
+    """
+    child_env = dict(os.environ)
+    child_env["HOME"] = env["home"]
+    child_env["PYTHONPATH"] = os.pathsep.join(
+        [REPO_ROOT] + ([os.environ["PYTHONPATH"]] if os.environ.get("PYTHONPATH") else [])
+    )
+    with open(log_path, "w") as log:
+        start_time = time.monotonic()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.shim", module] + args,
+            cwd=REPO_ROOT,
+            env=child_env,
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+        # wait4 rather than wait, for the child's resource usage.
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.monotonic() - start_time
+    if os.WIFEXITED(status):
+        process.returncode = os.WEXITSTATUS(status)
+    else:
+        process.returncode = -os.WTERMSIG(status)
+    # ru_maxrss is in kilobytes on Linux but bytes on macOS.
+    peak_rss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    return process.returncode, seconds, peak_rss
+
+
+def run_scenario(name, env, repeat):
+    """Run a scenario repeat times and summarise the runs.
+
+    :returns: Result dictionary
+    """
+    module, args = SCENARIOS[name](env)
+    total_bytes = 0
+    total_objects = 0
+    if name not in STARTUP_SCENARIOS:
+        total_bytes = sum(dip["bytes"] for dip in env["dips"])
+        total_objects = sum(dip["objects"] for dip in env["dips"])
+    times = []
+    peaks = []
+    failures = 0
+    for attempt in range(repeat):
+        _reset(env)
+        log_path = os.path.join(env["logs"], "{}-{}.log".format(name, attempt + 1))
+        status, seconds, peak_rss = run_command(module, args, env, log_path)
+        if status != 0:
+            failures += 1
+            print("  Error: run {} exited with status {}, see {}".format(
+                attempt + 1, status, log_path
+            ))
+        times.append(seconds)
+        peaks.append(peak_rss)
+
+    seconds = statistics.median(times)
+    return {
+        "seconds": round(seconds, 3),
+        "mb_per_second": round(total_bytes / 1024 ** 2 / seconds, 2),
+        "objects_per_second": round(total_objects / seconds, 1),
+        "peak_rss_mb": round(max(peaks) / 1024 ** 2, 1),
+        "bytes": total_bytes,
+        "objects": total_objects,
+        "runs": repeat,
+        "failures": failures,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Find results that are worse than the baseline by more than tolerance.
+
+    :param results: Result dictionaries by scenario key (dict)
+    :param baseline: Baseline result dictionaries by scenario key (dict)
+    :param tolerance: Allowed growth, as a fraction (float)
+
+    :returns: List of regression descriptions (str)
+    """
+    regressions = []
+    for key, result in sorted(results.items()):
+        if key not in baseline:
+            continue
+        min_seconds_difference = MIN_SECONDS_DIFFERENCE
+        if key.split("/")[0] in STARTUP_SCENARIOS:
+            min_seconds_difference = MIN_STARTUP_SECONDS_DIFFERENCE
+        for metric in ("seconds", "peak_rss_mb"):
+            before = baseline[key][metric]
+            after = result[metric]
+            if metric == "seconds" and after - before < min_seconds_difference:
+                continue
+            if before and after > before * (1 + tolerance):
+                regressions.append(
+                    "{} {}: {} -> {} (+{:.0%})".format(
+                        key, metric, before, after, after / before - 1
+                    )
+                )
+    return regressions
+
+
+def main():
+    parser = _make_parser()
+    args = parser.parse_args()
+
+    scales = [scale for scale in args.scales.split(",") if scale]
+    scenarios = [scenario for scenario in args.scenarios.split(",") if scenario]
+    for scale in scales:
+        if scale not in SCALES:
+            parser.error("unknown scale: {}".format(scale))
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            parser.error("unknown scenario: {}".format(scenario))
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+    if not hasattr(os, "wait4"):
+        parser.error("peak memory can only be measured where os.wait4 exists")
+
+    # The SSH server's transports log dropped connections as errors when a
+    # command exits; that is expected here.
+    logging.getLogger("paramiko").addHandler(logging.NullHandler())
+
+    results = {}
+    for scale in scales:
+        work_dir = tempfile.mkdtemp(prefix="dip-mungers-benchmark-")
+        print("Generating {} scale DIPs in {}...".format(scale, work_dir))
+        env = setup_scale(work_dir, SCALES[scale], args.atom_latency)
+        os.makedirs(env["logs"])
+        try:
+            for scenario in scenarios:
+                key = "{}/{}".format(scenario, scale)
+                print("Running {}...".format(key))
+                result = run_scenario(scenario, env, args.repeat)
+                results[key] = result
+                if scenario in STARTUP_SCENARIOS:
+                    print("  {seconds:.3f} s, peak RSS {peak_rss_mb:.1f} MB".format(**result))
+                    continue
+                print(
+                    "  {seconds:.2f} s, {mb_per_second:.1f} MB/s, "
+                    "{objects_per_second:.1f} objects/s, peak RSS {peak_rss_mb:.1f} MB".format(
+                        **result
+                    )
+                )
+        finally:
+            for service in env["services"]:
+                service.stop()
+            if args.keep:
+                print("Kept {}".format(work_dir))
+            else:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    document = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(document, output, indent=2, sort_keys=True)
+
+    failed = [key for key, result in sorted(results.items()) if result["failures"]]
+    if args.save_baseline:
+        if failed:
+            for key in failed:
+                print("Error: {} had failed runs".format(key))
+            print("Not saving a baseline with failed runs")
+            sys.exit(1)
+        baseline = {"results": {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as baseline_file:
+                baseline = json.load(baseline_file)
+        baseline.update({key: value for key, value in document.items() if key != "results"})
+        baseline["results"].update(results)
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        print("Saved baseline to {}".format(args.baseline))
+        return
+
+    regressions = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("platform") != document["platform"]:
+            print(
+                "Warning: Baseline was recorded on {}; times from another machine "
+                "are not comparable".format(baseline.get("platform"))
+            )
+        regressions = compare(results, baseline["results"], args.tolerance)
+        for regression in regressions:
+            print("Regression: {}".format(regression))
+        if not regressions:
+            print("No regressions against {}".format(args.baseline))
+    else:
+        print("Warning: No baseline at {}; run with --save-baseline to create one".format(
+            args.baseline
+        ))
+    for key in failed:
+        print("Error: {} had failed runs".format(key))
+    if regressions or failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
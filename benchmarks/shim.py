@@ -0,0 +1,28 @@
+"""Run a dip-mungers command without a terminal to type passwords into.
+
+The benchmark runner starts each measured command as
+`python -m benchmarks.shim <module> [args...]`, so that the command runs in
+a process of its own and its peak memory can be read back, while password
+prompts are answered here instead of by a person.
+"""
+import getpass
+import importlib
+import sys
+
+PASSWORD = "benchmark"
+
+
+def main():
+    module_name = sys.argv[1]
+    getpass.getpass = lambda prompt="Password: ", stream=None: PASSWORD
+    module = importlib.import_module("dip_mungers.{}".format(module_name))
+    if hasattr(module, "simple_auth_handler"):
+        module.simple_auth_handler = lambda title, instructions, prompts: [
+            PASSWORD for _ in prompts
+        ]
+    sys.argv = [module_name.replace("_", "-")] + sys.argv[2:]
+    module.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""Local paramiko SSH server standing in for the jump server and AtoM server.
+
+One listening socket plays the jump server: it accepts any login, and every
+direct-tcpip channel opened through it (SSHJumpClient's second hop) is handed
+to a fresh in-process server that plays the AtoM server. Both run commands
+with bash and serve SFTP, with every absolute path under /home moved into a
+sandbox directory so nothing outside it is touched. AtoM's import command is
+replaced by a stub that answers sudo's password prompt the way sudo does and
+prints a line per object file.
+"""
+import os
+import re
+import shlex
+import socket
+import subprocess
+import threading
+
+import paramiko
+
+READ_SIZE = 64 * 1024
+
+# sudo -S -p '<prompt>' php <symfony> import:dip-objects <path>, or the
+# same without sudo for --nginx.
+IMPORT_COMMAND = re.compile(
+    r"^(?:sudo -S -p ('(?:[^']|'\\'')*') )?php \S+ import:dip-objects (\S+)$"
+)
+
+IMPORT_STUB = """\
+if [ -n "$PROMPT" ]; then printf '%s' "$PROMPT" >&2; read -r password; fi
+for path in "$DIP"/objects/*; do
+    case "$path" in *.csv) continue ;; esac
+    echo "Importing digital object ${path##*/}"
+done
+echo "Successfully imported DIP $DIP"
+"""
+
+
+class _SFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as err:
+            return paramiko.SFTPServer.convert_errno(err.errno)
+
+
+def _sftp_interface(root):
+    """Build an SFTP server interface class rooted at root."""
+
+    def local(path):
+        return os.path.join(root, os.path.normpath("/" + path).lstrip("/"))
+
+    def errors(method):
+        def wrapper(self, *args):
+            try:
+                return method(self, *args)
+            except OSError as err:
+                return paramiko.SFTPServer.convert_errno(err.errno)
+
+        return wrapper
+
+    class Interface(paramiko.SFTPServerInterface):
+        @errors
+        def list_folder(self, path):
+            entries = []
+            for name in os.listdir(local(path)):
+                attributes = paramiko.SFTPAttributes.from_stat(
+                    os.lstat(os.path.join(local(path), name))
+                )
+                attributes.filename = name
+                entries.append(attributes)
+            return entries
+
+        @errors
+        def stat(self, path):
+            return paramiko.SFTPAttributes.from_stat(os.stat(local(path)))
+
+        @errors
+        def lstat(self, path):
+            return paramiko.SFTPAttributes.from_stat(os.lstat(local(path)))
+
+        @errors
+        def open(self, path, flags, attr):
+            fd = os.open(local(path), flags | getattr(os, "O_BINARY", 0), 0o644)
+            if flags & os.O_WRONLY:
+                mode = "ab" if flags & os.O_APPEND else "wb"
+            elif flags & os.O_RDWR:
+                mode = "a+b" if flags & os.O_APPEND else "r+b"
+            else:
+                mode = "rb"
+            fileobj = os.fdopen(fd, mode)
+            handle = _SFTPHandle(flags)
+            handle.filename = local(path)
+            handle.readfile = fileobj
+            handle.writefile = fileobj
+            return handle
+
+        @errors
+        def remove(self, path):
+            os.remove(local(path))
+            return paramiko.SFTP_OK
+
+        @errors
+        def rename(self, oldpath, newpath):
+            os.rename(local(oldpath), local(newpath))
+            return paramiko.SFTP_OK
+
+        @errors
+        def posix_rename(self, oldpath, newpath):
+            os.replace(local(oldpath), local(newpath))
+            return paramiko.SFTP_OK
+
+        @errors
+        def mkdir(self, path, attr):
+            os.mkdir(local(path))
+            return paramiko.SFTP_OK
+
+        @errors
+        def rmdir(self, path):
+            os.rmdir(local(path))
+            return paramiko.SFTP_OK
+
+        @errors
+        def chattr(self, path, attr):
+            if attr.st_mode is not None:
+                os.chmod(local(path), attr.st_mode & 0o7777)
+            if attr.st_atime is not None and attr.st_mtime is not None:
+                os.utime(local(path), (attr.st_atime, attr.st_mtime))
+            return paramiko.SFTP_OK
+
+        def canonicalize(self, path):
+            return os.path.normpath("/" + path)
+
+    return Interface
+
+
+class _Interface(paramiko.ServerInterface):
+    def __init__(self, server):
+        self.server = server
+        self.forwarded = set()
+
+    def get_allowed_auths(self, username):
+        return "password,publickey,keyboard-interactive"
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_interactive(self, username, submethods):
+        return paramiko.InteractiveQuery("", "", ("Password: ", False))
+
+    def check_auth_interactive_response(self, responses):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        self.forwarded.add(chanid)
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_pty_request(self, *args):
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(
+            target=self.server._run_command,
+            args=(channel, command.decode("utf-8")),
+            daemon=True,
+        ).start()
+        return True
+
+
+class SSHServer:
+    """SSH server playing the jump server and, behind it, the AtoM server."""
+
+    def __init__(self, root):
+        """
+        :param root: Sandbox directory standing in for the server's / (str)
+        """
+        self.root = root
+        self.commands = []
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self._listener = None
+
+    @property
+    def port(self):
+        return self._listener.getsockname()[1]
+
+    def local_command(self, command):
+        """Rewrite a command so its /home paths point into the sandbox."""
+        match = IMPORT_COMMAND.match(command)
+        if match:
+            prompt = shlex.split(match.group(1))[0] if match.group(1) else ""
+            return "PROMPT={} DIP={} bash -c {}".format(
+                shlex.quote(prompt),
+                shlex.quote(self.root + match.group(2)),
+                shlex.quote(IMPORT_STUB),
+            )
+        return command.replace("/home/", self.root + "/home/")
+
+    def _run_command(self, channel, command):
+        self.commands.append(command)
+        process = subprocess.Popen(
+            ["bash", "-c", self.local_command(command)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+
+        def pump_stdin():
+            try:
+                for data in iter(lambda: channel.recv(READ_SIZE), b""):
+                    process.stdin.write(data)
+                    process.stdin.flush()
+            except (OSError, EOFError):
+                pass
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+        def pump(source, send):
+            for data in iter(lambda: os.read(source.fileno(), READ_SIZE), b""):
+                send(data)
+
+        threading.Thread(target=pump_stdin, daemon=True).start()
+        stderr_thread = threading.Thread(
+            target=pump, args=(process.stderr, channel.sendall_stderr), daemon=True
+        )
+        stderr_thread.start()
+        try:
+            pump(process.stdout, channel.sendall)
+            stderr_thread.join()
+        except OSError:
+            process.kill()
+        channel.send_exit_status(process.wait())
+        channel.shutdown_write()
+        channel.close()
+
+    def _serve(self, sock):
+        transport = paramiko.Transport(sock)
+        transport.add_server_key(self.host_key)
+        transport.set_subsystem_handler(
+            "sftp", paramiko.SFTPServer, _sftp_interface(self.root)
+        )
+        interface = _Interface(self)
+        transport.start_server(server=interface)
+        # Channels are closed when garbage collected, so keep every one.
+        channels = []
+        while transport.is_active():
+            channel = transport.accept(1)
+            if channel is None:
+                continue
+            channels.append(channel)
+            if channel.get_id() in interface.forwarded:
+                ours, theirs = socket.socketpair()
+                threading.Thread(target=self._serve, args=(ours,), daemon=True).start()
+                threading.Thread(
+                    target=_splice, args=(channel, theirs), daemon=True
+                ).start()
+
+    def start(self):
+        os.makedirs(self.root, exist_ok=True)
+        self._listener = socket.socket()
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(("127.0.0.1", 0))
+        self._listener.listen(16)
+
+        def accept():
+            while True:
+                try:
+                    sock, _ = self._listener.accept()
+                except OSError:
+                    return
+                threading.Thread(target=self._serve, args=(sock,), daemon=True).start()
+
+        threading.Thread(target=accept, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._listener.close()
+
+
+def _splice(channel, sock):
+    """Copy bytes both ways between a forwarded channel and a socket."""
+
+    def to_socket():
+        try:
+            for data in iter(lambda: channel.recv(READ_SIZE), b""):
+                sock.sendall(data)
+            sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+    threading.Thread(target=to_socket, daemon=True).start()
+    try:
+        for data in iter(lambda: sock.recv(READ_SIZE), b""):
+            channel.sendall(data)
+    except OSError:
+        pass
+    channel.close()
@@ -0,0 +1,138 @@
+"""Generate synthetic DIPs shaped like Archivematica's.
+
+A DIP is a directory named "<transfer name>-<AIP UUID>" holding a METS file
+with a PREMIS object per original file, and an objects directory of access
+copies named "<file UUID>-<original name>" plus the filename,slug CSV that
+dip-upload and dip-metadata read. Names, UUIDs and file sizes come from a
+seeded random generator, so the same arguments always give the same DIP
+layout; file contents are random bytes, which compress as badly as the JPEG
+and JP2 access copies of a real DIP.
+"""
+import csv
+import math
+import os
+import random
+import uuid
+from xml.sax.saxutils import escape
+
+WRITE_SIZE = 1024 * 1024
+
+METS_HEADER = """<?xml version='1.0' encoding='UTF-8'?>
+<mets:mets xmlns:mets="http://www.loc.gov/METS/" \
+xmlns:premis="http://www.loc.gov/premis/v3" \
+xmlns:xlink="http://www.w3.org/1999/xlink" \
+xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+<mets:metsHdr CREATEDATE="2020-01-01T00:00:00"/>
+"""
+
+AMDSEC = """<mets:amdSec ID="amdSec_{index}"><mets:techMD ID="techMD_{index}">\
+<mets:mdWrap MDTYPE="PREMIS:OBJECT"><mets:xmlData>\
+<premis:object xsi:type="premis:file" version="3.0">\
+<premis:objectIdentifier><premis:objectIdentifierType>UUID</premis:objectIdentifierType>\
+<premis:objectIdentifierValue>{file_uuid}</premis:objectIdentifierValue></premis:objectIdentifier>\
+<premis:objectCharacteristics><premis:compositionLevel>0</premis:compositionLevel>\
+<premis:size>{size}</premis:size><premis:format><premis:formatDesignation>\
+<premis:formatName>TIFF</premis:formatName><premis:formatVersion>6</premis:formatVersion>\
+</premis:formatDesignation><premis:formatRegistry>\
+<premis:formatRegistryName>PRONOM</premis:formatRegistryName>\
+<premis:formatRegistryKey>fmt/353</premis:formatRegistryKey></premis:formatRegistry>\
+</premis:format></premis:objectCharacteristics>\
+<premis:originalName>%transferDirectory%objects/{name}</premis:originalName>\
+</premis:object></mets:xmlData></mets:mdWrap></mets:techMD></mets:amdSec>
+"""
+
+
+def _uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def object_sizes(objects, mean_kb, sigma, rng):
+    """Draw object sizes from a log-normal distribution.
+
+    :param objects: Number of sizes (int)
+    :param mean_kb: Mean size in KiB (float)
+    :param sigma: Spread of the distribution; 0 makes every size the mean
+    :param rng: random.Random instance
+
+    :returns: List of sizes in bytes
+    """
+    mu = math.log(mean_kb * 1024) - sigma ** 2 / 2
+    return [max(1, int(rng.lognormvariate(mu, sigma))) for _ in range(objects)]
+
+
+def _write_random(path, size):
+    with open(path, "wb") as target:
+        remaining = size
+        while remaining > 0:
+            chunk = min(remaining, WRITE_SIZE)
+            target.write(os.urandom(chunk))
+            remaining -= chunk
+
+
+def make_dip(root, objects, mean_kb=256, sigma=1.0, slugs=1, seed=0, name="transfer"):
+    """Write a synthetic DIP into root.
+
+    :param root: Directory to create the DIP in (str)
+    :param objects: Number of object files (int)
+    :param mean_kb: Mean object size in KiB (float)
+    :param sigma: Spread of the log-normal object size distribution (float)
+    :param slugs: Number of parent descriptions to spread objects over (int)
+    :param seed: Seed for names, UUIDs and sizes (int)
+    :param name: Transfer name (str)
+
+    :returns: Tuple of (DIP path, AIP UUID, total size of object files)
+    """
+    rng = random.Random(seed)
+    aip_uuid = _uuid(rng)
+    dip_path = os.path.join(root, "{}-{}".format(name, aip_uuid))
+    objects_path = os.path.join(dip_path, "objects")
+    os.makedirs(objects_path, exist_ok=True)
+
+    sizes = object_sizes(objects, mean_kb, sigma, rng)
+    rows = []
+    mets_path = os.path.join(dip_path, "METS.{}.xml".format(aip_uuid))
+    with open(mets_path, "w", encoding="utf-8") as mets:
+        mets.write(METS_HEADER)
+        files = []
+        divs = []
+        for index, size in enumerate(sizes):
+            file_uuid = _uuid(rng)
+            original = "file{:06d}.tif".format(index)
+            object_name = "{}-file{:06d}.jpg".format(file_uuid, index)
+            _write_random(os.path.join(objects_path, object_name), size)
+            rows.append([object_name, "parent-{}".format(index % slugs)])
+            mets.write(
+                AMDSEC.format(
+                    index=index, file_uuid=file_uuid, size=size, name=escape(original)
+                )
+            )
+            files.append(
+                '<mets:file GROUPID="Group-{0}" ID="file-{0}" ADMID="amdSec_{1}">'
+                '<mets:FLocat xlink:href="objects/{2}" LOCTYPE="OTHER" '
+                'OTHERLOCTYPE="SYSTEM"/></mets:file>'.format(
+                    file_uuid, index, escape(original)
+                )
+            )
+            divs.append(
+                '<mets:div LABEL="{0}" TYPE="Item"><mets:fptr FILEID="file-{1}"/>'
+                "</mets:div>".format(escape(original), file_uuid)
+            )
+        mets.write('<mets:fileSec><mets:fileGrp USE="original">')
+        mets.write("".join(files))
+        mets.write("</mets:fileGrp></mets:fileSec>\n")
+        mets.write(
+            '<mets:structMap TYPE="physical" ID="structMap_1" '
+            'LABEL="Archivematica default"><mets:div TYPE="Directory" LABEL="{}">'
+            '<mets:div TYPE="Directory" LABEL="objects">'.format(
+                escape(os.path.basename(dip_path))
+            )
+        )
+        mets.write("".join(divs))
+        mets.write("</mets:div></mets:div></mets:structMap>\n</mets:mets>\n")
+
+    with open(os.path.join(objects_path, name + ".csv"), "w", newline="") as csvfile:
+        objects_writer = csv.writer(csvfile)
+        objects_writer.writerow(["filename", "slug"])
+        objects_writer.writerows(rows)
+
+    return dip_path, aip_uuid, sum(sizes)
@@ -0,0 +1,335 @@
+"""Command-line arguments of the dip-mungers commands.
+
+Argument definitions and the checks that need nothing but the arguments
+live here, away from the command modules, so that the dip-mungers command
+can answer --help and report usage errors without importing paramiko,
+requests, lxml or amclient, or reading the config file.
+"""
+import os
+
+DESKTOP_PATH = os.path.expanduser("~/Desktop")
+
+# Default number of DIPs retrieved at once in batch mode.
+DEFAULT_WORKERS = 4
+
+# Default upper bound on concurrent AtoM API requests.
+DEFAULT_MAX_IN_FLIGHT = 8
+
+# Default number of DIPs planned at once with --plan-dir.
+DEFAULT_PLAN_WORKERS = 4
+
+# Default number of SFTP channels used by dip-upload --transfer sftp.
+DEFAULT_SFTP_CHANNELS = 4
+
+# Megabytes sent per transport profile by dip-upload --calibrate.
+DEFAULT_CALIBRATION_SIZE_MB = 64
+
+# Default number of DIP copies allowed on the server at once: one being
+# imported and the next one being copied.
+DEFAULT_MAX_STAGED = 2
+
+
+def _add_metrics_argument(parser):
+    parser.add_argument(
+        "--metrics",
+        help="Write phase timings, byte counts and request latencies to this "
+        "file: Prometheus text format if it ends in .prom, JSON otherwise",
+        metavar="PATH",
+    )
+
+
+def add_retrieve_arguments(parser):
+    """Add the arguments of dip-retrieve to an argparse parser."""
+    parser.add_argument(
+        "--dev",
+        help="Download DIP from development Storage Service",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--stream",
+        help="Extract DIP while it downloads, without writing the tarball to disk",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--metadata-only",
+        help="Fetch only the METS file and write the CSV, skipping object files",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--index",
+        help="Resolve DIPs from a local index of Storage Service DIPs, "
+        "updated with newly stored DIPs before retrieval",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--rebuild-index",
+        help="Re-list every DIP in the Storage Service into the local index",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--no-cache",
+        help="Download DIPs even if they are in the local DIP cache",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--uuid-file",
+        help="File listing AIP UUIDs to retrieve, one per line",
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of DIPs to retrieve at once (default: {})".format(DEFAULT_WORKERS),
+        type=int,
+        default=DEFAULT_WORKERS,
+    )
+    parser.add_argument(
+        "--target-dir",
+        help="Directory to write DIPs to (default: {})".format(DESKTOP_PATH),
+        default=DESKTOP_PATH,
+    )
+    _add_metrics_argument(parser)
+    parser.add_argument("aip_uuid", help="AIP UUID", nargs="*")
+
+
+def check_retrieve_arguments(parser, args):
+    """Exit with a usage error if parsed dip-retrieve arguments conflict."""
+    if not args.aip_uuid and not args.uuid_file:
+        parser.error("at least one AIP UUID or --uuid-file is required")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+
+def add_metadata_arguments(parser):
+    """Add the arguments of dip-metadata to an argparse parser."""
+    parser.add_argument(
+        "--dev",
+        help="Upload DIP metadata to development AtoM",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        help="Maximum number of concurrent AtoM API requests (default: {})".format(
+            DEFAULT_MAX_IN_FLIGHT
+        ),
+        type=int,
+        default=DEFAULT_MAX_IN_FLIGHT,
+    )
+    parser.add_argument(
+        "--mets-parser",
+        help="METS reader: a low-memory streaming index (default) or metsrw",
+        choices=("stream", "metsrw"),
+        default="stream",
+    )
+    parser.add_argument(
+        "--no-mets-cache",
+        help="Parse the METS file even if its index is cached",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--no-journal",
+        help="Upload every row, ignoring and not updating the upload journal",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--reconcile",
+        help="Before uploading, hold back rows whose filename matches a child "
+        "AtoM already has, reporting them as possibly uploaded",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--results",
+        help="Write per-file upload results to this JSON file",
+    )
+    parser.add_argument(
+        "--plan-dir",
+        help="Only write an upload plan for each DIP to this directory, "
+        "without contacting AtoM",
+    )
+    parser.add_argument(
+        "--plan-workers",
+        help="Number of DIPs planned at once with --plan-dir (default: {})".format(
+            DEFAULT_PLAN_WORKERS
+        ),
+        type=int,
+        default=DEFAULT_PLAN_WORKERS,
+    )
+    parser.add_argument(
+        "--apply",
+        help="Upload from previously written plan files instead of DIPs",
+        nargs="+",
+        metavar="PLAN",
+        default=[],
+    )
+    _add_metrics_argument(parser)
+    parser.add_argument("dip_path", help="Path to local DIP", nargs="*")
+
+
+def check_metadata_arguments(parser, args):
+    """Exit with a usage error if parsed dip-metadata arguments conflict."""
+    if args.max_in_flight < 1:
+        parser.error("--max-in-flight must be at least 1")
+    if args.plan_workers < 1:
+        parser.error("--plan-workers must be at least 1")
+    if args.apply and (args.dip_path or args.plan_dir):
+        parser.error("--apply cannot be combined with DIP paths or --plan-dir")
+    if not args.apply and not args.dip_path:
+        parser.error("at least one DIP path or --apply plan is required")
+
+
+def add_upload_arguments(parser):
+    """Add the arguments of dip-upload to an argparse parser."""
+    parser.add_argument(
+        "--dev",
+        help="Upload DIP to development AtoM",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--nginx",
+        help="Use nginx AtoM user for upload (requires ssh key on jump server)",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--transfer",
+        help="How to copy the DIP: recursive scp (default), one tar stream, "
+        "or parallel SFTP channels",
+        choices=("scp", "tar", "sftp"),
+        default="scp",
+    )
+    parser.add_argument(
+        "--channels",
+        help="With --transfer sftp, number of SFTP channels to use (default: {})".format(
+            DEFAULT_SFTP_CHANNELS
+        ),
+        type=int,
+        default=DEFAULT_SFTP_CHANNELS,
+    )
+    parser.add_argument(
+        "--compress",
+        help="With --transfer tar, gzip files that are not already compressed",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--delta",
+        help="With --transfer tar or sftp, only send files that are missing or "
+        "changed in the remote copy left by an earlier run",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--profile",
+        help="SSH transport profile to use (default: [TRANSPORT] PROFILE "
+        "in the config file)",
+    )
+    parser.add_argument(
+        "--calibrate",
+        help="Time an upload through the jump host with each transport profile "
+        "and save the fastest as the default, instead of uploading a DIP",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--calibrate-size",
+        help="Megabytes to send per profile with --calibrate (default: {})".format(
+            DEFAULT_CALIBRATION_SIZE_MB
+        ),
+        type=int,
+        default=DEFAULT_CALIBRATION_SIZE_MB,
+    )
+    parser.add_argument(
+        "--start-agent",
+        help="Log in once and keep the session open in a background agent "
+        "that later dip-upload runs use",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--stop-agent",
+        help="Stop the background session agent",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--no-agent",
+        help="Connect directly even if a session agent is running",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--max-staged",
+        help="With several DIPs, maximum number of DIP copies on the server at "
+        "once, including the one being imported (default: {})".format(
+            DEFAULT_MAX_STAGED
+        ),
+        type=int,
+        default=DEFAULT_MAX_STAGED,
+    )
+    parser.add_argument(
+        "--shards",
+        help="Split each DIP's import into this many AtoM import processes "
+        "run at once (default: 1)",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--pull",
+        help="Have the AtoM server download each DIP from the Storage Service "
+        "itself, sending only the local DIP's CSV",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--import-log",
+        help="Write per-object import timings to this file as JSON Lines",
+        metavar="PATH",
+    )
+    _add_metrics_argument(parser)
+    parser.add_argument("dip_path", help="Paths to local DIPs", nargs="*")
+
+
+def check_upload_arguments(parser, args):
+    """Exit with a usage error if parsed dip-upload arguments conflict."""
+    if args.compress and args.transfer != "tar":
+        parser.error("--compress requires --transfer tar")
+    if args.channels < 1:
+        parser.error("--channels must be at least 1")
+    if args.delta and args.transfer == "scp":
+        parser.error("--delta requires --transfer tar or sftp")
+    if args.pull and (args.delta or args.compress):
+        parser.error("--pull cannot be combined with --delta or --compress")
+    if not (args.calibrate or args.start_agent or args.stop_agent or args.dip_path):
+        parser.error("a DIP path is required")
+    if args.max_staged < 1:
+        parser.error("--max-staged must be at least 1")
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+    if len(set(os.path.basename(os.path.abspath(p)) for p in args.dip_path)) != len(
+        args.dip_path
+    ):
+        parser.error("DIP directories must have different names")
+    if args.calibrate_size < 1:
+        parser.error("--calibrate-size must be at least 1")
+
+
+def add_pipeline_arguments(parser):
+    """Add the arguments of dip-pipeline to an argparse parser."""
+    parser.add_argument(
+        "--dev",
+        help="Use the development Storage Service and AtoM server",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--nginx",
+        help="Use nginx user for upload, requires SSH keys to be configured",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--slug",
+        help="Slug of the AtoM description to attach every object to",
+        required=True,
+    )
+    parser.add_argument(
+        "--profile",
+        help="SSH transport profile to use instead of the configured one",
+    )
+    parser.add_argument(
+        "--no-agent",
+        help="Connect directly even if a session agent is running",
+        action="store_true",
+    )
+    _add_metrics_argument(parser)
+    parser.add_argument("aip_uuid", help="AIP UUID")
+    # dip_upload.import_dip reads this; a relayed DIP is imported in one go.
+    parser.set_defaults(shards=1)
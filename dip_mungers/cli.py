@@ -0,0 +1,82 @@
+"""The dip-mungers command, running each tool as a subcommand.
+
+Only argparse and the argument definitions are imported up front, so help
+and usage errors come back straight away. The subcommand's module, with its
+network and SSH libraries, is imported once the arguments are known to be
+usable, and it reads just the config file sections it needs.
+"""
+import argparse
+import importlib
+
+from dip_mungers import arguments
+
+# Subcommand name, module running it, functions adding and checking its
+# arguments, and help.
+COMMANDS = (
+    (
+        "retrieve",
+        "dip_retrieve",
+        arguments.add_retrieve_arguments,
+        arguments.check_retrieve_arguments,
+        "Download DIPs from the Storage Service",
+    ),
+    (
+        "metadata",
+        "dip_metadata",
+        arguments.add_metadata_arguments,
+        arguments.check_metadata_arguments,
+        "Upload DIP object metadata to AtoM",
+    ),
+    (
+        "upload",
+        "dip_upload",
+        arguments.add_upload_arguments,
+        arguments.check_upload_arguments,
+        "Copy DIPs to the AtoM server and import them",
+    ),
+    (
+        "pipeline",
+        "dip_pipeline",
+        arguments.add_pipeline_arguments,
+        None,
+        "Relay a DIP from the Storage Service to AtoM and import it",
+    ),
+)
+
+
+def _make_parser():
+    """Return the dip-mungers parser, and each subcommand's parser and
+    argument check by name."""
+    parser = argparse.ArgumentParser(
+        prog="dip-mungers",
+        description="Move Archivematica DIPs from the Storage Service into AtoM",
+    )
+    # Not add_subparsers(required=True), which needs Python 3.7.
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND")
+    subparsers.required = True
+    commands = {}
+    for name, module, add_arguments, check_arguments, help_text in COMMANDS:
+        subparser = subparsers.add_parser(name, help=help_text, description=help_text)
+        add_arguments(subparser)
+        subparser.set_defaults(module=module)
+        commands[name] = (subparser, check_arguments)
+    return parser, commands
+
+
+def main(argv=None):
+    """Run a dip-mungers subcommand.
+
+    :param argv: Arguments after the program name, or None for sys.argv (list)
+    """
+    parser, commands = _make_parser()
+    args = parser.parse_args(argv)
+    subparser, check_arguments = commands[args.command]
+    # Before the import, so usage errors come back as fast as --help.
+    if check_arguments is not None:
+        check_arguments(subparser, args)
+    module = importlib.import_module("dip_mungers.{}".format(args.module))
+    module.run(subparser, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Shared, lazy reading of the ~/.dip-mungers config file.
+
+The file is parsed the first time a command asks for it, after its
+arguments have been parsed, and at most once per process however many
+command modules read it. Each command checks only the sections it uses, so
+a config file written for dip-retrieve alone still works for dip-retrieve.
+"""
+import configparser
+import os
+
+USER_DIRECTORY = os.path.expanduser("~")
+CONFIG_FILE = os.path.join(USER_DIRECTORY, ".dip-mungers")
+
+
+class ConfigParsingError(Exception):
+    pass
+
+
+_config = None
+
+
+def read_config():
+    """Parse the config file, or return the already parsed one.
+
+    :returns: configparser.ConfigParser
+
+    :raises FileNotFoundError: If there is no config file
+    """
+    global _config
+    if _config is None:
+        if not os.path.exists(CONFIG_FILE):
+            error_msg = "DIP Mungers configuration file expected but not found at {}".format(
+                CONFIG_FILE
+            )
+            raise FileNotFoundError(error_msg)
+        config = configparser.ConfigParser()
+        config.read(CONFIG_FILE)
+        _config = config
+    return _config
+
+
+def require(section, *keys):
+    """Read required settings from one section.
+
+    :param section: Section name (str)
+    :param keys: Names of the settings (str)
+
+    :returns: List of values, in the order of keys
+
+    :raises ConfigParsingError: If the section or a setting is missing
+    """
+    config = read_config()
+    try:
+        return [config[section][key] for key in keys]
+    except KeyError as err:
+        error_msg = "Config file at {} missing expected field: {}".format(CONFIG_FILE, err)
+        raise ConfigParsingError(error_msg)
+
+
+def invalid_setting(kind, err):
+    """Build the error for a setting that cannot be used.
+
+    :param kind: What sort of setting it is, e.g. "cache" (str)
+    :param err: Exception raised while reading it
+
+    :returns: ConfigParsingError
+    """
+    return ConfigParsingError(
+        "Config file at {} has invalid {} setting: {}".format(CONFIG_FILE, kind, err)
+    )
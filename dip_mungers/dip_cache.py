@@ -0,0 +1,229 @@
+"""Local content-addressed cache of extracted DIPs.
+
+Each cached DIP is recorded as a list of relative paths pointing at blobs
+named by the SHA-256 of their content, so object files shared between DIPs
+are stored once. Files are copied into the cache, never linked, so the DIP
+they came from stays the user's to edit. Blobs are made read-only and
+hardlinked out into working directories where the filesystem allows it, and
+copied otherwise, so edits in a working directory cannot corrupt the cache. Entries are evicted least
+recently used first to keep the blobs under a disk budget.
+"""
+import hashlib
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+
+INDEX_FILENAME = "index.sqlite"
+BLOBS_DIRECTORY = "blobs"
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Seconds to wait for another process holding the index lock.
+INDEX_TIMEOUT = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    dip_uuid TEXT NOT NULL,
+    checksum TEXT NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entry_files (
+    key TEXT NOT NULL,
+    path TEXT NOT NULL,
+    digest TEXT,
+    PRIMARY KEY (key, path)
+);
+CREATE INDEX IF NOT EXISTS entry_files_digest ON entry_files (digest);
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL
+);
+"""
+
+
+def _hash_file(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _link_or_copy(source, destination):
+    """Hardlink source to destination, copying if linking is not possible."""
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+class DIPCache:
+    """Size-bounded cache of extracted DIPs keyed by DIP UUID and checksum."""
+
+    def __init__(self, directory, max_size):
+        """
+        :param directory: Cache directory, created if missing (str)
+        :param max_size: Disk budget for cached files, in bytes (int)
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.blobs_directory = os.path.join(directory, BLOBS_DIRECTORY)
+        os.makedirs(self.blobs_directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """Open the index for one transaction, closing it afterwards."""
+        conn = sqlite3.connect(
+            os.path.join(self.directory, INDEX_FILENAME), timeout=INDEX_TIMEOUT
+        )
+        # The connection's own context manager commits or rolls back but
+        # leaves it open.
+        with closing(conn), conn:
+            yield conn
+
+    @staticmethod
+    def _key(dip_uuid, checksum):
+        return "{}:{}".format(dip_uuid, checksum or "")
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blobs_directory, digest[:2], digest)
+
+    def checkout(self, dip_uuid, checksum, destination):
+        """Recreate a cached DIP tree at destination.
+
+        :param dip_uuid: DIP UUID (str)
+        :param checksum: DIP package checksum, or None if unknown (str)
+        :param destination: Path to create the DIP at (str)
+
+        :returns: True on a cache hit, False on a miss (bool)
+        """
+        key = self._key(dip_uuid, checksum)
+        with self._connect() as conn:
+            files = conn.execute(
+                "SELECT path, digest FROM entry_files WHERE key = ? ORDER BY path",
+                (key,),
+            ).fetchall()
+            if not files:
+                return False
+            conn.execute(
+                "UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+
+        for path, digest in files:
+            target = os.path.join(destination, path)
+            if digest is None:
+                os.makedirs(target, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                _link_or_copy(self._blob_path(digest), target)
+            except FileNotFoundError:
+                # Evicted by a concurrent run while we were linking.
+                return False
+
+        return True
+
+    def store(self, dip_uuid, checksum, source):
+        """Add an extracted DIP tree to the cache, then evict to fit.
+
+        :param dip_uuid: DIP UUID (str)
+        :param checksum: DIP package checksum, or None if unknown (str)
+        :param source: Path to the extracted DIP (str)
+
+        :returns: True if the DIP was cached (bool)
+        """
+        files = []
+        total_size = 0
+        for dirpath, dirnames, filenames in os.walk(source):
+            for name in dirnames:
+                files.append((os.path.join(dirpath, name), None))
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                files.append((path, os.path.getsize(path)))
+                total_size += files[-1][1]
+
+        if total_size > self.max_size:
+            print(
+                "Warning: DIP {} is larger than the cache budget; not caching".format(
+                    dip_uuid
+                )
+            )
+            return False
+
+        rows = []
+        blobs = []
+        for path, size in files:
+            relative_path = os.path.relpath(path, source)
+            if size is None:
+                rows.append((relative_path, None))
+                continue
+            digest = _hash_file(path)
+            blob_path = self._blob_path(digest)
+            if not os.path.exists(blob_path):
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                temp_path = "{}.{}.tmp".format(blob_path, os.getpid())
+                # A copy, since a link would share, and chmod, the user's file.
+                shutil.copyfile(path, temp_path)
+                os.chmod(temp_path, 0o444)
+                os.replace(temp_path, blob_path)
+            rows.append((relative_path, digest))
+            blobs.append((digest, size))
+
+        key = self._key(dip_uuid, checksum)
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entry_files WHERE key = ?", (key,))
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, dip_uuid, checksum, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                (key, dip_uuid, checksum or "", time.time()),
+            )
+            conn.executemany(
+                "INSERT INTO entry_files (key, path, digest) VALUES (?, ?, ?)",
+                [(key, path, digest) for path, digest in rows],
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO blobs (digest, size) VALUES (?, ?)", blobs
+            )
+
+        self.evict(keep=key)
+        return True
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until blobs fit the budget.
+
+        :param keep: Entry key never to evict, e.g. the one just stored (str)
+        """
+        with self._connect() as conn:
+            while True:
+                (used,) = conn.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM blobs"
+                ).fetchone()
+                if used <= self.max_size:
+                    break
+                oldest = conn.execute(
+                    "SELECT key FROM entries WHERE key != ? "
+                    "ORDER BY last_used LIMIT 1",
+                    (keep or "",),
+                ).fetchone()
+                if oldest is None:
+                    break
+                conn.execute("DELETE FROM entry_files WHERE key = ?", oldest)
+                conn.execute("DELETE FROM entries WHERE key = ?", oldest)
+
+                orphans = conn.execute(
+                    "SELECT digest FROM blobs WHERE digest NOT IN "
+                    "(SELECT digest FROM entry_files WHERE digest IS NOT NULL)"
+                ).fetchall()
+                for (digest,) in orphans:
+                    try:
+                        os.remove(self._blob_path(digest))
+                    except FileNotFoundError:
+                        pass
+                conn.executemany("DELETE FROM blobs WHERE digest = ?", orphans)
@@ -0,0 +1,143 @@
+"""Local SQLite index of Storage Service DIPs by AIP UUID.
+
+AMClient.aip2dips pages through every DIP in the Storage Service on each
+call. The index is built from one paged listing instead and then refreshed
+with only the DIPs stored since the last refresh, so resolving many AIPs is
+a local lookup.
+"""
+import json
+import os
+import sqlite3
+from contextlib import closing, contextmanager
+
+import requests
+
+from dip_mungers import storage_service
+
+# Length of the AIP UUID that ends each DIP's current_path.
+UUID_LENGTH = 36
+
+# Seconds to wait for another process holding the index lock.
+INDEX_TIMEOUT = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dips (
+    uuid TEXT PRIMARY KEY,
+    aip_uuid TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stored_date TEXT,
+    package TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dips_aip_uuid ON dips (aip_uuid);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class DIPIndex:
+    """Mapping of AIP UUIDs to the DIPs the Storage Service holds for them."""
+
+    def __init__(self, path):
+        """
+        :param path: Path to the SQLite index file, created if missing (str)
+        """
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """Open the index for one transaction, closing it afterwards."""
+        conn = sqlite3.connect(self.path, timeout=INDEX_TIMEOUT)
+        # The connection's own context manager commits or rolls back but
+        # leaves it open.
+        with closing(conn), conn:
+            yield conn
+
+    def _last_seen(self, conn):
+        row = conn.execute(
+            "SELECT value FROM state WHERE key = 'last_stored_date'"
+        ).fetchone()
+        return row[0] if row else None
+
+    def refresh(self, amclient, full=False):
+        """Update the index from the Storage Service package listing.
+
+        Incremental refreshes only request DIPs stored since the newest one
+        already indexed. Status changes to older DIPs (e.g. deletions) are
+        only picked up by a full refresh.
+
+        :param amclient: AMClient object instance
+        :param full: Re-list every DIP rather than only new ones (bool)
+
+        :returns: Number of DIPs added or updated (int)
+
+        :raises requests.RequestException: If the listing cannot be fetched
+        """
+        with self._connect() as conn:
+            last_seen = None if full else self._last_seen(conn)
+
+        params = {"package_type": "DIP"}
+        if last_seen:
+            params["stored_date__gte"] = last_seen
+        try:
+            count = self._load(amclient, params, last_seen)
+        except requests.HTTPError as err:
+            if not last_seen or err.response.status_code != 400:
+                raise
+            # Storage Service releases that cannot filter on stored_date.
+            count = self._load(amclient, {"package_type": "DIP"}, None)
+        return count
+
+    def _load(self, amclient, params, last_seen):
+        rows = []
+        newest = last_seen
+        for package in storage_service.iter_packages(amclient, params):
+            stored_date = package.get("stored_date")
+            # Skip unchanged DIPs if the server ignored the date filter.
+            if last_seen and stored_date and stored_date < last_seen:
+                continue
+            rows.append(
+                (
+                    package["uuid"],
+                    package["current_path"].rstrip("/")[-UUID_LENGTH:],
+                    package["status"],
+                    stored_date,
+                    json.dumps(package),
+                )
+            )
+            if stored_date and (newest is None or stored_date > newest):
+                newest = stored_date
+
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO dips "
+                "(uuid, aip_uuid, status, stored_date, package) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            if newest:
+                conn.execute(
+                    "INSERT OR REPLACE INTO state (key, value) "
+                    "VALUES ('last_stored_date', ?)",
+                    (newest,),
+                )
+        return len(rows)
+
+    def aip2dips(self, aip_uuid):
+        """Return the indexed DIPs for an AIP, oldest first.
+
+        :param aip_uuid: AIP UUID (str)
+
+        :returns: List of DIP dictionaries, as from AMClient.aip2dips
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT package FROM dips WHERE aip_uuid = ? "
+                "ORDER BY stored_date, uuid",
+                (aip_uuid,),
+            ).fetchall()
+        return [json.loads(package) for (package,) in rows]
@@ -1,50 +1,97 @@
 import argparse
-import configparser
+import concurrent.futures
 import csv
 import glob
-import lxml
-import metsrw
+import json
+import lxml.etree
 import os
 import re
+import sys
+from urllib.parse import quote, urljoin
 
-from agentarchives import atom
+import requests
 
+from dip_mungers import arguments, http_session, mets_index, metrics, upload_engine
+from dip_mungers.config import invalid_setting, read_config, require
+from dip_mungers.mets_cache import METSCache, hash_file
+from dip_mungers.upload_journal import UploadJournal
 
-class ConfigParsingError(Exception):
+
+class PlanError(Exception):
     pass
 
 
 UUID4_PREFIX_LENGTH = 33
 
-USER_DIRECTORY = os.path.expanduser("~")
-CONFIG_FILE = os.path.join(USER_DIRECTORY, ".dip-mungers")
+# Status codes that mean AtoM is overloaded or unavailable and created
+# nothing. After other errors, e.g. a 502 from a proxy that gave up waiting,
+# the object may exist, so retrying could create a duplicate.
+RETRYABLE_STATUS_CODES = (429, 503)
+
+# Result status for rows the upload journal or AtoM already has.
+ALREADY_UPLOADED = "already uploaded"
+
+# Result status for rows --reconcile held back because their parent already
+# has a child description with the same title.
+POSSIBLY_UPLOADED = "possibly uploaded"
+
+# Version of the upload plan file format.
+PLAN_VERSION = 1
+
+# Default size cap for the METS index cache, in megabytes.
+DEFAULT_METS_CACHE_MAX_SIZE_MB = 500
 
-config = configparser.ConfigParser()
-config.read(CONFIG_FILE)
+PREMIS_PROPERTIES = (
+    "size",
+    "format_name",
+    "format_version",
+    "format_registry_name",
+    "format_registry_key",
+)
 
-if not os.path.exists(CONFIG_FILE):
-    error_msg = "DIP Mungers configuration file expected but not found at {}".format(CONFIG_FILE)
-    raise FileNotFoundError(error_msg)
+# Settings from the config file, set by load_config.
+config = None
+ATOM_URL_DEV = None
+ATOM_API_KEY_DEV = None
+ATOM_URL_PROD = None
+ATOM_API_KEY_PROD = None
+METS_CACHE_DIRECTORY = None
+JOURNAL_DIRECTORY = None
+METS_CACHE_MAX_SIZE_MB = None
 
-try:
-    ATOM_URL_DEV = config["ATOM"]["DEV_URL"]
-    ATOM_API_KEY_DEV = config["ATOM"]["DEV_API_KEY"]
-    ATOM_URL_PROD = config["ATOM"]["PROD_URL"]
-    ATOM_API_KEY_PROD = config["ATOM"]["PROD_API_KEY"]
-except KeyError as err:
-    error_msg = "Config file at {} missing expected field: {}".format(CONFIG_FILE, err)
-    raise ConfigParsingError(error_msg)
+
+def load_config(uploading=True):
+    """Read the [CACHE] settings and, unless told not to, the [ATOM] ones.
+
+    :param uploading: Whether AtoM will be contacted, needing [ATOM] (bool)
+
+    :raises FileNotFoundError: If there is no config file
+    :raises ConfigParsingError: If a setting is missing or invalid
+    """
+    global config, ATOM_URL_DEV, ATOM_API_KEY_DEV, ATOM_URL_PROD, ATOM_API_KEY_PROD
+    global METS_CACHE_DIRECTORY, JOURNAL_DIRECTORY, METS_CACHE_MAX_SIZE_MB
+    config = read_config()
+    if uploading:
+        ATOM_URL_DEV, ATOM_API_KEY_DEV, ATOM_URL_PROD, ATOM_API_KEY_PROD = require(
+            "ATOM", "DEV_URL", "DEV_API_KEY", "PROD_URL", "PROD_API_KEY"
+        )
+    try:
+        METS_CACHE_DIRECTORY = os.path.expanduser(
+            config.get("CACHE", "METS_DIRECTORY", fallback="~/.cache/dip-mungers/mets")
+        )
+        JOURNAL_DIRECTORY = os.path.expanduser(
+            config.get("CACHE", "JOURNAL_DIRECTORY", fallback="~/.cache/dip-mungers/journals")
+        )
+        METS_CACHE_MAX_SIZE_MB = config.getfloat(
+            "CACHE", "METS_MAX_SIZE_MB", fallback=DEFAULT_METS_CACHE_MAX_SIZE_MB
+        )
+    except ValueError as err:
+        raise invalid_setting("cache", err)
 
 
 def _make_parser():
     parser = argparse.ArgumentParser()
-    parser.add_argument(
-        "--dev",
-        help="Upload DIP metadata to development AtoM",
-        action="store_true",
-    )
-    parser.add_argument("dip_path", help="Path to local DIP")
-
+    arguments.add_metadata_arguments(parser)
     return parser
 
 
@@ -57,22 +104,162 @@ def uuid_from_filename(filename):
     return None
 
 
-def main():
-    parser = _make_parser()
-    args = parser.parse_args()
+def premis_properties(fs_entry):
+    """Extract the PREMIS properties AtoM accepts for a METS file entry.
 
-    atom_url = ATOM_URL_PROD
-    api_token = ATOM_API_KEY_PROD
-    if args.dev:
-        atom_url = ATOM_URL_DEV
-        api_token = ATOM_API_KEY_DEV
+    :param fs_entry: metsrw.FSEntry object
 
-    local_dip_path = os.path.abspath(args.dip_path)
-    dip_names = []
+    :returns: Properties dictionary, or None if the entry has no PREMIS object
+    """
+    try:
+        premis_object = fs_entry.get_premis_objects()[0]
+    except IndexError:
+        return None
+
+    data = {}
+    for prop in PREMIS_PROPERTIES:
+        try:
+            val = getattr(premis_object, prop)
+        except AttributeError:
+            continue
+        # Calling `getattr` to find an attribute deeper in the `premis_object`
+        # structure returns a non JSON serializable tuple instead of a None
+        # value. See Issues#743 for more information.
+        if not val or isinstance(val, tuple):
+            continue
+        data[prop] = val
+    return data
+
+
+def read_file_records(metspath, mets_parser="stream"):
+    """Index the files of a METS document by UUID.
+
+    :param metspath: Path to METS file (str)
+    :param mets_parser: "stream" for mets_index, or "metsrw" (str)
+
+    :returns: Dictionary of file UUID to mets_index.FileRecord
+
+    :raises lxml.etree.Error: If the METS file cannot be parsed
+    """
+    if mets_parser == "stream":
+        return mets_index.read_index(metspath)
+
+    import metsrw
+
+    mets = metsrw.METSDocument.fromfile(metspath)
+    records = {}
+    for fs_entry in mets.all_files():
+        if not fs_entry.file_uuid:
+            continue
+        data = premis_properties(fs_entry)
+        if data is None:
+            continue
+        records[fs_entry.file_uuid] = mets_index.FileRecord(
+            fs_entry.file_uuid, fs_entry.label, **data
+        )
+    return records
+
+
+def load_file_records(metspath, mets_parser="stream", cache=None):
+    """Index the files of a METS document, going through a METSCache.
+
+    :param metspath: Path to METS file (str)
+    :param mets_parser: "stream" for mets_index, or "metsrw" (str)
+    :param cache: METSCache to read and update, or None (METSCache)
+
+    :returns: Dictionary of file UUID to mets_index.FileRecord
+
+    :raises lxml.etree.Error: If the METS file cannot be parsed
+    """
+    if cache is None:
+        return read_file_records(metspath, mets_parser)
+
+    digest = hash_file(metspath)
+    records = cache.load(digest, mets_parser)
+    if records is not None:
+        print("Using cached index of METS file {}".format(metspath))
+        return records
+
+    records = read_file_records(metspath, mets_parser)
+    try:
+        cache.store(digest, mets_parser, records)
+    except OSError as err:
+        print("Warning: Unable to cache METS index: {}".format(err))
+    return records
+
+
+def child_titles(client, slug):
+    """Return the titles of the descriptions directly below a description.
+
+    Digital objects added by dip-metadata become child descriptions titled
+    with the file's name, so this lists what a parent already has in a single
+    request.
+
+    :param client: AtomClient object instance
+    :param slug: Parent description slug (str)
+
+    :returns: Set of titles
+    """
+    url = urljoin(client.base_url, "informationobjects/tree/{}".format(quote(slug)))
+    with metrics.timed("child_titles"):
+        tree = client._get(url).json()
+    return {child.get("title") for child in tree.get("children") or []}
+
+
+def reconcile(client, uploads):
+    """Hold back uploads whose file may already be under its parent in AtoM.
 
-    # Gather DIP object metadata from CSV file.
-    csvpath = glob.glob(local_dip_path + "/objects/*.csv")[0]
-    with open(csvpath, "r") as csvfile:
+    AtoM's description tree only gives each child's title, which is the
+    file's name, and different files can share a name. A match is therefore
+    not proof that the file was uploaded: matching uploads are neither sent
+    nor recorded in the upload journal, but reported as POSSIBLY_UPLOADED
+    for someone to check.
+
+    :param client: AtomClient object instance
+    :param uploads: Upload dictionaries (list)
+
+    :returns: Uploads still to send (list)
+    """
+    from agentarchives import atom
+    from agentarchives.atom.client import CommunicationError
+
+    titles = {}
+    for slug in {upload["slug"] for upload in uploads}:
+        try:
+            titles[slug] = child_titles(client, slug)
+        except (CommunicationError, atom.AtomError, requests.RequestException) as err:
+            print("Warning: Unable to list existing objects for {}: {}".format(slug, err))
+            titles[slug] = set()
+
+    remaining = []
+    for upload in uploads:
+        if upload["payload"]["title"] not in titles[upload["slug"]]:
+            remaining.append(upload)
+            continue
+        upload["result"].update(
+            status=POSSIBLY_UPLOADED,
+            error="A description titled {} already exists under {}".format(
+                upload["payload"]["title"], upload["slug"]
+            ),
+        )
+    return remaining
+
+
+def read_csv_rows(local_dip_path):
+    """Read the filename and slug columns of a DIP's objects CSV file.
+
+    :param local_dip_path: Path to local DIP (str)
+
+    :returns: List of dictionaries with "filename" and "slug" keys
+
+    :raises PlanError: If the DIP has no CSV file
+    """
+    csvpaths = glob.glob(local_dip_path + "/objects/*.csv")
+    if not csvpaths:
+        raise PlanError("No CSV file found in {}/objects".format(local_dip_path))
+
+    dip_names = []
+    with open(csvpaths[0], "r") as csvfile:
         csvreader = csv.DictReader(csvfile)
         for row in csvreader:
             new_row = {}
@@ -82,68 +269,352 @@ def main():
                 if "slug" in key:
                     new_row["slug"] = value
             dip_names.append(new_row)
+    return dip_names
+
+
+def plan_dip(local_dip_path, mets_parser="stream", mets_cache=None):
+    """Resolve a DIP into add_digital_object payloads without any network use.
+
+    Every CSV row becomes one plan row. Rows that can be uploaded carry the
+    complete keyword arguments for AtomClient.add_digital_object under
+    "payload"; rows that cannot carry the reason under "error" instead.
 
-    # Parse METS file.
-    metspath = glob.glob(local_dip_path + "/METS*.xml")[0]
+    :param local_dip_path: Path to local DIP (str)
+    :param mets_parser: "stream" for mets_index, or "metsrw" (str)
+    :param mets_cache: METSCache to read and update, or None (METSCache)
+
+    :returns: Tuple of (plan header dictionary, list of plan rows)
+
+    :raises PlanError: If the CSV or METS file is missing or unreadable
+    """
+    dip_names = read_csv_rows(local_dip_path)
+
+    metspaths = glob.glob(local_dip_path + "/METS*.xml")
+    if not metspaths:
+        raise PlanError("No METS file found in {}".format(local_dip_path))
+    metspath = metspaths[0]
     try:
-        mets = metsrw.METSDocument.fromfile(metspath)
+        with metrics.span("mets_parse"):
+            file_records = load_file_records(metspath, mets_parser, mets_cache)
     except (AttributeError, lxml.etree.Error) as err:
-        print("Unable to parse METS file {}: {}".format(metspath, err))
-
-    client = atom.AtomClient(atom_url, api_token, 443)
+        raise PlanError("Unable to parse METS file {}: {}".format(metspath, err))
 
-    # Upload file metadata.
+    rows = []
     for dip_name in dip_names:
-        file_uuid = uuid_from_filename(dip_name["filename"])
-        if not file_uuid:
+        row = {
+            "filename": dip_name.get("filename", ""),
+            "slug": dip_name.get("slug") or "",
+            "file_uuid": uuid_from_filename(dip_name.get("filename", "")),
+            "payload": None,
+            "error": None,
+        }
+        rows.append(row)
+        if not row["file_uuid"]:
+            row["error"] = "No file UUID in filename"
+            continue
+        if not row["slug"]:
+            row["error"] = "No slug in CSV"
             continue
 
-        fs_entry = mets.get_file(file_uuid=file_uuid)
-        if not fs_entry:
+        record = file_records.get(row["file_uuid"])
+        if record is None:
+            row["error"] = "File with PREMIS object not found in METS"
             continue
 
-        filename = fs_entry.label
-        data = {"filename": filename}
+        payload = {
+            "information_object_slug": row["slug"],
+            "title": record.label,
+            "usage": "Offline",
+            "file_uuid": row["file_uuid"],
+        }
+        payload.update(record.properties())
+        row["payload"] = payload
 
-        try:
-            premis_object = fs_entry.get_premis_objects()[0]
-        except IndexError:
-            continue
+    header = {
+        "plan_version": PLAN_VERSION,
+        "dip": os.path.basename(local_dip_path),
+        "dip_path": local_dip_path,
+    }
+    return header, rows
+
+
+def write_plan(plan_path, header, rows):
+    """Write an upload plan as JSON lines, header first.
+
+    :param plan_path: Path to plan file (str)
+    :param header: Plan header dictionary
+    :param rows: Plan rows (list)
+    """
+    temp_path = plan_path + ".tmp"
+    with open(temp_path, "w") as plan_file:
+        for line in [header] + rows:
+            plan_file.write(json.dumps(line, sort_keys=True))
+            plan_file.write("\n")
+    os.replace(temp_path, plan_path)
+
+
+def read_plan(plan_path):
+    """Open an upload plan written by write_plan.
+
+    :param plan_path: Path to plan file (str)
+
+    :returns: Tuple of (plan header dictionary, generator of plan rows)
+
+    :raises PlanError: If the file is not a plan this version can apply
+    """
+    plan_file = open(plan_path, "r")
+    try:
+        header = json.loads(plan_file.readline() or "{}")
+    except ValueError as err:
+        plan_file.close()
+        raise PlanError("Unable to read plan {}: {}".format(plan_path, err))
+    if header.get("plan_version") != PLAN_VERSION:
+        plan_file.close()
+        raise PlanError("{} is not a version {} upload plan".format(plan_path, PLAN_VERSION))
+
+    def _rows():
+        with plan_file:
+            for line in plan_file:
+                if line.strip():
+                    yield json.loads(line)
 
-        props = (
-            "size",
-            "format_name",
-            "format_version",
-            "format_registry_name",
-            "format_registry_key",
+    return header, _rows()
+
+
+def _plan_to_file(local_dip_path, plan_dir, mets_parser, mets_cache):
+    header, rows = plan_dip(local_dip_path, mets_parser, mets_cache)
+    plan_path = os.path.join(plan_dir, header["dip"] + ".jsonl")
+    write_plan(plan_path, header, rows)
+    return plan_path, sum(1 for row in rows if row["error"])
+
+
+def upload_digital_object(client, upload, journal=None):
+    """Create one digital object in AtoM.
+
+    :param client: AtomClient object instance
+    :param upload: Plan row with a "payload"
+    :param journal: UploadJournal to record the upload in, or None
+
+    :raises upload_engine.RetryableError: If AtoM is overloaded or couldn't
+        be connected to, so the object certainly wasn't created
+    """
+    from agentarchives.atom.client import CommunicationError
+
+    try:
+        with metrics.timed("add_digital_object"):
+            client.add_digital_object(**upload["payload"])
+    except CommunicationError as err:
+        response = getattr(err, "response", None)
+        if response is not None and response.status_code in RETRYABLE_STATUS_CODES:
+            retry_after = response.headers.get("Retry-After", "")
+            raise upload_engine.RetryableError(
+                str(err), float(retry_after) if retry_after.isdigit() else None
+            )
+        raise
+    except (requests.ConnectionError, requests.ConnectTimeout) as err:
+        # Not read timeouts, which come after the request was sent.
+        raise upload_engine.RetryableError(str(err))
+
+    if journal is not None:
+        journal.record(upload["file_uuid"], upload["slug"])
+
+
+def apply_plan(client, header, rows, atom_url, args):
+    """Send the payloads of an upload plan to AtoM.
+
+    :param client: AtomClient object instance
+    :param header: Plan header dictionary
+    :param rows: Plan rows (iterable)
+    :param atom_url: AtoM URL, used to scope the upload journal (str)
+    :param args: Parsed command-line arguments
+
+    :returns: List of per-row result dictionaries
+    """
+    journal = None
+    completed = set()
+    if not args.no_journal:
+        os.makedirs(JOURNAL_DIRECTORY, exist_ok=True)
+        journal = UploadJournal(
+            os.path.join(JOURNAL_DIRECTORY, header["dip"] + ".sqlite"), atom_url
         )
-        for prop in props:
-            try:
-                val = getattr(premis_object, prop)
-            except AttributeError:
+        completed = journal.completed()
+
+    results = []
+
+    def _pending():
+        for row in rows:
+            result = {
+                "dip": header["dip"],
+                "filename": row["filename"],
+                "slug": row["slug"],
+                "file_uuid": row["file_uuid"],
+                "status": upload_engine.SKIPPED,
+                "error": row["error"],
+            }
+            results.append(result)
+            if row["payload"] is None:
                 continue
-            # Calling `getattr` to find an attribute deeper in the `premis_object`
-            # structure returns a non JSON serializable tuple instead of a None
-            # value. See Issues#743 for more information.
-            if not val or isinstance(val, tuple):
+            if (row["file_uuid"], row["slug"]) in completed:
+                result.update(status=ALREADY_UPLOADED, error="In upload journal")
                 continue
-            data[prop] = val
+            row["result"] = result
+            yield row
 
-        try:
-            client.add_digital_object(
-                dip_name["slug"],
-                title=filename,
-                usage="Offline",
-                size=data.get("size"),
-                format_name=data.get("format_name"),
-                format_version=data.get("format_version"),
-                format_registry_name=data.get("format_registry_name"),
-                format_registry_key=data.get("format_registry_key"),
-                file_uuid=file_uuid,
+    uploads = _pending()
+    if args.reconcile:
+        uploads = list(uploads)
+        if uploads:
+            print("Checking AtoM for existing digital objects...")
+            with metrics.span("reconcile"):
+                uploads = reconcile(client, uploads)
+
+    print("Uploading metadata for {}...".format(header["dip"]))
+    with metrics.span("atom_upload"):
+        outcomes = upload_engine.run(
+            uploads,
+            lambda upload: upload_digital_object(client, upload, journal),
+            args.max_in_flight,
+        )
+    for outcome in outcomes:
+        result = outcome["item"]["result"]
+        result.update(
+            status=outcome["status"],
+            error=outcome["error"],
+            attempts=outcome["attempts"],
+            latency=outcome["latency"],
+        )
+        if outcome["status"] == upload_engine.FAILED:
+            print(
+                "Couldn't upload metadata for {}: {}".format(
+                    result["filename"], outcome["error"]
+                )
             )
-            print("Uploaded metadata for {}".format(filename))
-        except NameError as err:
-            print("Couldn't upload metadata for {}: {}".format(filename, err))
+
+    if journal is not None:
+        journal.close()
+
+    return results
+
+
+def main():
+    parser = _make_parser()
+    run(parser, parser.parse_args())
+
+
+def run(parser, args):
+    """Plan or upload DIP metadata as asked by arguments parsed with parser.
+
+    :param parser: Parser the arguments came from, for usage errors
+        (argparse.ArgumentParser)
+    :param args: Parsed arguments (argparse.Namespace)
+    """
+    arguments.check_metadata_arguments(parser, args)
+    metrics.start(args.metrics, "dip-metadata")
+    # Writing plans does not contact AtoM, so needs no [ATOM] settings.
+    load_config(uploading=not args.plan_dir)
+
+    mets_cache = None
+    if not args.no_mets_cache:
+        mets_cache = METSCache(
+            METS_CACHE_DIRECTORY, int(METS_CACHE_MAX_SIZE_MB * 1024 ** 2)
+        )
+    dip_paths = [os.path.abspath(dip_path) for dip_path in args.dip_path]
+
+    if args.plan_dir:
+        os.makedirs(args.plan_dir, exist_ok=True)
+        failures = 0
+        # Planning runs in worker processes, so only its total time is seen.
+        with metrics.span("plan"), concurrent.futures.ProcessPoolExecutor(
+            max_workers=args.plan_workers
+        ) as executor:
+            futures = {
+                executor.submit(
+                    _plan_to_file, dip_path, args.plan_dir, args.mets_parser, mets_cache
+                ): dip_path
+                for dip_path in dip_paths
+            }
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    plan_path, skipped = future.result()
+                except PlanError as err:
+                    failures += 1
+                    print("Error: {}".format(err))
+                    continue
+                except Exception as err:
+                    # E.g. a CSV file that isn't UTF-8, or a crashed worker;
+                    # the other DIPs' plans are still written.
+                    failures += 1
+                    print("Error planning {}: {}".format(futures[future], err))
+                    continue
+                print("Wrote {} ({} rows will be skipped)".format(plan_path, skipped))
+        if failures:
+            sys.exit(1)
+        return
+
+    # Resolve every DIP before touching the network, so that a bad CSV or
+    # METS file stops the run before anything has been uploaded.
+    plans = []
+    try:
+        with metrics.span("plan"):
+            if args.apply:
+                plans = [read_plan(plan_path) for plan_path in args.apply]
+            else:
+                for dip_path in dip_paths:
+                    plans.append(plan_dip(dip_path, args.mets_parser, mets_cache))
+    except PlanError as err:
+        print("Error: {}".format(err))
+        sys.exit(1)
+
+    atom_url = ATOM_URL_PROD
+    api_token = ATOM_API_KEY_PROD
+    if args.dev:
+        atom_url = ATOM_URL_DEV
+        api_token = ATOM_API_KEY_DEV
+
+    try:
+        session = http_session.from_config(config, minimum_pool_size=args.max_in_flight)
+    except ValueError as err:
+        raise invalid_setting("HTTP", err)
+    # Imported only once there is something to upload, since it is slow to
+    # import and planning does not need it.
+    from agentarchives import atom
+
+    client = atom.AtomClient(atom_url, api_token, 443)
+    http_session.use_session(client, session)
+
+    results = []
+    for header, rows in plans:
+        results.extend(apply_plan(client, header, rows, atom_url, args))
+
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    for status, count in counts.items():
+        metrics.count("objects_{}".format(status.replace(" ", "_")), count)
+    print(
+        "Uploaded {}, already uploaded {}, skipped {}, failed {}".format(
+            counts.get(upload_engine.UPLOADED, 0),
+            counts.get(ALREADY_UPLOADED, 0),
+            counts.get(upload_engine.SKIPPED, 0),
+            counts.get(upload_engine.FAILED, 0),
+        )
+    )
+    if counts.get(POSSIBLY_UPLOADED):
+        print(
+            "Warning: {} rows were not uploaded because their parent already has a "
+            "description with the same title; check them in AtoM, and rerun without "
+            "--reconcile to upload the ones that are missing".format(
+                counts[POSSIBLY_UPLOADED]
+            )
+        )
+    session.report("AtoM")
+
+    if args.results:
+        with open(args.results, "w") as results_file:
+            json.dump(results, results_file, indent=2)
+
+    if counts.get(upload_engine.FAILED):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,250 @@
+"""Relay a DIP from the Storage Service into AtoM without landing on disk.
+
+dip-retrieve followed by dip-upload writes every DIP to the workstation and
+reads it back again. dip-pipeline instead reads the Storage Service download
+as a tar stream and re-emits its members straight into a `tar -x` on the
+AtoM server, through the jump server or a running session agent. Only one
+tar block and the SSH channel window are held in memory at a time, whatever
+the DIP's size. The objects CSV is built from the member list as it goes by
+and appended to the same stream, and then the DIP is imported.
+"""
+import argparse
+import csv
+import io
+import os
+import sys
+import tarfile
+import time
+
+import requests
+
+from dip_mungers import (
+    arguments,
+    dip_retrieve,
+    dip_upload,
+    metrics,
+    session_agent,
+    storage_service,
+    transfer,
+)
+
+
+class PipelineError(Exception):
+    pass
+
+
+# Root that tar members are checked against; members must stay inside it.
+MEMBER_ROOT = "/dip-pipeline"
+
+
+def _make_parser():
+    parser = argparse.ArgumentParser(
+        description="Relay a DIP from the Storage Service to AtoM and import it"
+    )
+    arguments.add_pipeline_arguments(parser)
+    return parser
+
+
+def objects_csv(object_names, slug):
+    """Build the objects CSV for a DIP in memory.
+
+    :param object_names: Filenames of the DIP's object files (list)
+    :param slug: Slug to fill in for every object (str)
+
+    :returns: CSV contents (bytes)
+    """
+    output = io.StringIO(newline="")
+    objects_writer = csv.writer(output, delimiter=",", lineterminator="\n")
+    objects_writer.writerow(["filename", "slug"])
+    for name in object_names:
+        objects_writer.writerow([name, slug])
+    return output.getvalue().encode("utf-8")
+
+
+def relay_dip(amclient, target, dip, remote_parent, slug):
+    """Stream a DIP from the Storage Service into a directory on the server.
+
+    :param amclient: AMClient object instance
+    :param target: Connected SSHClient, or session_agent.AgentClient
+    :param dip: DIP dictionary from Storage Service
+    :param remote_parent: Remote directory to extract the DIP into (str)
+    :param slug: Slug for every object in the generated CSV (str)
+
+    :returns: Number of object files relayed (int)
+
+    :raises PipelineError: If the download, relay or checksum fails
+    """
+    dip_basename = os.path.basename(dip["current_path"])
+    objects_prefix = "{}/objects/".format(dip_basename)
+    csv_name = "{}{}.csv".format(
+        objects_prefix, dip_basename[: -dip_retrieve.DIP_UUID_SUFFIX_LENGTH]
+    )
+    checksum_algorithm, checksum = storage_service.package_checksum(dip)
+    hasher = None
+    if checksum_algorithm:
+        hasher = storage_service.new_hasher(checksum_algorithm)
+    object_names = []
+
+    def _fill(archive):
+        payload_bytes = 0
+        with tarfile.open(fileobj=reader, mode="r|") as source:
+            for member in dip_retrieve._safe_members(source, MEMBER_ROOT):
+                fileobj = None
+                if member.isfile():
+                    name = member.name
+                    if name.startswith("./"):
+                        name = name[2:]
+                    object_name = name[len(objects_prefix):]
+                    if name.startswith(objects_prefix) and "/" not in object_name:
+                        # AtoM expects a single CSV, the one generated here.
+                        if object_name.endswith(".csv"):
+                            continue
+                        object_names.append(object_name)
+                    fileobj = source.extractfile(member)
+                    payload_bytes += member.size
+                archive.addfile(member, fileobj)
+            # Drain the end-of-archive padding so the whole body is hashed.
+            while reader.read(storage_service.CHUNK_SIZE):
+                pass
+
+        if not object_names:
+            raise PipelineError(
+                "No object files found under {} in DIP {}".format(
+                    objects_prefix, dip["uuid"]
+                )
+            )
+        data = objects_csv(object_names, slug)
+        info = tarfile.TarInfo(csv_name)
+        info.size = len(data)
+        info.mtime = time.time()
+        info.mode = 0o644
+        archive.addfile(info, io.BytesIO(data))
+        return payload_bytes
+
+    start_time = time.monotonic()
+    try:
+        response = storage_service.open_download(amclient, dip["uuid"])
+    except requests.RequestException as err:
+        raise PipelineError(
+            "Unable to download DIP {} from Storage Service: {}".format(dip["uuid"], err)
+        )
+    with response:
+        if response.status_code != 200:
+            raise PipelineError(
+                "Unable to download DIP {} from Storage Service (HTTP {})".format(
+                    dip["uuid"], response.status_code
+                )
+            )
+        reader = storage_service.CountingReader(response.raw, hasher)
+        try:
+            with metrics.span("relay"):
+                sent_bytes, payload_bytes = transfer.stream_tar(
+                    target, remote_parent, _fill
+                )
+        except (tarfile.TarError, requests.RequestException) as err:
+            raise PipelineError("Unable to relay DIP download stream: {}".format(err))
+        except transfer.TransferError as err:
+            raise PipelineError("Unable to extract DIP on server: {}".format(err))
+
+    metrics.count("storage_service_bytes", reader.bytes_read)
+    transfer.report_throughput(
+        "Relay", sent_bytes, time.monotonic() - start_time, payload_bytes
+    )
+    try:
+        storage_service.verify_checksum(hasher, checksum, dip["uuid"])
+    except storage_service.ChecksumMismatchError as err:
+        raise PipelineError(str(err))
+    return len(object_names)
+
+
+def run_pipeline(amclient, target, password, args, server_name):
+    """Relay an AIP's DIP to the server, import it, and remove the copy.
+
+    :param amclient: AMClient object instance
+    :param target: Connected SSHClient, or session_agent.AgentClient
+    :param password: Password for sudo prompts, or None (str)
+    :param args: Parsed command-line arguments
+    :param server_name: AtoM site directory name under /usr/share/nginx (str)
+
+    :returns: Whether the DIP was imported (bool)
+    """
+    try:
+        dip = dip_retrieve.fetch_dip_information(amclient, args.aip_uuid)
+    except dip_retrieve.DIPRetrievalError as err:
+        print("Error: {}".format(err))
+        return False
+    dip_basename = os.path.basename(dip["current_path"])
+    remote_parent = "/home/{}".format(dip_upload.USERNAME)
+    remote_dip_path = "{}/{}/".format(remote_parent, dip_basename)
+
+    print("Relaying DIP for AIP {} to server...".format(args.aip_uuid))
+    try:
+        count = relay_dip(amclient, target, dip, remote_parent, args.slug)
+    except PipelineError as err:
+        print("Error: {}".format(err))
+        dip_upload.remove_remote_dip(target, remote_dip_path)
+        return False
+    print("Relayed {} objects".format(count))
+
+    with metrics.span("import"):
+        status = dip_upload.import_dip(
+            target, password, args, server_name, None, remote_dip_path
+        )
+    if status != 0:
+        print(
+            "Error: DIP import failed with exit status {}. Keeping remote copy "
+            "at {}.".format(status, remote_dip_path)
+        )
+        return False
+    dip_upload.remove_remote_dip(target, remote_dip_path)
+    return True
+
+
+def main():
+    parser = _make_parser()
+    run(parser, parser.parse_args())
+
+
+def run(parser, args):
+    """Relay and import a DIP as asked by arguments parsed with parser.
+
+    :param parser: Parser the arguments came from, for usage errors
+        (argparse.ArgumentParser)
+    :param args: Parsed arguments (argparse.Namespace)
+    """
+    metrics.start(args.metrics, "dip-pipeline")
+    dip_upload.load_config()
+    profile = dip_upload.select_profile(parser, args)
+
+    amclient = dip_upload.storage_service_client(args.dev)
+
+    hostname, server_name = dip_upload.atom_server(args.dev)
+
+    agent = None
+    if not args.no_agent:
+        agent_path = session_agent.socket_path(
+            dip_upload.AGENT_DIRECTORY,
+            "nginx" if args.nginx else dip_upload.USERNAME,
+            hostname,
+        )
+        agent = session_agent.connect_agent(agent_path)
+
+    if agent is not None:
+        print("Using session agent at {}".format(agent_path))
+        succeeded = run_pipeline(amclient, agent, None, args, server_name)
+    else:
+        jumper, password = dip_upload.connect_jump(profile)
+        with jumper:
+            target = dip_upload.connect_target(
+                jumper, hostname, args.nginx, password, profile
+            )
+            succeeded = run_pipeline(amclient, target, password, args, server_name)
+
+    amclient.session.report("Storage Service")
+    if not succeeded:
+        sys.exit(1)
+    print("Done")
+
+
+if __name__ == "__main__":
+    main()
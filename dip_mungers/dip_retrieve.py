@@ -1,18 +1,26 @@
 import argparse
-import configparser
+import concurrent.futures
 import csv
 import os
+import shutil
+import sqlite3
 import sys
 import tarfile
+import time
+import xml.etree.ElementTree as ElementTree
 
-from amclient import AMClient
+import requests
 
+from dip_mungers import arguments, http_session, metrics, storage_service
+from dip_mungers.arguments import DEFAULT_WORKERS, DESKTOP_PATH
+from dip_mungers.config import invalid_setting, read_config, require
+from dip_mungers.dip_cache import DIPCache
+from dip_mungers.dip_index import DIPIndex
 
-class ConfigParsingError(Exception):
-    pass
 
+class DIPRetrievalError(Exception):
+    pass
 
-DESKTOP_PATH = os.path.expanduser("~/Desktop")
 
 # Suffix length includes leading dash separator.
 DIP_UUID_SUFFIX_LENGTH = 37
@@ -20,72 +28,119 @@ DIP_UUID_SUFFIX_LENGTH = 37
 # Status for stored AIPs in Storage Service.
 UPLOADED = "UPLOADED"
 
-USER_DIRECTORY = os.path.expanduser("~")
-CONFIG_FILE = os.path.join(USER_DIRECTORY, ".dip-mungers")
+# Namespaces used when listing DIP objects from a METS file.
+METS_NAMESPACE = "http://www.loc.gov/METS/"
+XLINK_NAMESPACE = "http://www.w3.org/1999/xlink"
 
-config = configparser.ConfigParser()
-config.read(CONFIG_FILE)
+# Default disk budget for the DIP cache, in gigabytes.
+DEFAULT_CACHE_MAX_SIZE_GB = 50
 
-try:
-    USERNAME = config["GENERAL"]["USERNAME"]
-    DEV_URL = config["STORAGE_SERVICE"]["DEV_URL"]
-    DEV_API_KEY = config["STORAGE_SERVICE"]["DEV_API_KEY"]
-    PROD_URL = config["STORAGE_SERVICE"]["PROD_URL"]
-    PROD_API_KEY = config["STORAGE_SERVICE"]["PROD_API_KEY"]
-except KeyError as err:
-    error_msg = "Config file at {} missing expected field: {}".format(CONFIG_FILE, err)
-    raise ConfigParsingError(error_msg)
+# Settings from the config file, set by load_config.
+config = None
+USERNAME = None
+DEV_URL = None
+DEV_API_KEY = None
+PROD_URL = None
+PROD_API_KEY = None
+# Directory holding the local AIP to DIP indexes, one per Storage Service.
+INDEX_DIRECTORY = None
+# The DIP cache is optional and only enabled when a directory is configured.
+CACHE_DIRECTORY = None
+CACHE_MAX_SIZE_GB = None
 
 
-def _make_parser():
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        "--dev",
-        help="Download DIP from development Storage Service",
-        action="store_true",
+def load_config():
+    """Read the [GENERAL], [STORAGE_SERVICE], [INDEX] and [CACHE] settings.
+
+    :raises FileNotFoundError: If there is no config file
+    :raises ConfigParsingError: If a setting is missing or invalid
+    """
+    global config, USERNAME, DEV_URL, DEV_API_KEY, PROD_URL, PROD_API_KEY
+    global INDEX_DIRECTORY, CACHE_DIRECTORY, CACHE_MAX_SIZE_GB
+    config = read_config()
+    (USERNAME,) = require("GENERAL", "USERNAME")
+    DEV_URL, DEV_API_KEY, PROD_URL, PROD_API_KEY = require(
+        "STORAGE_SERVICE", "DEV_URL", "DEV_API_KEY", "PROD_URL", "PROD_API_KEY"
     )
-    parser.add_argument("aip_uuid", help="AIP UUID")
+    INDEX_DIRECTORY = os.path.expanduser(
+        config.get("INDEX", "DIRECTORY", fallback="~/.cache/dip-mungers")
+    )
+    try:
+        CACHE_DIRECTORY = config.get("CACHE", "DIRECTORY", fallback=None)
+        CACHE_MAX_SIZE_GB = config.getfloat(
+            "CACHE", "MAX_SIZE_GB", fallback=DEFAULT_CACHE_MAX_SIZE_GB
+        )
+    except ValueError as err:
+        raise invalid_setting("cache", err)
+
 
+def _make_parser():
+    parser = argparse.ArgumentParser()
+    arguments.add_retrieve_arguments(parser)
     return parser
 
 
-def write_csv(local_dip_path, dip_basename):
+def read_uuid_file(path):
+    """Read AIP UUIDs from a file, skipping blank lines and # comments.
+
+    :param path: Path to UUID file (str)
+
+    :returns: List of AIP UUIDs
+    """
+    with open(path, "r") as uuid_file:
+        lines = [line.split("#", 1)[0].strip() for line in uuid_file]
+    return [line for line in lines if line]
+
+
+def write_csv(local_dip_path, dip_basename, objects_list=None):
     """Write CSV file into DIP's objects directory.
 
     :param local_dip_path: Path to DIP on user's desktop (str)
     :param dip_basename: DIP basename (str)
+    :param objects_list: Object filenames, if not listing the objects
+        directory (list)
     """
     transfer_name = dip_basename[:-DIP_UUID_SUFFIX_LENGTH]
     csv_path = local_dip_path + "/objects/" + transfer_name + ".csv"
-    objects_list = os.listdir(local_dip_path + "/objects")
-    with open(csv_path, "w", newline="\n") as csvfile:
+    if objects_list is None:
+        objects_list = os.listdir(local_dip_path + "/objects")
+    with metrics.span("write_csv"), open(csv_path, "w", newline="\n") as csvfile:
         objects_writer = csv.writer(csvfile, delimiter=",")
         objects_writer.writerow(["filename", "slug"])
         for x in objects_list:
             objects_writer.writerow([x])
 
 
-def fetch_dip_information(amclient, aip_uuid):
+def _aip2dips(amclient, aip_uuid):
+    try:
+        return storage_service.aip2dips(amclient, aip_uuid)
+    except (requests.RequestException, ValueError):
+        raise DIPRetrievalError(
+            "Unable to connect to Storage Service. Check URL and credentials?"
+        )
+
+
+def fetch_dip_information(amclient, aip_uuid, index=None):
     """Fetch information about an AIP's DIP from the Storage Service.
 
     :param amclient: AMclient object instance
     :param aip_uuid: AIP UUID
+    :param index: DIPIndex to look the AIP up in instead, or None (DIPIndex)
 
     :returns: DIP dictionary from Storage Service
+
+    :raises DIPRetrievalError: If no uploaded DIP can be found
     """
-    try:
-        amclient.aip_uuid = aip_uuid
-        dips = amclient.aip2dips()
-    # amclient throws a TypeError on bad connection to Storage Service.
-    except (ConnectionError, TypeError):
-        print("Error: Unable to connect to Storage Service. Check URL and credentials?")
-        sys.exit(1)
+    with metrics.span("find_dip"):
+        if index is not None:
+            dips = index.aip2dips(aip_uuid)
+        else:
+            dips = _aip2dips(amclient, aip_uuid)
 
     uploaded_dips = [dip for dip in dips if dip["status"] == UPLOADED]
 
     if not uploaded_dips:
-        print("Error: No DIPs found for AIP {}".format(aip_uuid))
-        sys.exit(1)
+        raise DIPRetrievalError("No DIPs found for AIP {}".format(aip_uuid))
 
     dip = uploaded_dips[0]
 
@@ -99,49 +154,424 @@ def fetch_dip_information(amclient, aip_uuid):
     return dip
 
 
-def download_dip(amclient, dip_uuid, dip_basename):
-    """Download and extract DIP to desktop.
+def download_dip(
+    amclient,
+    dip_uuid,
+    dip_basename,
+    target_dir=DESKTOP_PATH,
+    checksum=None,
+    checksum_algorithm=None,
+):
+    """Download and extract DIP to target directory.
+
+    The tarball is downloaded resumably and verified against the package
+    checksum before it is extracted.
 
     :param amclient: AMclient object instance
     :param dip_uuid: DIP UUID (str)
     :param dip_basename: DIP basename (str)
+    :param target_dir: Directory to extract DIP into (str)
+    :param checksum: Expected tarball checksum, if known (str)
+    :param checksum_algorithm: hashlib name of the checksum algorithm (str)
 
-    :returns local_dip_path: Path to DIP on desktop (str)
-    """
-    amclient.directory = DESKTOP_PATH
-    amclient.download_package(uuid=dip_uuid,)
+    :returns local_dip_path: Path to extracted DIP (str)
 
-    local_dip_path_tar = os.path.join(DESKTOP_PATH, dip_basename + ".tar")
-    local_dip_path = os.path.join(DESKTOP_PATH, dip_basename)
+    :raises DIPRetrievalError: If the DIP cannot be downloaded or extracted
+    """
+    local_dip_path_tar = os.path.join(target_dir, dip_basename + ".tar")
+    local_dip_path = os.path.join(target_dir, dip_basename)
 
-    if not os.path.exists(local_dip_path_tar):
-        print("Error: Unable to download DIP {} from Storage Service".format(dip_uuid))
-        sys.exit(1)
+    try:
+        with metrics.span("download"):
+            storage_service.resumable_download(
+                amclient,
+                dip_uuid,
+                local_dip_path_tar,
+                checksum=checksum,
+                checksum_algorithm=checksum_algorithm,
+            )
+    except (storage_service.DownloadError, requests.RequestException, OSError) as err:
+        raise DIPRetrievalError(
+            "Unable to download DIP {} from Storage Service: {}".format(dip_uuid, err)
+        )
 
     # Extract DIP from tarball.
-    with tarfile.open(local_dip_path_tar) as dip_tar:
-        dip_tar.extractall(DESKTOP_PATH)
+    try:
+        with metrics.span("extract"), tarfile.open(local_dip_path_tar) as dip_tar:
+            dip_tar.extractall(target_dir, members=_safe_members(dip_tar, target_dir))
+    except (tarfile.TarError, OSError) as err:
+        # Leave nothing that looks like a retrieved DIP, nor the tarball that
+        # couldn't be extracted.
+        shutil.rmtree(local_dip_path, ignore_errors=True)
+        try:
+            os.remove(local_dip_path_tar)
+        except OSError:
+            pass
+        raise DIPRetrievalError(
+            "Unable to extract DIP {} from tarball: {}".format(dip_uuid, err)
+        )
 
     if not os.path.exists(local_dip_path):
-        print("Error: Unable to extract DIP from tarball")
-        sys.exit(1)
+        raise DIPRetrievalError("Unable to extract DIP from tarball")
 
     # Delete tarball.
     try:
         os.remove(local_dip_path_tar)
     except OSError as err:
-        print("Warning: Unable to delete .tar from desktop: {}".format(err))
+        print("Warning: Unable to delete .tar from {}: {}".format(target_dir, err))
+
+    return local_dip_path
+
+
+def _is_safe_member(member, destination):
+    """Check that a tar member extracts inside the destination directory.
+
+    :param member: tarfile.TarInfo object
+    :param destination: Extraction directory (str)
+
+    :returns: True if the member can be extracted safely (bool)
+    """
+    if not (member.isfile() or member.isdir() or member.issym() or member.islnk()):
+        return False
+
+    destination = os.path.realpath(destination)
+    member_path = os.path.realpath(os.path.join(destination, member.name))
+    if os.path.commonpath([destination, member_path]) != destination:
+        return False
+
+    if member.issym() or member.islnk():
+        if member.issym():
+            link_base = os.path.dirname(member_path)
+        else:
+            link_base = destination
+        link_path = os.path.realpath(os.path.join(link_base, member.linkname))
+        if os.path.commonpath([destination, link_path]) != destination:
+            return False
+
+    return True
+
+
+def _safe_members(dip_tar, destination):
+    """Yield the members of a tarball that extract inside destination."""
+    for member in dip_tar:
+        if not _is_safe_member(member, destination):
+            print("Warning: Skipping unsafe tar member {}".format(member.name))
+            continue
+        yield member
+
+
+def stream_dip(
+    amclient,
+    dip_uuid,
+    dip_basename,
+    target_dir=DESKTOP_PATH,
+    checksum=None,
+    checksum_algorithm=None,
+):
+    """Download and extract DIP to target directory in a single pass.
+
+    The Storage Service response is read as a tar stream and members are
+    written out as they arrive, so the tarball itself never touches the disk.
+    The stream is hashed on the way through; since it can only be verified
+    once extraction has finished, a mismatch removes the extracted DIP.
+
+    :param amclient: AMclient object instance
+    :param dip_uuid: DIP UUID (str)
+    :param dip_basename: DIP basename (str)
+    :param target_dir: Directory to extract DIP into (str)
+    :param checksum: Expected tarball checksum, if known (str)
+    :param checksum_algorithm: hashlib name of the checksum algorithm (str)
+
+    :returns local_dip_path: Path to extracted DIP (str)
+
+    :raises DIPRetrievalError: If the DIP cannot be downloaded or extracted
+    """
+    local_dip_path = os.path.join(target_dir, dip_basename)
+    start_time = time.time()
+
+    try:
+        response = storage_service.open_download(amclient, dip_uuid)
+    except requests.RequestException as err:
+        raise DIPRetrievalError(
+            "Unable to download DIP {} from Storage Service: {}".format(dip_uuid, err)
+        )
+
+    with response:
+        if response.status_code != 200:
+            raise DIPRetrievalError(
+                "Unable to download DIP {} from Storage Service (HTTP {})".format(
+                    dip_uuid, response.status_code
+                )
+            )
+
+        hasher = None
+        if checksum_algorithm:
+            hasher = storage_service.new_hasher(checksum_algorithm)
+        reader = storage_service.CountingReader(response.raw, hasher)
+        try:
+            with metrics.span("download_extract"), tarfile.open(
+                fileobj=reader, mode="r|"
+            ) as dip_tar:
+                for member in _safe_members(dip_tar, target_dir):
+                    dip_tar.extract(member, target_dir)
+                # Drain the end-of-archive padding so the whole body is hashed.
+                while reader.read(storage_service.CHUNK_SIZE):
+                    pass
+        except (tarfile.TarError, requests.RequestException) as err:
+            shutil.rmtree(local_dip_path, ignore_errors=True)
+            raise DIPRetrievalError(
+                "Unable to extract DIP from download stream: {}".format(err)
+            )
+
+    if not os.path.exists(local_dip_path):
+        raise DIPRetrievalError("Unable to extract DIP from download stream")
+
+    try:
+        storage_service.verify_checksum(hasher, checksum, dip_uuid)
+    except storage_service.ChecksumMismatchError as err:
+        shutil.rmtree(local_dip_path, ignore_errors=True)
+        raise DIPRetrievalError(str(err))
+
+    metrics.count("storage_service_bytes", reader.bytes_read)
+    elapsed = max(time.time() - start_time, 0.001)
+    megabytes = reader.bytes_read / (1024 * 1024)
+    print(
+        "Retrieved {:.1f} MB in {:.1f}s ({:.1f} MB/s)".format(
+            megabytes, elapsed, megabytes / elapsed
+        )
+    )
+
+    return local_dip_path
+
+
+def objects_from_mets(metspath):
+    """List DIP object names for the original files described in a METS file.
+
+    DIP objects are named after the UUID and name of the original file, but
+    with the extension of the access derivative, which the METS file does not
+    record. The names returned here therefore lack an extension; they carry
+    the UUID prefix that dip-metadata matches files on.
+
+    :param metspath: Path to METS file (str)
+
+    :returns: List of object names
+    """
+    file_tag = "{{{}}}file".format(METS_NAMESPACE)
+    flocat_tag = "{{{}}}FLocat".format(METS_NAMESPACE)
+    href_attribute = "{{{}}}href".format(XLINK_NAMESPACE)
+    group_tag = "{{{}}}fileGrp".format(METS_NAMESPACE)
+    # Sections that can be large and are not needed here.
+    skipped_tags = {
+        "{{{}}}{}".format(METS_NAMESPACE, name) for name in ("amdSec", "dmdSec")
+    }
+
+    objects_list = []
+    for _, element in ElementTree.iterparse(metspath):
+        if element.tag == group_tag:
+            if element.get("USE") == "original":
+                for mets_file in element.iter(file_tag):
+                    file_uuid = mets_file.get("ID", "")[len("file-"):]
+                    flocat = mets_file.find(flocat_tag)
+                    if flocat is None or not file_uuid:
+                        continue
+                    name = os.path.basename(flocat.get(href_attribute, ""))
+                    objects_list.append(
+                        "{}-{}".format(file_uuid, os.path.splitext(name)[0])
+                    )
+            element.clear()
+        elif element.tag in skipped_tags:
+            element.clear()
+    return objects_list
+
+
+def retrieve_dip_metadata(amclient, aip_uuid, target_dir=DESKTOP_PATH, index=None):
+    """Fetch only an AIP's DIP METS file and write the DIP's CSV file.
+
+    Uses the Storage Service's single-file extraction so object files are
+    never transferred. Object names come from the package contents the
+    Storage Service has recorded, or from the METS file if there are none.
+
+    :param amclient: AMclient object instance
+    :param aip_uuid: AIP UUID (str)
+    :param target_dir: Directory to create the DIP directory in (str)
+    :param index: DIPIndex to resolve the DIP from, or None (DIPIndex)
+
+    :returns local_dip_path: Path to the DIP directory (str)
+
+    :raises DIPRetrievalError: If any retrieval step fails
+    """
+    dip = fetch_dip_information(amclient, aip_uuid, index)
+    dip_basename = os.path.basename(dip["current_path"])
+    local_dip_path = os.path.join(target_dir, dip_basename)
+    mets_name = "METS.{}.xml".format(aip_uuid)
+    metspath = os.path.join(local_dip_path, mets_name)
+    os.makedirs(os.path.join(local_dip_path, "objects"), exist_ok=True)
+
+    print("Downloading METS file for AIP {}...".format(aip_uuid))
+    try:
+        with metrics.span("download_mets"):
+            response = storage_service.open_extracted_file(
+                amclient, dip["uuid"], "{}/{}".format(dip_basename, mets_name)
+            )
+            with response:
+                if response.status_code != 200:
+                    raise DIPRetrievalError(
+                        "Unable to extract {} from DIP {} (HTTP {})".format(
+                            mets_name, dip["uuid"], response.status_code
+                        )
+                    )
+                with open(metspath, "wb") as mets_file:
+                    for chunk in response.iter_content(storage_service.CHUNK_SIZE):
+                        mets_file.write(chunk)
+
+        objects_prefix = "{}/objects/".format(dip_basename)
+        objects_list = [
+            os.path.basename(path)
+            for path in storage_service.package_contents(amclient, dip["uuid"])
+            if path.lstrip("/").startswith(objects_prefix)
+            or path.lstrip("/").startswith("objects/")
+        ]
+    except (storage_service.DownloadError, requests.RequestException) as err:
+        raise DIPRetrievalError(
+            "Unable to fetch metadata for DIP {}: {}".format(dip["uuid"], err)
+        )
+
+    if not objects_list:
+        try:
+            with metrics.span("mets_parse"):
+                objects_list = objects_from_mets(metspath)
+        except ElementTree.ParseError as err:
+            raise DIPRetrievalError("Unable to parse METS file {}: {}".format(metspath, err))
+
+    print("Writing CSV for AIP {}...".format(aip_uuid))
+    write_csv(local_dip_path, dip_basename, objects_list)
+
+    return local_dip_path
+
+
+def retrieve_dip(
+    amclient, aip_uuid, target_dir=DESKTOP_PATH, stream=False, cache=None, index=None
+):
+    """Find, download and extract an AIP's DIP and write its CSV file.
+
+    :param amclient: AMclient object instance
+    :param aip_uuid: AIP UUID (str)
+    :param target_dir: Directory to extract DIP into (str)
+    :param stream: Extract while downloading (bool)
+    :param cache: DIPCache to check before downloading, or None (DIPCache)
+    :param index: DIPIndex to resolve the DIP from, or None (DIPIndex)
+
+    :returns local_dip_path: Path to extracted DIP (str)
+
+    :raises DIPRetrievalError: If any retrieval step fails
+    """
+    dip = fetch_dip_information(amclient, aip_uuid, index)
+    dip_basename = os.path.basename(dip["current_path"])
+    checksum_algorithm, checksum = storage_service.package_checksum(dip)
+    local_dip_path = os.path.join(target_dir, dip_basename)
+
+    if cache is not None and cache.checkout(dip["uuid"], checksum, local_dip_path):
+        print("Using cached DIP for AIP {}".format(aip_uuid))
+    else:
+        print("Downloading DIP for AIP {}...".format(aip_uuid))
+        retrieve = stream_dip if stream else download_dip
+        local_dip_path = retrieve(
+            amclient,
+            dip["uuid"],
+            dip_basename,
+            target_dir,
+            checksum=checksum,
+            checksum_algorithm=checksum_algorithm,
+        )
+        if cache is not None:
+            try:
+                cache.store(dip["uuid"], checksum, local_dip_path)
+            except (OSError, sqlite3.Error) as err:
+                print("Warning: Unable to add DIP to cache: {}".format(err))
+
+    print("Writing CSV for AIP {}...".format(aip_uuid))
+    write_csv(local_dip_path, dip_basename)
 
     return local_dip_path
 
 
+def retrieve_dips(
+    make_amclient,
+    aip_uuids,
+    target_dir,
+    stream=False,
+    workers=DEFAULT_WORKERS,
+    cache=None,
+    metadata_only=False,
+    index=None,
+):
+    """Retrieve DIPs for many AIPs with a bounded pool of workers.
+
+    Each worker gets its own AMClient since retrieval sets attributes on it.
+    A failure for one AIP is recorded and does not stop the others.
+
+    :param make_amclient: Callable returning a new AMClient object instance
+    :param aip_uuids: AIP UUIDs (list)
+    :param target_dir: Directory to extract DIPs into (str)
+    :param stream: Extract while downloading (bool)
+    :param workers: Maximum number of concurrent retrievals (int)
+    :param cache: DIPCache to check before downloading, or None (DIPCache)
+    :param metadata_only: Fetch only METS files and CSVs (bool)
+    :param index: DIPIndex to resolve DIPs from, or None (DIPIndex)
+
+    :returns: Dictionary of AIP UUID to (succeeded, local DIP path or error)
+    """
+
+    def _retrieve(aip_uuid):
+        if metadata_only:
+            return retrieve_dip_metadata(make_amclient(), aip_uuid, target_dir, index)
+        return retrieve_dip(
+            make_amclient(), aip_uuid, target_dir, stream, cache, index
+        )
+
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_retrieve, aip_uuid): aip_uuid for aip_uuid in aip_uuids
+        }
+        for future in concurrent.futures.as_completed(futures):
+            aip_uuid = futures[future]
+            try:
+                results[aip_uuid] = (True, future.result())
+            except Exception as err:
+                results[aip_uuid] = (False, str(err))
+                print("Error: Unable to retrieve DIP for AIP {}: {}".format(aip_uuid, err))
+
+    return results
+
+
 def main():
     parser = _make_parser()
-    args = parser.parse_args()
+    run(parser, parser.parse_args())
 
-    if not os.path.exists(CONFIG_FILE):
-        error_msg = "DIP Mungers configuration file expected but not found at {}".format(CONFIG_FILE)
-        raise FileNotFoundError(error_msg)
+
+def run(parser, args):
+    """Retrieve DIPs as asked by arguments parsed with parser.
+
+    :param parser: Parser the arguments came from, for usage errors
+        (argparse.ArgumentParser)
+    :param args: Parsed arguments (argparse.Namespace)
+    """
+    arguments.check_retrieve_arguments(parser, args)
+    metrics.start(args.metrics, "dip-retrieve")
+    load_config()
+    # Imported here, after the arguments are known to be usable, since it
+    # takes a noticeable part of a second.
+    from amclient import AMClient
+
+    aip_uuids = list(args.aip_uuid)
+    if args.uuid_file:
+        aip_uuids.extend(read_uuid_file(args.uuid_file))
+    if not aip_uuids:
+        parser.error("no AIP UUIDs found in {}".format(args.uuid_file))
+
+    target_dir = os.path.abspath(args.target_dir)
+    os.makedirs(target_dir, exist_ok=True)
 
     storage_service_url = PROD_URL
     api_key = PROD_API_KEY
@@ -149,20 +579,86 @@ def main():
         storage_service_url = DEV_URL
         api_key = DEV_API_KEY
 
-    amclient = AMClient(
-        ss_url=storage_service_url, ss_user_name=USERNAME, ss_api_key=api_key,
-    )
-
-    dip = fetch_dip_information(amclient, args.aip_uuid)
-    dip_basename = os.path.basename(dip["current_path"])
+    cache = None
+    if CACHE_DIRECTORY and not args.no_cache:
+        cache = DIPCache(
+            os.path.expanduser(CACHE_DIRECTORY),
+            int(CACHE_MAX_SIZE_GB * 1024 ** 3),
+        )
 
-    print("Downloading DIP...")
-    local_dip_path = download_dip(amclient, dip["uuid"], dip_basename)
+    try:
+        session = http_session.from_config(config, minimum_pool_size=args.workers)
+    except ValueError as err:
+        raise invalid_setting("HTTP", err)
 
-    print("Writing CSV...")
-    write_csv(local_dip_path, dip_basename)
+    def make_amclient():
+        amclient = AMClient(
+            ss_url=storage_service_url, ss_user_name=USERNAME, ss_api_key=api_key,
+        )
+        amclient.session = session
+        return amclient
+
+    index = None
+    if args.index or args.rebuild_index:
+        index = DIPIndex(
+            os.path.join(
+                INDEX_DIRECTORY,
+                "dip-index-{}.sqlite".format("dev" if args.dev else "prod"),
+            )
+        )
+        print("Updating DIP index...")
+        try:
+            count = index.refresh(make_amclient(), full=args.rebuild_index)
+        except requests.RequestException as err:
+            print("Error: Unable to update DIP index from Storage Service: {}".format(err))
+            sys.exit(1)
+        print("{} DIPs added or updated in index".format(count))
+
+    if len(aip_uuids) == 1 and not args.uuid_file:
+        try:
+            if args.metadata_only:
+                retrieve_dip_metadata(make_amclient(), aip_uuids[0], target_dir, index)
+            else:
+                retrieve_dip(
+                    make_amclient(),
+                    aip_uuids[0],
+                    target_dir,
+                    args.stream,
+                    cache,
+                    index,
+                )
+        except DIPRetrievalError as err:
+            print("Error: {}".format(err))
+            sys.exit(1)
+        session.report("Storage Service")
+        print("Done")
+        return
+
+    # Drop duplicates while keeping the requested order for the summary.
+    aip_uuids = list(dict.fromkeys(aip_uuids))
+    results = retrieve_dips(
+        make_amclient,
+        aip_uuids,
+        target_dir,
+        args.stream,
+        args.workers,
+        cache,
+        args.metadata_only,
+        index,
+    )
 
-    print("Done")
+    print("Summary:")
+    failures = 0
+    for aip_uuid in aip_uuids:
+        succeeded, detail = results[aip_uuid]
+        if not succeeded:
+            failures += 1
+        print("  {} {}: {}".format("OK    " if succeeded else "FAILED", aip_uuid, detail))
+    print("{} of {} DIPs retrieved".format(len(aip_uuids) - failures, len(aip_uuids)))
+    session.report("Storage Service")
+
+    if failures:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -1,92 +1,182 @@
 import argparse
-import configparser
 import sys
 import os
 import getpass
+import glob
+import queue
+import shlex
+import threading
+import time
 
 from paramiko import AutoAddPolicy
 from paramiko_jump import SSHJumpClient, simple_auth_handler
-from scp import SCPClient, SCPException
+from scp import SCPException
 
+from dip_mungers import (
+    arguments,
+    http_session,
+    import_monitor,
+    import_shards,
+    metrics,
+    session_agent,
+    ssh_profiles,
+    storage_service,
+    transfer,
+)
+from dip_mungers.config import (
+    CONFIG_FILE,
+    ConfigParsingError,
+    invalid_setting,
+    read_config,
+    require,
+)
 
-class ConfigParsingError(Exception):
-    pass
+# Settings from the config file, set by load_config.
+config = None
+USERNAME = None
+JUMP_SERVER_HOSTNAME = None
+JUMP_SERVER_PORT = None
+ATOM_HOSTNAME_DEV = None
+ATOM_HOSTNAME_PROD = None
+AGENT_DIRECTORY = None
+AGENT_IDLE_TIMEOUT_HOURS = None
+TRANSPORT_PROFILES = None
 
 
-USER_DIRECTORY = os.path.expanduser("~")
-CONFIG_FILE = os.path.join(USER_DIRECTORY, ".dip-mungers")
+def load_config():
+    """Read the [GENERAL], [ATOM], [AGENT] and transport profile settings.
 
-config = configparser.ConfigParser()
-config.read(CONFIG_FILE)
+    :raises FileNotFoundError: If there is no config file
+    :raises ConfigParsingError: If a setting is missing or invalid
+    """
+    global config, USERNAME, JUMP_SERVER_HOSTNAME, JUMP_SERVER_PORT
+    global ATOM_HOSTNAME_DEV, ATOM_HOSTNAME_PROD
+    global AGENT_DIRECTORY, AGENT_IDLE_TIMEOUT_HOURS, TRANSPORT_PROFILES
+    config = read_config()
+    USERNAME, JUMP_SERVER_HOSTNAME, JUMP_SERVER_PORT = require(
+        "GENERAL", "USERNAME", "JUMP_SERVER_HOSTNAME", "JUMP_SERVER_PORT"
+    )
+    ATOM_HOSTNAME_DEV, ATOM_HOSTNAME_PROD = require(
+        "ATOM", "DEV_HOSTNAME", "PROD_HOSTNAME"
+    )
+    try:
+        AGENT_DIRECTORY = os.path.expanduser(
+            config.get("AGENT", "DIRECTORY", fallback="~/.cache/dip-mungers/agent")
+        )
+        AGENT_IDLE_TIMEOUT_HOURS = config.getfloat(
+            "AGENT",
+            "IDLE_TIMEOUT_HOURS",
+            fallback=session_agent.DEFAULT_IDLE_TIMEOUT_HOURS,
+        )
+    except ValueError as err:
+        raise invalid_setting("agent", err)
+    try:
+        TRANSPORT_PROFILES = ssh_profiles.load_profiles(config)
+    except ValueError as err:
+        error_msg = "Config file at {} has invalid transport profile: {}".format(
+            CONFIG_FILE, err
+        )
+        raise ConfigParsingError(error_msg)
 
-try:
-    USERNAME = config["GENERAL"]["USERNAME"]
-    JUMP_SERVER_HOSTNAME = config["GENERAL"]["JUMP_SERVER_HOSTNAME"]
-    JUMP_SERVER_PORT = config["GENERAL"]["JUMP_SERVER_PORT"]
-    ATOM_HOSTNAME_DEV = config["ATOM"]["DEV_HOSTNAME"]
-    ATOM_HOSTNAME_PROD = config["ATOM"]["PROD_HOSTNAME"]
-except KeyError as err:
-    error_msg = "Config file at {} missing expected field: {}".format(CONFIG_FILE, err)
-    raise ConfigParsingError(error_msg)
 
+def select_profile(parser, args):
+    """Return the transport profile chosen by --profile or the config file.
 
-def _make_parser():
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        "--dev",
-        help="Upload DIP to development AtoM",
-        action="store_true",
-    )
-    parser.add_argument(
-        "--nginx",
-        help="Use nginx AtoM user for upload (requires ssh key on jump server)",
-        action="store_true"
-    )
-    parser.add_argument("dip_path", help="Path to local DIP")
+    :param parser: Parser the arguments came from, for usage errors
+        (argparse.ArgumentParser)
+    :param args: Parsed arguments with a profile attribute (argparse.Namespace)
 
-    return parser
+    :returns: ssh_profiles.TransportProfile
+    """
+    if args.profile:
+        if args.profile not in TRANSPORT_PROFILES:
+            parser.error(
+                "argument --profile: invalid choice: '{}' (choose from {})".format(
+                    args.profile,
+                    ", ".join("'{}'".format(name) for name in sorted(TRANSPORT_PROFILES)),
+                )
+            )
+        return TRANSPORT_PROFILES[args.profile]
+    profile_name = ssh_profiles.selected_profile_name(config)
+    if profile_name not in TRANSPORT_PROFILES:
+        error_msg = "Config file at {} selects unknown transport profile: {}".format(
+            CONFIG_FILE, profile_name
+        )
+        raise ConfigParsingError(error_msg)
+    return TRANSPORT_PROFILES[profile_name]
 
 
-def dummy_sanitizer(s):
-    return s
+def _make_parser():
+    parser = argparse.ArgumentParser()
+    arguments.add_upload_arguments(parser)
+    return parser
 
 
-def main():
-    parser = _make_parser()
-    args = parser.parse_args()
+def atom_server(dev):
+    """Return the AtoM server hostname and its site directory name.
 
-    if not os.path.exists(CONFIG_FILE):
-        error_msg = "DIP Mungers configuration file expected but not found at {}".format(CONFIG_FILE)
-        raise FileNotFoundError(error_msg)
+    :param dev: Use the development AtoM server (bool)
 
+    :returns: Tuple of (hostname, name under /usr/share/nginx)
+    """
     hostname = ATOM_HOSTNAME_PROD
-    if args.dev:
+    if dev:
         hostname = ATOM_HOSTNAME_DEV
 
     server_name = hostname.split(".")[0]
     if server_name.startswith("arm-"):
         server_name = server_name[4:]
+    return hostname, server_name
 
-    local_dip_path = os.path.abspath(args.dip_path)
 
-    remote_dip_path = "/home/{}/{}/".format(USERNAME, os.path.basename(local_dip_path))
+def dummy_sanitizer(s):
+    return s
 
-    # Connect through jump server.
-    with SSHJumpClient(auth_handler=simple_auth_handler) as jumper:
-        jumper.set_missing_host_key_policy(AutoAddPolicy())
+
+def connect_jump(profile):
+    """Connect to the jump server and ask for the AtoM server password.
+
+    :param profile: ssh_profiles.TransportProfile
+
+    :returns: Tuple of (connected SSHJumpClient, password)
+    """
+    jumper = SSHJumpClient(auth_handler=simple_auth_handler)
+    jumper.set_missing_host_key_policy(AutoAddPolicy())
+    # Includes the time taken to answer any login prompts.
+    with metrics.span("connect_jump"):
         jumper.connect(
-            hostname=JUMP_SERVER_HOSTNAME, port=JUMP_SERVER_PORT, username=USERNAME,
+            hostname=JUMP_SERVER_HOSTNAME,
+            port=JUMP_SERVER_PORT,
+            username=USERNAME,
+            **profile.connect_kwargs()
         )
 
-        password = getpass.getpass("Password (again, for second hop): ")
+    password = getpass.getpass("Password (again, for second hop): ")
+    return jumper, password
 
-        # Connect to target server.
-        target = SSHJumpClient(jump_session=jumper)
-        target.set_missing_host_key_policy(AutoAddPolicy())
-        if args.nginx:
+
+def connect_target(jumper, hostname, nginx, password, profile):
+    """Connect to the AtoM server through the jump server.
+
+    :param jumper: SSHJumpClient connected to the jump server
+    :param hostname: AtoM server hostname (str)
+    :param nginx: Log in as the nginx user with SSH keys (bool)
+    :param password: Password for USERNAME, unused with nginx (str)
+    :param profile: ssh_profiles.TransportProfile
+
+    :returns: Connected SSHJumpClient
+    """
+    # The hop to the target is a channel on the jump transport, so the
+    # profile's window settings must be in place there before it opens.
+    profile.apply(jumper.get_transport())
+    target = SSHJumpClient(jump_session=jumper)
+    target.set_missing_host_key_policy(AutoAddPolicy())
+    with metrics.span("connect_target"):
+        if nginx:
             target.connect(
                 hostname=hostname,
                 username="nginx",
+                **profile.connect_kwargs()
             )
         else:
             target.connect(
@@ -94,38 +184,619 @@ def main():
                 look_for_keys=False,
                 username=USERNAME,
                 password=password,
+                **profile.connect_kwargs()
             )
+    profile.apply(target.get_transport())
+    return target
+
+
+def calibrate(jumper, hostname, nginx, password, size_mb):
+    """Find the fastest transport profile and save it to the config file.
+
+    The jump server connection is made once, with the configured profile,
+    so multi-factor authentication is only needed once; each profile is
+    applied to the hop to the AtoM server.
+    """
+    print("Sending {} MB with each transport profile...".format(size_mb))
+    timings = ssh_profiles.calibrate(
+        lambda profile: connect_target(jumper, hostname, nginx, password, profile),
+        [TRANSPORT_PROFILES[name] for name in sorted(TRANSPORT_PROFILES)],
+        size_mb * 1024 ** 2,
+    )
+    if not timings:
+        print("Error: No transport profile could be timed")
+        sys.exit(1)
+    fastest = timings[0][0]
+    ssh_profiles.save_selected_profile(CONFIG_FILE, fastest.name)
+    print("Saved profile {} as the default in {}".format(fastest, CONFIG_FILE))
+
+
+def storage_service_client(dev):
+    """Return an AMClient for the Storage Service paired with the AtoM server.
+
+    Storage Service settings are only needed by some modes, so they are read,
+    and checked, only when this is called.
+
+    :param dev: Use the development Storage Service (bool)
+
+    :returns: AMClient object instance using the shared HTTP session
+    """
+    from amclient import AMClient
+
+    from dip_mungers import dip_retrieve
 
-        # Copy DIP to target server.
-        print("Copying DIP to server...")
+    dip_retrieve.load_config()
+    url = dip_retrieve.DEV_URL if dev else dip_retrieve.PROD_URL
+    api_key = dip_retrieve.DEV_API_KEY if dev else dip_retrieve.PROD_API_KEY
+    try:
+        session = http_session.from_config(dip_retrieve.config, minimum_pool_size=1)
+    except ValueError as err:
+        raise invalid_setting("HTTP", err)
+
+    amclient = AMClient(
+        ss_url=url, ss_user_name=dip_retrieve.USERNAME, ss_api_key=api_key,
+    )
+    amclient.session = session
+    return amclient
+
+
+def pull_dip(target, amclient, local_dip_path, remote_dip_path):
+    """Have the AtoM server download a DIP itself, then send it the CSV.
+
+    The AIP UUID is taken from the end of the local DIP directory's name, as
+    written by dip-retrieve (including with --metadata-only), and only the
+    local objects CSV, with its slugs, is sent from this computer.
+
+    :param target: Connected SSHClient, or session_agent.AgentClient
+    :param amclient: AMClient object instance
+    :param local_dip_path: Path to local DIP (str)
+    :param remote_dip_path: Remote staging directory (str)
+
+    :returns: Whether the download and CSV upload succeeded (bool)
+    """
+    from dip_mungers import dip_retrieve
+
+    dip_basename = os.path.basename(local_dip_path)
+    aip_uuid = dip_basename[-(dip_retrieve.DIP_UUID_SUFFIX_LENGTH - 1):]
+    csvpaths = sorted(glob.glob(local_dip_path + "/objects/*.csv"))
+    if not csvpaths:
+        print("Error: No CSV file found in {}/objects".format(local_dip_path))
+        return False
+
+    print("Server downloading {} from Storage Service...".format(dip_basename))
+    try:
+        dip = dip_retrieve.fetch_dip_information(amclient, aip_uuid)
+    except dip_retrieve.DIPRetrievalError as err:
+        print("Error: {}".format(err))
+        return False
+    checksum_algorithm, checksum = storage_service.package_checksum(dip)
+
+    start_time = time.monotonic()
+    try:
+        size = transfer.pull_package(
+            target,
+            storage_service.package_url(amclient, dip["uuid"], "download"),
+            storage_service.auth_headers(amclient),
+            remote_dip_path,
+            checksum_algorithm,
+            checksum,
+        )
+    except transfer.TransferError as err:
+        print("Error: Server was unable to download DIP: {}".format(err))
+        return False
+    transfer.report_throughput("Storage Service", size, time.monotonic() - start_time)
+
+    # Replace any CSV from the package with the local one and its slugs.
+    objects_path = "{}/objects".format(remote_dip_path.rstrip("/"))
+    with open(csvpaths[0], "rb") as csvfile:
+        status, _, stderr = transfer.run_command(
+            target,
+            "rm -f {0}/*.csv && cat > {0}/{1}".format(
+                shlex.quote(objects_path), shlex.quote(os.path.basename(csvpaths[0]))
+            ),
+            csvfile.read(),
+        )
+    if status != 0:
+        print(
+            "Error: Unable to send CSV to server: {}".format(
+                stderr.decode("utf-8", "replace").strip()
+            )
+        )
+        return False
+    return True
+
+
+def copy_dip(target, args, local_dip_path, remote_dip_path, amclient=None):
+    """Copy a DIP to the AtoM server with the transfer chosen in args.
+
+    :param target: Connected SSHClient, or session_agent.AgentClient
+    :param args: Parsed command-line arguments
+    :param local_dip_path: Path to local DIP (str)
+    :param remote_dip_path: Remote staging directory (str)
+    :param amclient: AMClient object instance, needed with args.pull
+
+    :returns: Whether the copy succeeded (bool)
+    """
+    if not args.delta:
+        # Start from an empty directory; see reuses_remote_copy.
         try:
-            with SCPClient(target.get_transport(), sanitize=dummy_sanitizer) as scp:
-                scp.put(local_dip_path, remote_dip_path, recursive=True)
-        except SCPException as err:
+            transfer.clear_remote_dir(target, remote_dip_path)
+        except transfer.TransferError as err:
             print("Error copying DIP to target server: {}".format(err))
+            return False
+
+    if args.pull:
+        return pull_dip(target, amclient, local_dip_path, remote_dip_path)
+
+    print("Copying {} to server...".format(os.path.basename(local_dip_path)))
+    try:
+        files = None
+        if args.delta:
+            files, stale = transfer.delta_sync(target, local_dip_path, remote_dip_path)
+            print(
+                "{} files missing or changed on server, {} stale files to remove".format(
+                    len(files), len(stale)
+                )
+            )
+            transfer.remove_remote_files(target, remote_dip_path, stale)
+        if args.transfer == "tar":
+            transfer.tar_transfer(
+                target,
+                local_dip_path,
+                remote_dip_path,
+                compress=args.compress,
+                files=files,
+            )
+        elif args.transfer == "sftp":
+            transfer.sftp_transfer(
+                target,
+                local_dip_path,
+                remote_dip_path,
+                channels=args.channels,
+                files=files,
+            )
+        else:
+            transfer.scp_transfer(
+                target, local_dip_path, remote_dip_path, sanitize=dummy_sanitizer
+            )
+    except (SCPException, transfer.TransferError) as err:
+        print("Error copying DIP to target server: {}".format(err))
+        return False
+    return True
+
+
+def reuses_remote_copy(args):
+    """Return whether a remote copy left by a failed import is worth keeping.
+
+    Only tar and SFTP transfers can update an earlier copy with --delta, and
+    failed shards' staging directories link into it. Every other copy starts
+    by removing what an earlier run left.
+
+    :param args: Parsed command-line arguments
+
+    :returns: bool
+    """
+    return args.shards > 1 or (args.transfer in ("tar", "sftp") and not args.pull)
+
+
+def _import_command(args, server_name, remote_dip_path):
+    import_cmd = "php /usr/share/nginx/{}/src/symfony import:dip-objects {}".format(
+        server_name, remote_dip_path
+    )
+    if not args.nginx:
+        import_cmd = import_monitor.sudo_command(import_cmd)
+    return import_cmd
+
+
+# Keeps lines from concurrent shard imports whole.
+_output_lock = threading.Lock()
+
+
+def _line_printer(prefix):
+    def on_line(stream, text):
+        output = sys.stderr if stream == "stderr" else sys.stdout
+        with _output_lock:
+            output.write("{}{}\n".format(prefix, text))
+            output.flush()
+
+    return on_line
+
+
+def _run_import(target, password, import_cmd, dip_name, shard, filenames, import_log):
+    monitor = None
+    if import_log is not None:
+        monitor = import_monitor.ImportMonitor(filenames)
+    prefix = "" if shard is None else "[shard {}] ".format(shard)
+    start_time = time.monotonic()
+    status = import_monitor.run_import(
+        target, import_cmd, password, _line_printer(prefix), monitor
+    )
+    if import_log is not None:
+        import_log.write_import(
+            dip_name, shard, status, time.monotonic() - start_time, monitor.finish()
+        )
+    return status
+
+
+def import_dip(
+    target,
+    password,
+    args,
+    server_name,
+    local_dip_path,
+    remote_dip_path,
+    import_log=None,
+):
+    """Run the AtoM DIP import on a copied DIP, streaming its output.
+
+    With args.shards above 1 the import is split into shards that run at
+    once; see import_sharded.
+
+    :param target: Connected SSHClient, or session_agent.AgentClient
+    :param password: Password for sudo prompts, or None if the session
+        agent answers them (str)
+    :param args: Parsed command-line arguments
+    :param server_name: AtoM site directory name under /usr/share/nginx (str)
+    :param local_dip_path: Path to local DIP, only read for shards or the
+        import log (str)
+    :param remote_dip_path: Remote staging directory (str)
+    :param import_log: import_monitor.ImportLog for timing records, or None
+
+    :returns: Exit status of the import (int)
+    """
+    dip_name = os.path.basename(remote_dip_path.rstrip("/"))
+    print("Importing {} into AtoM...".format(dip_name))
+    filenames = ()
+    if import_log is not None:
+        filenames = import_monitor.object_filenames(local_dip_path)
+    if args.shards > 1:
+        return import_sharded(
+            target,
+            password,
+            args,
+            server_name,
+            local_dip_path,
+            remote_dip_path,
+            filenames,
+            import_log,
+        )
+    return _run_import(
+        target,
+        password,
+        _import_command(args, server_name, remote_dip_path),
+        dip_name,
+        None,
+        filenames,
+        import_log,
+    )
+
+
+def import_sharded(
+    target,
+    password,
+    args,
+    server_name,
+    local_dip_path,
+    remote_dip_path,
+    filenames=(),
+    import_log=None,
+):
+    """Split a DIP's import into shards and run them at once.
+
+    Each shard's import runs on its own channel, and its output is printed
+    line by line prefixed with the shard number. The staging directories of
+    shards that succeed are removed; those of failed shards are kept, so
+    their import can be rerun on its own without importing the other
+    shards' objects twice.
+
+    :param target: Connected SSHClient, or session_agent.AgentClient
+    :param password: Password for sudo prompts, or None if the session
+        agent answers them (str)
+    :param args: Parsed command-line arguments
+    :param server_name: AtoM site directory name under /usr/share/nginx (str)
+    :param local_dip_path: Path to local DIP (str)
+    :param remote_dip_path: Remote staging directory (str)
+    :param filenames: Object filenames for the timing records (set)
+    :param import_log: import_monitor.ImportLog for timing records, or None
+
+    :returns: 0 if every shard succeeded, otherwise the exit status of the
+        first failed shard (int)
+    """
+    try:
+        shards = import_shards.stage_shards(
+            target, local_dip_path, remote_dip_path, args.shards
+        )
+    except (OSError, import_shards.ShardError) as err:
+        print("Error: Unable to split DIP import into shards: {}".format(err))
+        return 1
+    if len(shards) < args.shards:
+        print(
+            "Warning: DIP has too few slugs for {} shards; using {}".format(
+                args.shards, len(shards)
+            )
+        )
+
+    dip_name = os.path.basename(remote_dip_path.rstrip("/"))
+    statuses = [None] * len(shards)
+
+    def _import_shard(index, shard_path):
+        try:
+            statuses[index] = _run_import(
+                target,
+                password,
+                _import_command(args, server_name, shard_path),
+                dip_name,
+                index + 1,
+                filenames,
+                import_log,
+            )
+        except Exception as err:
+            _line_printer("[shard {}] ".format(index + 1))(
+                "stderr", "Error: {}".format(err)
+            )
+            statuses[index] = -1
+
+    threads = [
+        threading.Thread(target=_import_shard, args=(index, shard_path), daemon=True)
+        for index, (shard_path, _) in enumerate(shards)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    failed = 0
+    for index, ((shard_path, rows), status) in enumerate(zip(shards, statuses)):
+        if status == 0:
+            import_shards.remove_shard(target, shard_path)
+            continue
+        print(
+            "Error: Shard {} of {} ({} rows) failed with exit status {}. Keeping "
+            "its staging directory at {}".format(
+                index + 1, len(shards), rows, status, shard_path
+            )
+        )
+        failed = failed or status
+    import_shards.remove_shards_root(target, remote_dip_path)
+    return failed
+
+
+def remove_remote_dip(target, remote_dip_path):
+    print(
+        "Deleting remote copy of {}...".format(
+            os.path.basename(remote_dip_path.rstrip("/"))
+        )
+    )
+    with metrics.span("remove_remote_dip"):
+        _, stdout, _ = target.exec_command("rm -rf {}".format(remote_dip_path))
+        stdout.channel.recv_exit_status()
+
+
+def _next_copied(copied, copier):
+    """Wait for the copier thread to hand over its next DIP.
+
+    :param copied: Queue the copier puts DIPs on (queue.Queue)
+    :param copier: The copier thread (threading.Thread)
+
+    :returns: DIP dictionary, or None if the copier stopped without one
+    """
+    while True:
+        try:
+            return copied.get(timeout=1)
+        except queue.Empty:
+            # Checked after the timeout, as the copier may have put its last
+            # DIP and stopped while this was waiting.
+            if not copier.is_alive() and copied.empty():
+                return None
+
+
+def upload_dips(target, password, args, server_name, amclient=None):
+    """Copy, import and remove each DIP, copying ahead while importing.
+
+    A background thread copies DIPs in order while the main thread imports
+    the ones already copied, so the network and the server's CPU are both
+    busy. At most args.max_staged DIP copies are on the server at a time.
+
+    :param target: Connected SSHClient, or session_agent.AgentClient
+    :param password: Password for sudo prompts, or None if the session
+        agent answers them (str)
+    :param args: Parsed command-line arguments
+    :param server_name: AtoM site directory name under /usr/share/nginx (str)
+    :param amclient: AMClient object instance, needed with args.pull
+
+    :returns: Whether every DIP was imported (bool)
+    """
+    dips = []
+    for dip_path in args.dip_path:
+        local_dip_path = os.path.abspath(dip_path)
+        remote_dip_path = "/home/{}/{}/".format(
+            USERNAME, os.path.basename(local_dip_path)
+        )
+        dips.append(
+            {
+                "name": os.path.basename(local_dip_path),
+                "local_path": local_dip_path,
+                "remote_path": remote_dip_path,
+                "status": None,
+                "copied": False,
+                "copy_seconds": None,
+                "import_seconds": None,
+            }
+        )
+
+    import_log = None
+    if args.import_log:
+        import_log = import_monitor.ImportLog(args.import_log)
+
+    staging_slots = threading.Semaphore(args.max_staged)
+    copied = queue.Queue()
+
+    def _copy_all():
+        for dip in dips:
+            staging_slots.acquire()
+            start_time = time.monotonic()
+            try:
+                with metrics.span("copy"):
+                    dip["copied"] = copy_dip(
+                        target, args, dip["local_path"], dip["remote_path"], amclient
+                    )
+            except Exception as err:
+                # E.g. the SSH session dropped or a local file is unreadable;
+                # the DIP counts as not copied and the next one is tried.
+                print("Error copying {} to target server: {}".format(dip["name"], err))
+            finally:
+                dip["copy_seconds"] = time.monotonic() - start_time
+                copied.put(dip)
+
+    copier = threading.Thread(target=_copy_all, daemon=True)
+    copier.start()
+
+    for index in range(len(dips)):
+        dip = _next_copied(copied, copier)
+        if dip is None:
+            print("Error: Copying stopped unexpectedly")
+            for dip in dips[index:]:
+                dip["status"] = "copy failed"
+            break
+        try:
+            if not dip["copied"]:
+                dip["status"] = "copy failed"
+                continue
+
+            start_time = time.monotonic()
+            try:
+                with metrics.span("import"):
+                    status = import_dip(
+                        target,
+                        password,
+                        args,
+                        server_name,
+                        dip["local_path"],
+                        dip["remote_path"],
+                        import_log,
+                    )
+            except Exception as err:
+                # E.g. the SSH channel dropped; the remote copy is left for
+                # the next copy of this DIP to replace.
+                print("Error importing {}: {}".format(dip["name"], err))
+                dip["status"] = "import failed"
+                continue
+            finally:
+                dip["import_seconds"] = time.monotonic() - start_time
+            if status != 0:
+                dip["status"] = "import failed"
+                if not reuses_remote_copy(args):
+                    print("Error: DIP import failed with exit status {}.".format(status))
+                    remove_remote_dip(target, dip["remote_path"])
+                    continue
+                # Keep the remote copy of a failed import, so that a rerun
+                # with --delta only has to send the files that were fixed.
+                if args.shards > 1:
+                    hint = "rerun the import on the failed shards' staging directories"
+                else:
+                    hint = "rerun with --delta to reuse it"
+                print(
+                    "Error: DIP import failed with exit status {}. Keeping remote copy "
+                    "at {}; {}.".format(status, dip["remote_path"], hint)
+                )
+                continue
+
+            remove_remote_dip(target, dip["remote_path"])
+            dip["status"] = "imported"
+        finally:
+            staging_slots.release()
+    copier.join()
+    if import_log is not None:
+        import_log.close()
+        print("Wrote import timings to {}".format(args.import_log))
+
+    for dip in dips:
+        metrics.count("dips_{}".format(dip["status"].replace(" ", "_")))
+        timings = []
+        if dip["copy_seconds"] is not None:
+            timings.append("copied in {:.1f}s".format(dip["copy_seconds"]))
+        if dip["import_seconds"] is not None:
+            timings.append("imported in {:.1f}s".format(dip["import_seconds"]))
+        if timings:
+            print("{}: {} ({})".format(dip["name"], dip["status"], ", ".join(timings)))
+        else:
+            print("{}: {}".format(dip["name"], dip["status"]))
+
+    return all(dip["status"] == "imported" for dip in dips)
+
+
+def main():
+    parser = _make_parser()
+    run(parser, parser.parse_args())
+
+
+def run(parser, args):
+    """Upload DIPs, or manage the session agent, as asked by arguments.
+
+    :param parser: Parser the arguments came from, for usage errors
+        (argparse.ArgumentParser)
+    :param args: Parsed arguments (argparse.Namespace)
+    """
+    arguments.check_upload_arguments(parser, args)
+    metrics.start(args.metrics, "dip-upload")
+    load_config()
+    profile = select_profile(parser, args)
+
+    hostname, server_name = atom_server(args.dev)
+
+    agent_path = session_agent.socket_path(
+        AGENT_DIRECTORY, "nginx" if args.nginx else USERNAME, hostname
+    )
+    if args.stop_agent:
+        if session_agent.stop_agent(agent_path):
+            print("Stopped session agent at {}".format(agent_path))
+        else:
+            print("No session agent running at {}".format(agent_path))
+        return
+
+    if args.start_agent:
+        def _connect():
+            jumper, password = connect_jump(profile)
+            target = connect_target(jumper, hostname, args.nginx, password, profile)
+            return jumper, target, None if args.nginx else password
+
+        try:
+            pid = session_agent.start_daemon(
+                _connect, agent_path, AGENT_IDLE_TIMEOUT_HOURS * 3600
+            )
+        except session_agent.AgentError as err:
+            print("Error: Unable to start session agent: {}".format(err))
+            sys.exit(1)
+        print("Session agent started (pid {}) at {}".format(pid, agent_path))
+        return
+
+    amclient = None
+    if args.pull:
+        amclient = storage_service_client(args.dev)
+
+    if not args.calibrate and not args.no_agent:
+        agent = session_agent.connect_agent(agent_path)
+        if agent is not None:
+            print("Using session agent at {}".format(agent_path))
+            if not upload_dips(agent, None, args, server_name, amclient):
+                sys.exit(1)
+            print("Done")
+            return
+
+    # Connect through jump server.
+    jumper, password = connect_jump(profile)
+    with jumper:
+        if args.calibrate:
+            calibrate(jumper, hostname, args.nginx, password, args.calibrate_size)
+            return
+
+        # Connect to target server.
+        target = connect_target(jumper, hostname, args.nginx, password, profile)
+        succeeded = upload_dips(target, password, args, server_name, amclient)
 
-        # Run AtoM DIP import.
-        print("Importing DIP into AtoM...")
-        import_cmd = "php /usr/share/nginx/{}/src/symfony import:dip-objects {}".format(
-            server_name, remote_dip_path
-        )
-        if not args.nginx:
-            import_cmd = "sudo {}".format(import_cmd)
-        stdin, stdout, stderr = target.exec_command(import_cmd, get_pty=True)
-        while True:
-            received = stdout.channel.recv(1024).decode("utf-8")
-            if "sudo" in received:
-                stdin.write("{}\n".format(password))
-                stdin.flush()
-            if not received:
-                break
-            sys.stdout.write(received)
-            sys.stdout.flush()
-
-        print("Deleting remote copy of DIP...")
-        target.exec_command("rm -rf {}".format(remote_dip_path))
-
-        print("Done")
+    if not succeeded:
+        sys.exit(1)
+    print("Done")
 
 
 if __name__ == "__main__":
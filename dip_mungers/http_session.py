@@ -0,0 +1,105 @@
+"""Shared HTTP session layer for the AtoM and Storage Service clients.
+
+One PooledSession per run keeps connections to each host open between
+requests, so a run of many API calls pays for a TLS handshake per pooled
+connection rather than per request. Pool size, keep-alive and timeouts come
+from the [HTTP] section of the config file.
+"""
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 30.0
+DEFAULT_READ_TIMEOUT = 300.0
+
+
+class PooledSession(requests.Session):
+    """requests.Session with a sized connection pool and default timeouts."""
+
+    def __init__(
+        self,
+        pool_size=DEFAULT_POOL_SIZE,
+        connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+        read_timeout=DEFAULT_READ_TIMEOUT,
+        keep_alive=True,
+    ):
+        """
+        :param pool_size: Connections kept open per host (int)
+        :param connect_timeout: Seconds to wait for a connection (float)
+        :param read_timeout: Seconds to wait for data from the server (float)
+        :param keep_alive: Reuse connections between requests (bool)
+        """
+        super().__init__()
+        self.timeout = (connect_timeout, read_timeout)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        if not keep_alive:
+            self.headers["Connection"] = "close"
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().request(method, url, **kwargs)
+
+    def connection_stats(self):
+        """Count connections opened and requests that reused a connection.
+
+        :returns: Tuple of (connections opened, connections reused)
+        """
+        opened = 0
+        requests_sent = 0
+        for adapter in set(self.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                opened += pool.num_connections
+                requests_sent += pool.num_requests
+        return opened, max(0, requests_sent - opened)
+
+    def report(self, label):
+        """Print connection reuse counts for this session.
+
+        :param label: Name of the service the session talked to (str)
+        """
+        opened, reused = self.connection_stats()
+        print(
+            "{} HTTP connections: {} opened, {} reused".format(label, opened, reused)
+        )
+
+
+def from_config(config, minimum_pool_size=1):
+    """Build a PooledSession from the [HTTP] section of a config file.
+
+    :param config: configparser.ConfigParser object
+    :param minimum_pool_size: Lower bound for the pool size, e.g. the number
+        of concurrent requests a command makes (int)
+
+    :returns: PooledSession
+
+    :raises ValueError: If a setting is not a valid number or boolean
+    """
+    pool_size = config.getint("HTTP", "POOL_SIZE", fallback=DEFAULT_POOL_SIZE)
+    return PooledSession(
+        pool_size=max(pool_size, minimum_pool_size),
+        connect_timeout=config.getfloat(
+            "HTTP", "CONNECT_TIMEOUT", fallback=DEFAULT_CONNECT_TIMEOUT
+        ),
+        read_timeout=config.getfloat(
+            "HTTP", "READ_TIMEOUT", fallback=DEFAULT_READ_TIMEOUT
+        ),
+        keep_alive=config.getboolean("HTTP", "KEEP_ALIVE", fallback=True),
+    )
+
+
+def use_session(atom_client, session):
+    """Make an agentarchives AtomClient send its requests through session.
+
+    :param atom_client: agentarchives.atom.AtomClient object instance
+    :param session: PooledSession
+    """
+    session.headers.update(atom_client.session.headers)
+    atom_client.session = session
+    atom_client.timeout = session.timeout
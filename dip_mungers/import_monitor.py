@@ -0,0 +1,264 @@
+"""Run AtoM's DIP import remotely and time its progress per object.
+
+The import's stdout and stderr are read at the same time, each through an
+incremental UTF-8 decoder so characters split between reads survive, and
+handed on a line at a time. sudo is run with -S and a fixed prompt, which
+is answered when it appears on stderr rather than by scanning all output
+for "sudo". Hosts whose sudoers set requiretty refuse to run sudo without a
+terminal; there the import is run again on a pty, where stderr is merged
+into stdout and the prompt is looked for there.
+
+ImportMonitor turns the lines into timing records: a new record starts
+whenever a line names one of the DIP's object files, and every line after
+it is a step timed until the next line, so slow objects and slow
+derivative steps stand out. ImportLog writes the records as JSON Lines.
+"""
+import codecs
+import csv
+import glob
+import json
+import os
+import re
+import shlex
+import threading
+import time
+
+from dip_mungers import metrics
+
+# Contains "[sudo] password" so the session agent recognises it too.
+SUDO_PROMPT = "[sudo] password for dip-upload import:"
+READ_SIZE = 32 * 1024
+
+# symfony 1 tasks log as ">> section  message".
+SECTION_LINE = re.compile(r"^>>\s+(\S+)\s+(.*)$")
+FILENAME_TOKEN = re.compile(r"[^\s\"'()\[\],]+")
+# sudo's refusals to ask for a password without a terminal, across versions.
+NO_TTY_LINE = re.compile(
+    r"^sudo: (sorry, you must have a tty|no tty present|a terminal is required)"
+)
+
+
+def sudo_command(command):
+    """Wrap a command in sudo, reading the password from stdin."""
+    return "sudo -S -p {} {}".format(shlex.quote(SUDO_PROMPT), command)
+
+
+def object_filenames(local_dip_path):
+    """Read the object filenames listed in a DIP's objects CSV file.
+
+    :param local_dip_path: Path to local DIP (str)
+
+    :returns: Set of filenames, empty if the DIP has no CSV file
+    """
+    filenames = set()
+    for csvpath in glob.glob(local_dip_path + "/objects/*.csv"):
+        with open(csvpath, "r", newline="") as csvfile:
+            for row in csv.DictReader(csvfile):
+                for key, value in row.items():
+                    if key and "filename" in key and value:
+                        filenames.add(os.path.basename(value))
+    return filenames
+
+
+class ImportMonitor:
+    """Build per-object timing records from import output lines."""
+
+    def __init__(self, filenames=(), clock=time.monotonic):
+        """
+        :param filenames: Object filenames to recognise in output (iterable)
+        :param clock: Function returning the current time in seconds
+        """
+        self.filenames = set(filenames)
+        self._clock = clock
+        self._start = clock()
+        self._current = None
+        self._last_step = None
+        self.records = []
+
+    def _offset(self, now):
+        return round(now - self._start, 3)
+
+    def _match_filename(self, text):
+        for token in FILENAME_TOKEN.findall(text):
+            name = os.path.basename(token)
+            if name in self.filenames:
+                return name
+        return None
+
+    def _close_step(self, now):
+        if self._last_step is not None:
+            step, started = self._last_step
+            step["seconds"] = round(now - started, 3)
+            self._last_step = None
+
+    def _close_record(self, now):
+        if self._current is not None:
+            self._current["seconds"] = round(
+                now - self._start - self._current["started"], 3
+            )
+            self.records.append(self._current)
+            self._current = None
+
+    def line(self, stream, text):
+        """Record one line of import output.
+
+        :param stream: "stdout" or "stderr" (str)
+        :param text: Line without its line ending (str)
+        """
+        now = self._clock()
+        self._close_step(now)
+        filename = self._match_filename(text)
+        if self._current is None or (
+            filename is not None and filename != self._current["filename"]
+        ):
+            self._close_record(now)
+            self._current = {
+                "filename": filename,
+                "started": self._offset(now),
+                "seconds": None,
+                "steps": [],
+            }
+
+        step = {"stream": stream, "line": text, "seconds": None}
+        section = SECTION_LINE.match(text)
+        if section:
+            step["section"] = section.group(1)
+        self._current["steps"].append(step)
+        self._last_step = (step, now)
+
+    def finish(self):
+        """Close the last step and record.
+
+        :returns: List of records, one per object in order of appearance;
+            output before the first object has a filename of None
+        """
+        now = self._clock()
+        self._close_step(now)
+        self._close_record(now)
+        return self.records
+
+
+class ImportLog:
+    """Thread-safe JSON Lines writer for import timing records."""
+
+    def __init__(self, path):
+        """
+        :param path: Path of the log file, replaced if it exists (str)
+        """
+        self._file = open(path, "w")
+        self._lock = threading.Lock()
+
+    def write_import(self, dip, shard, exit_status, seconds, records):
+        """Write an import's object records followed by its summary.
+
+        :param dip: DIP name (str)
+        :param shard: Shard number, or None if the import wasn't sharded (int)
+        :param exit_status: Exit status of the import (int)
+        :param seconds: Wall-clock duration of the import (float)
+        :param records: Records from ImportMonitor.finish (list)
+        """
+        lines = []
+        for record in records:
+            lines.append(dict(record, record="object", dip=dip, shard=shard))
+        lines.append(
+            {
+                "record": "import",
+                "dip": dip,
+                "shard": shard,
+                "exit_status": exit_status,
+                "seconds": round(seconds, 3),
+                "objects": sum(1 for record in records if record["filename"]),
+            }
+        )
+        with self._lock:
+            for line in lines:
+                self._file.write(json.dumps(line, sort_keys=True) + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def run_import(ssh_client, command, password, on_line, monitor=None):
+    """Run an import command, reading stdout and stderr at the same time.
+
+    If sudo refuses to run without a terminal, the command is run again on a
+    pty, and its output all arrives as stdout.
+
+    :param ssh_client: Connected paramiko SSHClient, or
+        session_agent.AgentClient
+    :param command: Shell command, with sudo from sudo_command (str)
+    :param password: Password for the sudo prompt, or None if there is no
+        prompt or the session agent answers it (str)
+    :param on_line: Function called with (stream, line) for each output line
+        in the order received
+    :param monitor: ImportMonitor to feed the lines to, or None
+
+    :returns: Exit status of the command (int)
+    """
+    lock = threading.Lock()
+
+    def _emit(stream, text):
+        with lock:
+            if monitor is not None:
+                monitor.line(stream, text)
+            on_line(stream, text)
+
+    status, needs_tty = _run_channel(ssh_client, command, password, _emit, False)
+    if needs_tty and status != 0:
+        status, _ = _run_channel(ssh_client, command, password, _emit, True)
+    return status
+
+
+def _run_channel(ssh_client, command, password, emit, pty):
+    """Run a command on one channel, passing its output lines to emit.
+
+    :returns: Tuple of (exit status, whether sudo asked for a terminal)
+    """
+    needs_tty = []
+    channel = ssh_client.get_transport().open_session()
+    try:
+        if pty:
+            channel.get_pty()
+        channel.exec_command(command)
+
+        def _read(recv, stream):
+            # On a pty sudo prompts on stdout, as stderr is merged into it.
+            prompt_stream = "stdout" if pty else "stderr"
+            decoder = codecs.getincrementaldecoder("utf-8")("replace")
+            pending = ""
+            while True:
+                with metrics.timed("ssh_channel_read"):
+                    data = recv(READ_SIZE)
+                pending += decoder.decode(data, final=not data)
+                if stream == prompt_stream and SUDO_PROMPT in pending:
+                    # The prompt has no line ending, so look for it in the
+                    # unfinished line.
+                    prompts = pending.count(SUDO_PROMPT)
+                    pending = pending.replace(SUDO_PROMPT, "")
+                    if password is not None:
+                        for _ in range(prompts):
+                            channel.sendall("{}\n".format(password).encode("utf-8"))
+                lines = pending.split("\n")
+                pending = lines.pop()
+                for text in lines:
+                    text = text.rstrip("\r")
+                    if not pty and stream == "stderr" and NO_TTY_LINE.match(text):
+                        # Not shown; the command is run again on a pty.
+                        needs_tty.append(text)
+                        continue
+                    emit(stream, text)
+                if not data:
+                    break
+            if pending.strip():
+                emit(stream, pending.rstrip("\r"))
+
+        stderr_reader = threading.Thread(
+            target=_read, args=(channel.recv_stderr, "stderr"), daemon=True
+        )
+        stderr_reader.start()
+        _read(channel.recv, "stdout")
+        stderr_reader.join()
+        return channel.recv_exit_status(), bool(needs_tty)
+    finally:
+        channel.close()
@@ -0,0 +1,159 @@
+"""Split a DIP import into shards that AtoM can import concurrently.
+
+AtoM's import:dip-objects task runs in a single PHP process, leaving the
+server's other cores idle. A DIP's objects CSV is split into partial CSVs,
+with all rows for a description kept in the same shard so its digital
+objects are still added in order. Each shard gets a staging directory on the
+server named like the DIP, holding symlinks to the DIP's files and its own
+partial CSV, so the import task can be run on each shard at once.
+"""
+import csv
+import heapq
+import io
+import os
+import shlex
+
+from dip_mungers import transfer
+
+
+class ShardError(Exception):
+    pass
+
+
+def split_csv(csv_path, shards):
+    """Split an objects CSV into groups of rows, keeping each slug together.
+
+    Slugs are assigned largest first to the shard with the fewest rows so
+    far, and rows keep their original order within a shard. There are fewer
+    shards than asked for if the CSV has fewer slugs.
+
+    :param csv_path: Path to objects CSV file (str)
+    :param shards: Number of shards wanted (int)
+
+    :returns: Tuple of (header row, list of lists of rows), each row a list of
+        column values
+
+    :raises ShardError: If the CSV has no slug column
+    """
+    with open(csv_path, "r", newline="") as csvfile:
+        csvreader = csv.reader(csvfile)
+        header = next(csvreader, [])
+        rows = list(csvreader)
+
+    slug_columns = [index for index, name in enumerate(header) if "slug" in name]
+    if not slug_columns:
+        raise ShardError("No slug column found in {}".format(csv_path))
+    slug_column = slug_columns[0]
+
+    groups = {}
+    for index, row in enumerate(rows):
+        slug = row[slug_column] if slug_column < len(row) else ""
+        groups.setdefault(slug, []).append(index)
+
+    loads = [(0, shard) for shard in range(min(shards, len(groups)))]
+    assigned = [[] for _ in loads]
+    for indexes in sorted(groups.values(), key=len, reverse=True):
+        load, shard = heapq.heappop(loads)
+        assigned[shard].extend(indexes)
+        heapq.heappush(loads, (load + len(indexes), shard))
+
+    return header, [[rows[index] for index in sorted(indexes)] for indexes in assigned]
+
+
+def csv_bytes(header, rows):
+    """Encode a header and rows as CSV file contents.
+
+    :param header: Header row (list)
+    :param rows: Rows (list of lists)
+
+    :returns: UTF-8 encoded CSV (bytes)
+    """
+    output = io.StringIO()
+    csvwriter = csv.writer(output)
+    csvwriter.writerow(header)
+    csvwriter.writerows(rows)
+    return output.getvalue().encode("utf-8")
+
+
+def shards_root(remote_dip_path):
+    """Return the remote directory holding a DIP's shard staging directories."""
+    return "{}.shards".format(remote_dip_path.rstrip("/"))
+
+
+def stage_shards(ssh_client, local_dip_path, remote_dip_path, shards):
+    """Create a staging directory on the server for each shard of a DIP.
+
+    Each staging directory has the DIP's name and contains symlinks to the
+    copied DIP's top-level entries and object files, plus the shard's
+    partial CSV in place of the full one.
+
+    :param ssh_client: Connected paramiko SSHClient to the AtoM server
+    :param local_dip_path: Path to local DIP, for reading its CSV (str)
+    :param remote_dip_path: Path of the copied DIP on the server (str)
+    :param shards: Number of shards wanted (int)
+
+    :returns: List of (remote staging directory, row count) tuples, one per
+        shard
+
+    :raises ShardError: If the CSV can't be split or staging fails
+    """
+    csvpaths = sorted(
+        name
+        for name in os.listdir(os.path.join(local_dip_path, "objects"))
+        if name.endswith(".csv")
+    )
+    if len(csvpaths) != 1:
+        raise ShardError(
+            "Expected one CSV file in {}/objects, found {}".format(
+                local_dip_path, len(csvpaths)
+            )
+        )
+    csv_name = csvpaths[0]
+    header, shard_rows = split_csv(
+        os.path.join(local_dip_path, "objects", csv_name), shards
+    )
+
+    remote_dip_path = remote_dip_path.rstrip("/")
+    dip_name = os.path.basename(remote_dip_path)
+    root = shards_root(remote_dip_path)
+    staged = []
+    for shard, rows in enumerate(shard_rows, 1):
+        shard_path = "{}/{}/{}".format(root, shard, dip_name)
+        command = (
+            "rm -rf {shard} && mkdir -p {shard}/objects"
+            " && find {dip} -mindepth 1 -maxdepth 1 ! -name objects"
+            " -exec ln -s -t {shard} {{}} +"
+            " && find {dip}/objects -mindepth 1 -maxdepth 1 ! -name '*.csv'"
+            " -exec ln -s -t {shard}/objects {{}} +"
+            " && cat > {shard}/objects/{csv}"
+        ).format(
+            shard=shlex.quote(shard_path),
+            dip=shlex.quote(remote_dip_path),
+            csv=shlex.quote(csv_name),
+        )
+        status, _, stderr = transfer.run_command(
+            ssh_client, command, csv_bytes(header, rows)
+        )
+        if status != 0:
+            raise ShardError(
+                "Unable to stage shard {} at {}: {}".format(
+                    shard, shard_path, stderr.decode("utf-8", "replace").strip()
+                )
+            )
+        staged.append((shard_path, len(rows)))
+    return staged
+
+
+def remove_shard(ssh_client, shard_path):
+    """Remove one shard's staging directory from the server."""
+    transfer.run_command(
+        ssh_client, "rm -rf {}".format(shlex.quote(os.path.dirname(shard_path)))
+    )
+
+
+def remove_shards_root(ssh_client, remote_dip_path):
+    """Remove the shard staging directories of a DIP, if they are all empty."""
+    transfer.run_command(
+        ssh_client,
+        "rmdir {} 2>/dev/null; true".format(shlex.quote(shards_root(remote_dip_path))),
+    )
@@ -0,0 +1,262 @@
+"""Timing and throughput metrics shared by the dip-mungers commands.
+
+Three kinds of measurement are recorded:
+
+- spans: phases of a run, such as a download or an import, with the number
+  of times each ran and their total seconds. Phases run by several workers
+  at once add up their time, so they can exceed the run's wall time.
+- counters: running totals, such as bytes downloaded or sent.
+- latencies: per-request durations, such as an AtoM add_digital_object call
+  or an SSH channel read, counted into histogram buckets.
+
+Recording is off unless a command is given --metrics, and then the metrics
+are written when the command exits, however it exits. A path ending in
+.prom gets the Prometheus text format, for node_exporter's textfile
+collector; any other path gets JSON. While recording is off, span() and
+timed() return a shared do-nothing context manager and count() and observe()
+return straight away, so instrumented code pays for a function call and
+nothing else.
+"""
+import atexit
+import json
+import os
+import re
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets, in seconds.
+LATENCY_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+    60.0, 300.0,
+)
+
+PROMETHEUS_PREFIX = "dip_mungers_"
+PROMETHEUS_SUFFIX = ".prom"
+
+
+class Recorder:
+    """Thread-safe store of spans, counters and latency histograms."""
+
+    def __init__(self, command, clock=time.monotonic):
+        """
+        :param command: Name of the command being measured (str)
+        :param clock: Function returning the current time in seconds
+        """
+        self.command = command
+        self.clock = clock
+        self.started = time.time()
+        self._start = clock()
+        self._lock = threading.Lock()
+        self._spans = {}
+        self._counters = {}
+        self._latencies = {}
+
+    def record_span(self, name, seconds):
+        with self._lock:
+            span = self._spans.setdefault(name, {"count": 0, "seconds": 0.0})
+            span["count"] += 1
+            span["seconds"] += seconds
+
+    def add(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            latency = self._latencies.get(name)
+            if latency is None:
+                latency = self._latencies[name] = {
+                    "count": 0,
+                    "seconds": 0.0,
+                    "max": 0.0,
+                    "buckets": [0] * len(LATENCY_BUCKETS),
+                }
+            latency["count"] += 1
+            latency["seconds"] += seconds
+            latency["max"] = max(latency["max"], seconds)
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    latency["buckets"][index] += 1
+                    break
+
+    def snapshot(self):
+        """Return everything recorded so far as a JSON-ready dictionary."""
+        with self._lock:
+            latencies = {}
+            for name, latency in self._latencies.items():
+                buckets = {}
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, latency["buckets"]):
+                    cumulative += count
+                    buckets[str(bound)] = cumulative
+                buckets["+Inf"] = latency["count"]
+                latencies[name] = {
+                    "count": latency["count"],
+                    "seconds": round(latency["seconds"], 6),
+                    "mean": round(latency["seconds"] / latency["count"], 6),
+                    "max": round(latency["max"], 6),
+                    "buckets": buckets,
+                }
+            return {
+                "command": self.command,
+                "started": time.strftime(
+                    "%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.started)
+                ),
+                # Measured from start(), after the command's imports.
+                "seconds": round(self.clock() - self._start, 6),
+                "spans": {
+                    name: {"count": span["count"], "seconds": round(span["seconds"], 6)}
+                    for name, span in self._spans.items()
+                },
+                "counters": dict(self._counters),
+                "latencies": latencies,
+            }
+
+    def prometheus(self):
+        """Return everything recorded so far in the Prometheus text format."""
+        snapshot = self.snapshot()
+        command = 'command="{}"'.format(_label_value(snapshot["command"]))
+        lines = [
+            "# TYPE {}run_seconds gauge".format(PROMETHEUS_PREFIX),
+            "{}run_seconds{{{}}} {}".format(PROMETHEUS_PREFIX, command, snapshot["seconds"]),
+            "# TYPE {}run_start_timestamp_seconds gauge".format(PROMETHEUS_PREFIX),
+            "{}run_start_timestamp_seconds{{{}}} {}".format(
+                PROMETHEUS_PREFIX, command, round(self.started, 3)
+            ),
+        ]
+        spans = sorted(snapshot["spans"].items())
+        for family, field in (("span_seconds_total", "seconds"), ("span_runs_total", "count")):
+            metric = PROMETHEUS_PREFIX + family
+            if spans:
+                lines.append("# TYPE {} counter".format(metric))
+            for name, span in spans:
+                lines.append(
+                    '{}{{{},span="{}"}} {}'.format(
+                        metric, command, _label_value(name), span[field]
+                    )
+                )
+        for name, value in sorted(snapshot["counters"].items()):
+            metric = "{}{}_total".format(PROMETHEUS_PREFIX, _metric_name(name))
+            lines.append("# TYPE {} counter".format(metric))
+            lines.append("{}{{{}}} {}".format(metric, command, value))
+        for name, latency in sorted(snapshot["latencies"].items()):
+            metric = "{}{}_seconds".format(PROMETHEUS_PREFIX, _metric_name(name))
+            lines.append("# TYPE {} histogram".format(metric))
+            for bound, count in latency["buckets"].items():
+                lines.append(
+                    '{}_bucket{{{},le="{}"}} {}'.format(metric, command, bound, count)
+                )
+            lines.append("{}_sum{{{}}} {}".format(metric, command, latency["seconds"]))
+            lines.append("{}_count{{{}}} {}".format(metric, command, latency["count"]))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write the metrics to path, replacing it in one step.
+
+        :param path: File to write; Prometheus format if it ends in .prom,
+            otherwise JSON (str)
+        """
+        if path.endswith(PROMETHEUS_SUFFIX):
+            content = self.prometheus()
+        else:
+            content = json.dumps(self.snapshot(), indent=2) + "\n"
+        # Scrapers must never see a half-written file.
+        partial_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(partial_path, "w") as metrics_file:
+            metrics_file.write(content)
+        os.replace(partial_path, path)
+
+
+def _metric_name(name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _label_value(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Span:
+    __slots__ = ("_recorder", "_name", "_record", "_start")
+
+    def __init__(self, recorder, name, record):
+        self._recorder = recorder
+        self._name = name
+        self._record = record
+
+    def __enter__(self):
+        self._start = self._recorder.clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._record(self._name, self._recorder.clock() - self._start)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+# The active Recorder, or None while recording is off.
+_recorder = None
+
+
+def _write_at_exit(recorder, path):
+    try:
+        recorder.write(path)
+    except OSError as err:
+        print("Warning: Unable to write metrics to {}: {}".format(path, err))
+
+
+def start(path, command):
+    """Start recording, to be written to path when the process exits.
+
+    :param path: File to write metrics to, or None to leave recording off (str)
+    :param command: Name of the command being measured (str)
+
+    :returns: The Recorder, or None if path is None
+    """
+    global _recorder
+    if not path:
+        return None
+    _recorder = Recorder(command)
+    atexit.register(_write_at_exit, _recorder, os.path.abspath(path))
+    return _recorder
+
+
+def enabled():
+    """Return whether metrics are being recorded."""
+    return _recorder is not None
+
+
+def span(name):
+    """Time a phase: `with metrics.span("download"): ...`"""
+    if _recorder is None:
+        return _NULL_SPAN
+    return _Span(_recorder, name, _recorder.record_span)
+
+
+def timed(name):
+    """Time a single request into a latency histogram, like span()."""
+    if _recorder is None:
+        return _NULL_SPAN
+    return _Span(_recorder, name, _recorder.observe)
+
+
+def count(name, value=1):
+    """Add value to a counter."""
+    if _recorder is not None:
+        _recorder.add(name, value)
+
+
+def observe(name, seconds):
+    """Add a duration measured elsewhere to a latency histogram."""
+    if _recorder is not None:
+        _recorder.observe(name, seconds)
@@ -0,0 +1,117 @@
+"""On-disk cache of METS file indexes for dip-metadata reruns.
+
+Entries are keyed by the SHA-256 of the METS file, the METS parser used and
+that parser's output version, so an edited METS file or a changed parser
+never reuses a stale entry. Each entry is a gzipped JSON list of file
+records. Reading an entry touches it, and the least recently used entries
+are removed to keep the cache under its size cap.
+"""
+import gzip
+import hashlib
+import json
+import os
+
+from dip_mungers.mets_index import FileRecord
+
+# Bump when the records extracted from METS files change.
+FORMAT_VERSION = 1
+
+HASH_CHUNK_SIZE = 1024 * 1024
+ENTRY_SUFFIX = ".json.gz"
+
+RECORD_FIELDS = ("file_uuid", "label") + FileRecord.PROPERTIES
+
+
+def hash_file(path):
+    """Return the SHA-256 hex digest of a file.
+
+    :param path: Path to file (str)
+
+    :returns: Hex digest (str)
+    """
+    hasher = hashlib.sha256()
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class METSCache:
+    """Size-capped directory of METS file indexes keyed by content hash."""
+
+    def __init__(self, directory, max_size):
+        """
+        :param directory: Cache directory, created if missing (str)
+        :param max_size: Size cap for all entries, in bytes (int)
+        """
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def _entry_path(self, digest, mets_parser):
+        name = "{}-{}-v{}{}".format(digest, mets_parser, FORMAT_VERSION, ENTRY_SUFFIX)
+        return os.path.join(self.directory, name)
+
+    def load(self, digest, mets_parser):
+        """Return the cached index for a METS file, if any.
+
+        :param digest: SHA-256 hex digest of the METS file (str)
+        :param mets_parser: Name of the parser that built the index (str)
+
+        :returns: Dictionary of file UUID to FileRecord, or None on a miss
+        """
+        path = self._entry_path(digest, mets_parser)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as entry:
+                rows = json.load(entry)
+        except (OSError, ValueError):
+            return None
+        os.utime(path)
+
+        records = {}
+        for row in rows:
+            values = dict(zip(RECORD_FIELDS, row))
+            records[values["file_uuid"]] = FileRecord(**values)
+        return records
+
+    def store(self, digest, mets_parser, records):
+        """Save the index for a METS file, then evict to fit the size cap.
+
+        :param digest: SHA-256 hex digest of the METS file (str)
+        :param mets_parser: Name of the parser that built the index (str)
+        :param records: Dictionary of file UUID to FileRecord
+        """
+        path = self._entry_path(digest, mets_parser)
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        rows = [
+            [getattr(record, field) for field in RECORD_FIELDS]
+            for record in records.values()
+        ]
+        with gzip.open(temp_path, "wt", encoding="utf-8") as entry:
+            json.dump(rows, entry, separators=(",", ":"))
+        os.replace(temp_path, path)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits its cap."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(ENTRY_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(size for _, size, _ in entries)
+        # Never evict the newest entry, which is the one just used.
+        for _, size, path in sorted(entries)[:-1]:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
@@ -0,0 +1,157 @@
+"""Streaming index of the file metadata dip-metadata needs from a METS file.
+
+metsrw builds the full object graph of a METS document, which for METS
+files of several hundred MB takes gigabytes of memory. This reader makes a
+single lxml iterparse pass instead, keeping only a small record per file and
+clearing elements as soon as they have been read, so memory use stays flat
+as the METS file grows.
+"""
+from lxml import etree
+
+METS_NAMESPACE = "http://www.loc.gov/METS/"
+FILE_ID_PREFIX = "file-"
+
+AMDSEC_TAG = "{{{}}}amdSec".format(METS_NAMESPACE)
+FILE_TAG = "{{{}}}file".format(METS_NAMESPACE)
+DIV_TAG = "{{{}}}div".format(METS_NAMESPACE)
+FPTR_TAG = "{{{}}}fptr".format(METS_NAMESPACE)
+
+# PREMIS elements read from each object, mapped to FileRecord attributes.
+# Matched by local name so PREMIS 2 and 3 documents both work.
+PREMIS_ELEMENTS = {
+    "size": "size",
+    "formatName": "format_name",
+    "formatVersion": "format_version",
+    "formatRegistryName": "format_registry_name",
+    "formatRegistryKey": "format_registry_key",
+}
+
+
+class FileRecord:
+    """Label and PREMIS properties of one file in a METS document."""
+
+    __slots__ = (
+        "file_uuid",
+        "label",
+        "size",
+        "format_name",
+        "format_version",
+        "format_registry_name",
+        "format_registry_key",
+    )
+
+    PROPERTIES = (
+        "size",
+        "format_name",
+        "format_version",
+        "format_registry_name",
+        "format_registry_key",
+    )
+
+    def __init__(self, file_uuid, label=None, **properties):
+        self.file_uuid = file_uuid
+        self.label = label
+        for prop in self.PROPERTIES:
+            setattr(self, prop, properties.get(prop))
+
+    def properties(self):
+        """Return the PREMIS properties that have a value.
+
+        :returns: Properties dictionary
+        """
+        return {
+            prop: getattr(self, prop)
+            for prop in self.PROPERTIES
+            if getattr(self, prop)
+        }
+
+
+def _local_name(tag):
+    return tag.rpartition("}")[2]
+
+
+def _premis_properties(amdsec):
+    """Read the first PREMIS object's properties from an amdSec element."""
+    for element in amdsec.iter():
+        if not isinstance(element.tag, str) or _local_name(element.tag) != "object":
+            continue
+        if "premis" not in element.tag:
+            continue
+        properties = {}
+        for child in element.iter():
+            if not isinstance(child.tag, str):
+                continue
+            prop = PREMIS_ELEMENTS.get(_local_name(child.tag))
+            if prop and prop not in properties and child.text:
+                properties[prop] = child.text.strip()
+        return properties
+    return None
+
+
+def _release(element):
+    """Clear an element and drop already-processed siblings before it."""
+    element.clear()
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def read_index(metspath):
+    """Build a file UUID index from a METS file in one streaming pass.
+
+    Only files that have a PREMIS object and a structMap label are indexed,
+    matching the entries dip-metadata could upload from a metsrw document.
+
+    :param metspath: Path to METS file (str)
+
+    :returns: Dictionary of file UUID to FileRecord
+
+    :raises lxml.etree.Error: If the METS file cannot be parsed
+    """
+    amdsec_properties = {}
+    file_amdsecs = {}
+    labels = {}
+    div_labels = []
+
+    context = etree.iterparse(
+        metspath, events=("start", "end"), huge_tree=True, remove_comments=True
+    )
+    for event, element in context:
+        tag = element.tag
+        if event == "start":
+            if tag == DIV_TAG:
+                div_labels.append(element.get("LABEL"))
+            continue
+
+        if tag == AMDSEC_TAG:
+            properties = _premis_properties(element)
+            if properties is not None:
+                amdsec_properties[element.get("ID")] = properties
+            _release(element)
+        elif tag == FILE_TAG:
+            file_id = element.get("ID", "")
+            if file_id.startswith(FILE_ID_PREFIX):
+                file_uuid = file_id[len(FILE_ID_PREFIX):]
+                file_amdsecs[file_uuid] = tuple(element.get("ADMID", "").split())
+            _release(element)
+        elif tag == FPTR_TAG:
+            file_id = element.get("FILEID", "")
+            if file_id.startswith(FILE_ID_PREFIX) and div_labels:
+                labels.setdefault(file_id[len(FILE_ID_PREFIX):], div_labels[-1])
+        elif tag == DIV_TAG:
+            div_labels.pop()
+            _release(element)
+    del context
+
+    index = {}
+    for file_uuid, amdsec_ids in file_amdsecs.items():
+        label = labels.get(file_uuid)
+        if label is None:
+            continue
+        for amdsec_id in amdsec_ids:
+            properties = amdsec_properties.get(amdsec_id)
+            if properties is not None:
+                index[file_uuid] = FileRecord(file_uuid, label, **properties)
+                break
+    return index
@@ -0,0 +1,555 @@
+"""Background agent that keeps dip-upload's SSH session to AtoM open.
+
+Logging in through the jump server takes two handshakes and two password
+prompts. The agent does this once, then serves new channels on the same
+transports to later dip-upload runs over a Unix socket only the user can
+open, so repeated uploads and unattended batch jobs skip connection setup.
+
+Each connection to the socket carries one channel. The client sends a
+request frame naming a command or subsystem, then the channel's data flows
+as frames in both directions until the agent sends the exit status.
+AgentClient, AgentTransport and AgentChannel mimic the parts of paramiko's
+SSHClient, Transport and Channel that dip-upload uses, so transfers work the
+same either way. The agent answers sudo password prompts itself, on pty
+channels or on stderr of commands whose sudo prompt contains SUDO_PROMPT, so
+clients never need the password.
+"""
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+from paramiko import SSHException
+from paramiko.channel import ChannelFile, ChannelStderrFile
+from paramiko.util import asbytes
+
+try:
+    from paramiko.channel import ChannelStdinFile
+except ImportError:  # paramiko < 2.11
+    ChannelStdinFile = ChannelFile
+
+DEFAULT_IDLE_TIMEOUT_HOURS = 8
+KEEPALIVE_INTERVAL = 60
+SUDO_PROMPT = "[sudo] password"
+
+RECV_SIZE = 64 * 1024
+HEADER = struct.Struct("!cI")
+
+# Frame types. Client to agent:
+REQUEST = b"q"
+STDIN = b"i"
+EOF = b"e"
+# Agent to client:
+REPLY = b"p"
+STDOUT = b"o"
+STDERR = b"r"
+EXIT = b"x"
+
+
+class AgentError(SSHException):
+    pass
+
+
+def socket_path(directory, username, hostname):
+    """Return the socket path of the agent for a user on an AtoM server.
+
+    :param directory: Directory for agent sockets (str)
+    :param username: User logged in to the AtoM server (str)
+    :param hostname: AtoM server hostname (str)
+
+    :returns: Socket path (str)
+    """
+    return os.path.join(directory, "{}@{}.sock".format(username, hostname))
+
+
+def _send_frame(sock, kind, payload=b""):
+    sock.sendall(HEADER.pack(kind, len(payload)) + payload)
+
+
+def _recv_exactly(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError("agent connection closed")
+        data += chunk
+    return data
+
+
+def _recv_frame(sock):
+    kind, size = HEADER.unpack(_recv_exactly(sock, HEADER.size))
+    return kind, _recv_exactly(sock, size) if size else b""
+
+
+class _ChannelHandler(socketserver.BaseRequestHandler):
+    """Serve one channel, or a control request, for one socket connection."""
+
+    def handle(self):
+        server = self.server
+        try:
+            kind, payload = _recv_frame(self.request)
+        except EOFError:
+            return
+        if kind != REQUEST:
+            return
+        request = json.loads(payload.decode("utf-8"))
+
+        if request["type"] == "status":
+            _send_frame(self.request, REPLY, json.dumps(server.status()).encode("utf-8"))
+            return
+        if request["type"] == "stop":
+            _send_frame(self.request, REPLY, b"{}")
+            threading.Thread(target=server.shutdown, daemon=True).start()
+            return
+
+        server.touch(1)
+        try:
+            self._serve_channel(request)
+        finally:
+            server.touch(-1)
+
+    def _serve_channel(self, request):
+        server = self.server
+        send_lock = threading.Lock()
+
+        def _send(kind, payload=b""):
+            with send_lock:
+                _send_frame(self.request, kind, payload)
+
+        try:
+            channel = server.transport.open_session()
+            if request.get("pty"):
+                channel.get_pty()
+            if request["type"] == "subsystem":
+                channel.invoke_subsystem(request["name"])
+            else:
+                channel.exec_command(request["command"])
+        except Exception as err:
+            _send(REPLY, json.dumps({"error": str(err)}).encode("utf-8"))
+            return
+        _send(REPLY, b"{}")
+
+        # sudo prompts on the pty, or on stderr for commands that give sudo
+        # -p a prompt of their own containing SUDO_PROMPT.
+        answer_sudo = server.password is not None and (
+            bool(request.get("pty")) or SUDO_PROMPT in request.get("command", "")
+        )
+
+        def _pump(read, kind):
+            try:
+                for chunk in iter(lambda: read(RECV_SIZE), b""):
+                    if answer_sudo:
+                        if SUDO_PROMPT in chunk.decode("utf-8", "replace"):
+                            channel.sendall("{}\n".format(server.password).encode("utf-8"))
+                    _send(kind, chunk)
+            except (OSError, EOFError):
+                pass
+
+        readers = [
+            threading.Thread(target=_pump, args=(channel.recv, STDOUT), daemon=True),
+            threading.Thread(
+                target=_pump, args=(channel.recv_stderr, STDERR), daemon=True
+            ),
+        ]
+        for reader in readers:
+            reader.start()
+
+        # Forward the client's input until it closes its side.
+        def _forward_input():
+            try:
+                while True:
+                    kind, payload = _recv_frame(self.request)
+                    if kind == STDIN:
+                        channel.sendall(payload)
+                    elif kind == EOF:
+                        channel.shutdown_write()
+            except (OSError, EOFError):
+                # The client went away; stop the remote command.
+                channel.close()
+
+        threading.Thread(target=_forward_input, daemon=True).start()
+
+        for reader in readers:
+            reader.join()
+        status = channel.recv_exit_status()
+        channel.close()
+        try:
+            _send(EXIT, struct.pack("!i", status))
+        except OSError:
+            pass
+
+
+class AgentServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server handing out channels on a connected SSH client."""
+
+    daemon_threads = True
+
+    def __init__(self, path, target, password, idle_timeout):
+        """
+        :param path: Socket path, created with mode 0600 (str)
+        :param target: Connected paramiko SSHClient to the AtoM server
+        :param password: Password for sudo prompts, or None (str)
+        :param idle_timeout: Seconds without channels before exiting (float)
+        """
+        self.path = path
+        self.target = target
+        self.transport = target.get_transport()
+        self.password = password
+        self.idle_timeout = idle_timeout
+        self.started = time.time()
+        self._active = 0
+        self._last_active = time.monotonic()
+        self._lock = threading.Lock()
+
+        _make_private_directory(os.path.dirname(path))
+        _remove_stale_socket(path)
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(path, _ChannelHandler)
+        finally:
+            os.umask(old_umask)
+
+    def touch(self, delta):
+        with self._lock:
+            self._active += delta
+            self._last_active = time.monotonic()
+
+    def status(self):
+        return {
+            "pid": os.getpid(),
+            "started": self.started,
+            "active_channels": self._active,
+            "peer": list(self.transport.getpeername()),
+        }
+
+    def _watch(self):
+        """Shut down once idle for too long or once the SSH session drops."""
+        while True:
+            time.sleep(1)
+            with self._lock:
+                idle = self._active == 0 and (
+                    time.monotonic() - self._last_active > self.idle_timeout
+                )
+            if idle or not self.transport.is_active():
+                self.shutdown()
+                return
+
+    def serve(self):
+        self.transport.set_keepalive(KEEPALIVE_INTERVAL)
+        threading.Thread(target=self._watch, daemon=True).start()
+        try:
+            self.serve_forever()
+        finally:
+            self.server_close()
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+def _make_private_directory(directory):
+    """Create the socket directory, or check an existing one, so that only
+    the user can reach the socket.
+
+    makedirs leaves an existing directory's mode alone, and another user who
+    owns the directory could swap the socket for one of their own.
+
+    :raises AgentError: If the directory belongs to another user
+    """
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    status = os.stat(directory)
+    if status.st_uid != os.getuid():
+        raise AgentError(
+            "{} belongs to another user; set [AGENT] DIRECTORY to a directory "
+            "of your own".format(directory)
+        )
+    if status.st_mode & 0o077:
+        os.chmod(directory, 0o700)
+
+
+def _remove_stale_socket(path):
+    if not os.path.exists(path):
+        return
+    if _request(path, {"type": "status"}) is not None:
+        raise AgentError("an agent is already running at {}".format(path))
+    os.remove(path)
+
+
+def _request(path, request):
+    """Send a control request to an agent.
+
+    :returns: Reply dictionary, or None if no agent answers at path
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        _send_frame(sock, REQUEST, json.dumps(request).encode("utf-8"))
+        _, payload = _recv_frame(sock)
+        return json.loads(payload.decode("utf-8"))
+    except (OSError, EOFError, ValueError):
+        return None
+    finally:
+        sock.close()
+
+
+def start_daemon(connect, path, idle_timeout):
+    """Log in, then keep the session open in a background process.
+
+    The process forks before connecting, because paramiko's transport
+    threads would not survive a fork. The child logs in on the current
+    terminal, so password and multi-factor prompts work as usual, and
+    detaches once the agent is listening.
+
+    :param connect: Callable returning a tuple of (jump SSHClient, target
+        SSHClient, password or None); called in the background process
+    :param path: Socket path (str)
+    :param idle_timeout: Seconds without channels before exiting (float)
+
+    :returns: Process ID of the agent (int)
+
+    :raises AgentError: If the agent could not log in or listen
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid:
+        os.close(write_fd)
+        with os.fdopen(read_fd, "rb") as ready:
+            message = ready.read().decode("utf-8", "replace")
+        if message != "ok":
+            os.waitpid(pid, 0)
+            raise AgentError(message or "agent exited while starting")
+        return pid
+
+    os.close(read_fd)
+    try:
+        jumper, target, password = connect()
+        server = AgentServer(path, target, password, idle_timeout)
+    except BaseException as err:
+        os.write(write_fd, str(err).encode("utf-8") or b"login failed")
+        os._exit(1)
+
+    os.setsid()
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+    os.write(write_fd, b"ok")
+    os.close(write_fd)
+    try:
+        server.serve()
+    finally:
+        target.close()
+        jumper.close()
+        os._exit(0)
+
+
+def stop_agent(path):
+    """Ask the agent at path to exit.
+
+    :returns: Whether an agent was running (bool)
+    """
+    return _request(path, {"type": "stop"}) is not None
+
+
+def connect_agent(path):
+    """Return an AgentClient for the agent at path, if one is running.
+
+    :param path: Socket path (str)
+
+    :returns: AgentClient, or None
+    """
+    status = _request(path, {"type": "status"})
+    if status is None:
+        return None
+    return AgentClient(path, tuple(status["peer"]))
+
+
+class AgentChannel:
+    """Channel opened through the agent, with paramiko Channel's interface."""
+
+    def __init__(self, path):
+        self.path = path
+        self.closed = False
+        self.timeout = None
+        self._pty = False
+        self._sock = None
+        self._stdout = bytearray()
+        self._stderr = bytearray()
+        self._done = False
+        self._exit_status = None
+        self._condition = threading.Condition()
+        self._send_lock = threading.Lock()
+
+    def get_pty(self, *args, **kwargs):
+        self._pty = True
+
+    def get_name(self):
+        return "agent:{}".format(self.path)
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def gettimeout(self):
+        return self.timeout
+
+    def setblocking(self, blocking):
+        self.timeout = None if blocking else 0.0
+
+    def exec_command(self, command):
+        if isinstance(command, bytes):
+            command = command.decode("utf-8")
+        self._open({"type": "exec", "command": command, "pty": self._pty})
+
+    def invoke_subsystem(self, name):
+        self._open({"type": "subsystem", "name": name, "pty": self._pty})
+
+    def _open(self, request):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._sock.connect(self.path)
+            _send_frame(self._sock, REQUEST, json.dumps(request).encode("utf-8"))
+            _, payload = _recv_frame(self._sock)
+        except (OSError, EOFError) as err:
+            self.close()
+            raise AgentError("Unable to reach session agent: {}".format(err))
+        reply = json.loads(payload.decode("utf-8"))
+        if "error" in reply:
+            self.close()
+            raise AgentError(reply["error"])
+        threading.Thread(target=self._read_frames, daemon=True).start()
+
+    def _read_frames(self):
+        try:
+            while True:
+                kind, payload = _recv_frame(self._sock)
+                with self._condition:
+                    if kind == STDOUT:
+                        self._stdout += payload
+                    elif kind == STDERR:
+                        self._stderr += payload
+                    elif kind == EXIT:
+                        self._exit_status = struct.unpack("!i", payload)[0]
+                    self._condition.notify_all()
+                if kind == EXIT:
+                    break
+        except (OSError, EOFError):
+            pass
+        with self._condition:
+            self._done = True
+            if self._exit_status is None:
+                self._exit_status = -1
+            self._condition.notify_all()
+
+    def _take(self, buffer, size):
+        with self._condition:
+            if not self._condition.wait_for(
+                lambda: buffer or self._done, self.timeout
+            ):
+                raise socket.timeout()
+            data = bytes(buffer[:size])
+            del buffer[:size]
+            return data
+
+    def recv(self, nbytes):
+        return self._take(self._stdout, nbytes)
+
+    def recv_stderr(self, nbytes):
+        return self._take(self._stderr, nbytes)
+
+    def recv_ready(self):
+        with self._condition:
+            return bool(self._stdout)
+
+    def recv_stderr_ready(self):
+        with self._condition:
+            return bool(self._stderr)
+
+    def exit_status_ready(self):
+        with self._condition:
+            return self._done
+
+    def recv_exit_status(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self._done)
+            return self._exit_status
+
+    def send(self, data):
+        data = asbytes(data)
+        with self._send_lock:
+            try:
+                _send_frame(self._sock, STDIN, data)
+            except (OSError, AttributeError):
+                raise OSError("Socket is closed")
+        return len(data)
+
+    def sendall(self, data):
+        self.send(data)
+
+    def shutdown_write(self):
+        with self._send_lock:
+            try:
+                _send_frame(self._sock, EOF)
+            except (OSError, AttributeError):
+                raise OSError("Socket is closed")
+
+    def makefile(self, *params):
+        return ChannelFile(*([self] + list(params)))
+
+    def makefile_stderr(self, *params):
+        return ChannelStderrFile(*([self] + list(params)))
+
+    def makefile_stdin(self, *params):
+        return ChannelStdinFile(*([self] + list(params)))
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+        self.closed = True
+        with self._condition:
+            if not self._done:
+                self._done = True
+                self._exit_status = -1
+            self._condition.notify_all()
+
+
+class AgentTransport:
+    """Stand-in for the paramiko Transport of the agent's session."""
+
+    def __init__(self, path, peer):
+        self.path = path
+        self.peer = peer
+
+    def open_session(self, window_size=None, max_packet_size=None, timeout=None):
+        return AgentChannel(self.path)
+
+    def getpeername(self):
+        return self.peer
+
+    def is_active(self):
+        return True
+
+
+class AgentClient:
+    """Stand-in for a paramiko SSHClient connected to the AtoM server."""
+
+    def __init__(self, path, peer):
+        self.path = path
+        self._transport = AgentTransport(path, peer)
+
+    def get_transport(self):
+        return self._transport
+
+    def exec_command(self, command, bufsize=-1, get_pty=False):
+        channel = self._transport.open_session()
+        if get_pty:
+            channel.get_pty()
+        channel.exec_command(command)
+        stdin = channel.makefile_stdin("wb", bufsize)
+        stdout = channel.makefile("r", bufsize)
+        stderr = channel.makefile_stderr("r", bufsize)
+        return stdin, stdout, stderr
+
+    def close(self):
+        pass
@@ -0,0 +1,237 @@
+"""Named SSH transport settings for dip-upload's jump host connections.
+
+Throughput through the jump host depends on the cipher and MAC in use, on
+whether the stream is compressed, and on the channel window and packet
+sizes. Profiles are read from [TRANSPORT_PROFILE:<name>] sections of the
+config file, and [TRANSPORT] PROFILE names the one to use. calibrate() times
+a synthetic upload with each profile so the fastest can be saved there.
+"""
+import os
+import re
+import time
+
+from paramiko import Transport
+from paramiko.common import DEFAULT_MAX_PACKET_SIZE, DEFAULT_WINDOW_SIZE
+
+SECTION_PREFIX = "TRANSPORT_PROFILE:"
+DEFAULT_PROFILE_NAME = "default"
+
+# Size of the repeated block of the calibration payload. Half of it is
+# random and half repetitive text, roughly like images plus METS files.
+PAYLOAD_BLOCK_SIZE = 1024 * 1024
+
+
+class TransportProfile:
+    """Cipher, MAC, compression and window settings for SSH connections."""
+
+    def __init__(
+        self,
+        name,
+        ciphers=None,
+        macs=None,
+        compress=False,
+        window_size=None,
+        max_packet_size=None,
+    ):
+        """
+        :param name: Profile name (str)
+        :param ciphers: Ciphers to allow, or None for paramiko's (list)
+        :param macs: MACs to allow, or None for paramiko's (list)
+        :param compress: Compress the SSH stream (bool)
+        :param window_size: Channel window size in bytes, or None (int)
+        :param max_packet_size: Maximum channel packet size in bytes, or None (int)
+
+        :raises ValueError: If a cipher or MAC is not supported by paramiko
+        """
+        self.name = name
+        self.ciphers = ciphers
+        self.macs = macs
+        self.compress = compress
+        self.window_size = window_size
+        self.max_packet_size = max_packet_size
+
+        # paramiko only offers a way to disable algorithms, so the allowed
+        # ones are turned into the complement of its supported list.
+        self._disabled = {}
+        for kind, allowed, supported in (
+            ("ciphers", ciphers, Transport._preferred_ciphers),
+            ("macs", macs, Transport._preferred_macs),
+        ):
+            if not allowed:
+                continue
+            unknown = set(allowed) - set(supported)
+            if unknown:
+                raise ValueError(
+                    "profile {} has unsupported {}: {}".format(
+                        name, kind, ", ".join(sorted(unknown))
+                    )
+                )
+            self._disabled[kind] = [alg for alg in supported if alg not in allowed]
+
+    def __str__(self):
+        return self.name
+
+    def connect_kwargs(self):
+        """Return the SSHClient.connect arguments for this profile.
+
+        :returns: Dictionary with "compress" and "disabled_algorithms"
+        """
+        return {
+            "compress": self.compress,
+            "disabled_algorithms": self._disabled or None,
+        }
+
+    def apply(self, transport):
+        """Set the window and packet sizes used for new channels.
+
+        :param transport: Connected paramiko Transport
+        """
+        transport.default_window_size = self.window_size or DEFAULT_WINDOW_SIZE
+        transport.default_max_packet_size = (
+            self.max_packet_size or DEFAULT_MAX_PACKET_SIZE
+        )
+
+
+def _split(value):
+    return [item.strip() for item in value.split(",") if item.strip()] or None
+
+
+def load_profiles(config):
+    """Read the transport profiles defined in a config file.
+
+    A profile named "default", with paramiko's settings, is always present
+    unless the config file defines its own.
+
+    :param config: configparser.ConfigParser object
+
+    :returns: Dictionary of profile name to TransportProfile
+
+    :raises ValueError: If a profile has an invalid setting
+    """
+    profiles = {DEFAULT_PROFILE_NAME: TransportProfile(DEFAULT_PROFILE_NAME)}
+    for section in config.sections():
+        if not section.startswith(SECTION_PREFIX):
+            continue
+        name = section[len(SECTION_PREFIX):]
+        profiles[name] = TransportProfile(
+            name,
+            ciphers=_split(config.get(section, "CIPHERS", fallback="")),
+            macs=_split(config.get(section, "MACS", fallback="")),
+            compress=config.getboolean(section, "COMPRESS", fallback=False),
+            window_size=config.getint(section, "WINDOW_SIZE", fallback=None),
+            max_packet_size=config.getint(section, "MAX_PACKET_SIZE", fallback=None),
+        )
+    return profiles
+
+
+def selected_profile_name(config):
+    """Return the profile named in [TRANSPORT] PROFILE, or the default."""
+    return config.get("TRANSPORT", "PROFILE", fallback=DEFAULT_PROFILE_NAME)
+
+
+def save_selected_profile(config_file, name):
+    """Set [TRANSPORT] PROFILE in a config file, keeping everything else.
+
+    configparser would drop comments when writing the file back, so the
+    setting is edited in place instead.
+
+    :param config_file: Path to config file (str)
+    :param name: Profile name (str)
+    """
+    with open(config_file, "r") as source:
+        lines = source.readlines()
+
+    section = None
+    section_end = None
+    for index, line in enumerate(lines):
+        header = re.match(r"\s*\[([^\]]+)\]", line)
+        if header:
+            if section == "TRANSPORT":
+                section_end = index
+            section = header.group(1)
+            continue
+        if section == "TRANSPORT" and re.match(r"\s*PROFILE\s*[=:]", line, re.I):
+            lines[index] = "PROFILE = {}\n".format(name)
+            break
+    else:
+        if section == "TRANSPORT" and section_end is None:
+            section_end = len(lines)
+        if section_end is None:
+            if lines and not lines[-1].endswith("\n"):
+                lines[-1] += "\n"
+            lines.extend(["\n", "[TRANSPORT]\n", "PROFILE = {}\n".format(name)])
+        else:
+            while section_end > 0 and not lines[section_end - 1].strip():
+                section_end -= 1
+            lines.insert(section_end, "PROFILE = {}\n".format(name))
+
+    temp_path = config_file + ".tmp"
+    with open(temp_path, "w") as target:
+        target.writelines(lines)
+    os.replace(temp_path, config_file)
+
+
+def _payload_block():
+    half = PAYLOAD_BLOCK_SIZE // 2
+    text = b"<premis:objectCharacteristics>0123456789</premis:objectCharacteristics>\n"
+    return os.urandom(half) + (text * (half // len(text) + 1))[:half]
+
+
+def time_upload(ssh_client, size):
+    """Time sending size bytes of synthetic data to `cat > /dev/null`.
+
+    :param ssh_client: Connected paramiko SSHClient
+    :param size: Bytes to send (int)
+
+    :returns: Seconds taken, including the remote command finishing (float)
+    """
+    block = _payload_block()
+    channel = ssh_client.get_transport().open_session()
+    try:
+        start_time = time.monotonic()
+        channel.exec_command("cat > /dev/null")
+        remaining = size
+        while remaining > 0:
+            chunk = block[:remaining]
+            channel.sendall(chunk)
+            remaining -= len(chunk)
+        channel.shutdown_write()
+        channel.recv_exit_status()
+        return time.monotonic() - start_time
+    finally:
+        channel.close()
+
+
+def calibrate(connect, profiles, size):
+    """Time a synthetic upload with each profile.
+
+    :param connect: Callable taking a TransportProfile and returning a
+        connected SSHClient, which calibrate closes
+    :param profiles: Profiles to try (list of TransportProfile)
+    :param size: Bytes to send with each profile (int)
+
+    :returns: List of (profile, seconds) tuples, fastest first; profiles
+        that failed to connect or to send are left out
+    """
+    timings = []
+    for profile in profiles:
+        try:
+            client = connect(profile)
+        except Exception as err:
+            print("Warning: Unable to connect with profile {}: {}".format(profile, err))
+            continue
+        try:
+            seconds = time_upload(client, size)
+        except Exception as err:
+            # E.g. the profile's compression or window size upset the server.
+            print("Warning: Unable to send with profile {}: {}".format(profile, err))
+            continue
+        finally:
+            client.close()
+        print(
+            "Profile {}: {:.1f} MB/s".format(
+                profile, size / 1024 ** 2 / max(seconds, 0.001)
+            )
+        )
+        timings.append((profile, seconds))
+    return sorted(timings, key=lambda timing: timing[1])
@@ -0,0 +1,422 @@
+"""Direct Storage Service API calls not covered by AMClient.
+
+AMClient always writes package downloads to disk before returning and has
+no way to share HTTP connections, so Storage Service requests are made here
+instead. Credentials are read from an existing AMClient instance so callers
+only configure one client; a PooledSession set as its ``session`` attribute
+is used for the requests, or a shared default session otherwise.
+"""
+import hashlib
+import os
+import time
+
+import requests
+
+from dip_mungers import metrics
+from dip_mungers.http_session import PooledSession
+
+# Size of the reads taken from streaming responses.
+CHUNK_SIZE = 64 * 1024
+
+# Number of packages requested per page of package listings.
+PAGE_SIZE = 100
+
+# Number of connection attempts in a row without progress made by resumable
+# downloads, and the seconds waited before the first retry (doubled on each
+# further retry, and reset once a retry makes progress).
+DOWNLOAD_ATTEMPTS = 5
+RETRY_DELAY = 2
+
+# Suffix for incomplete downloads kept around for resuming.
+PARTIAL_SUFFIX = ".partial"
+
+
+class DownloadError(Exception):
+    pass
+
+
+class ChecksumMismatchError(DownloadError):
+    pass
+
+
+_default_session = None
+
+
+def session(amclient):
+    """Return the HTTP session to send an AMClient's requests through.
+
+    :param amclient: AMClient object instance
+
+    :returns: PooledSession
+    """
+    global _default_session
+    client_session = getattr(amclient, "session", None)
+    if client_session is not None:
+        return client_session
+    if _default_session is None:
+        _default_session = PooledSession()
+    return _default_session
+
+
+def auth_headers(amclient):
+    """Return Storage Service API authentication headers.
+
+    :param amclient: AMClient object instance
+
+    :returns: Headers dictionary
+    """
+    return {
+        "Authorization": "ApiKey {}:{}".format(
+            amclient.ss_user_name, amclient.ss_api_key
+        )
+    }
+
+
+def package_url(amclient, package_uuid, endpoint=""):
+    """Return the Storage Service API URL for a package.
+
+    :param amclient: AMClient object instance
+    :param package_uuid: Package UUID (str)
+    :param endpoint: Optional endpoint below the package, e.g. "download" (str)
+
+    :returns: URL (str)
+    """
+    url = "{}/api/v2/file/{}/".format(amclient.ss_url.rstrip("/"), package_uuid)
+    if endpoint:
+        url = "{}{}/".format(url, endpoint)
+    return url
+
+
+def package_checksum(package):
+    """Return the checksum the Storage Service reports for a package.
+
+    Storage Service versions differ in whether and where they expose a
+    package checksum, so both the package itself and its misc_attributes
+    are checked.
+
+    :param package: Package dictionary from Storage Service
+
+    :returns: Tuple of (algorithm, hex digest), or (None, None) if unknown
+    """
+    for source in (package, package.get("misc_attributes") or {}):
+        checksum = source.get("checksum")
+        algorithm = source.get("checksum_algorithm")
+        if checksum and algorithm:
+            return algorithm.lower().replace("-", ""), checksum.lower()
+    return None, None
+
+
+def new_hasher(algorithm):
+    """Return a hashlib object for a Storage Service checksum algorithm.
+
+    :param algorithm: Algorithm name, e.g. "sha256" (str)
+
+    :returns: hashlib hash object, or None if the algorithm is unknown
+    """
+    try:
+        return hashlib.new(algorithm)
+    except (TypeError, ValueError):
+        return None
+
+
+def verify_checksum(hasher, checksum, package_uuid):
+    """Compare a finished hash against an expected checksum.
+
+    :param hasher: hashlib hash object, or None to skip verification
+    :param checksum: Expected hex digest, or None to skip verification (str)
+    :param package_uuid: Package UUID, for error messages (str)
+
+    :raises ChecksumMismatchError: If the digests differ
+    """
+    if hasher is None or not checksum:
+        print(
+            "Warning: No usable checksum reported for package {}; "
+            "skipping verification".format(package_uuid)
+        )
+        return
+    if hasher.hexdigest() != checksum:
+        raise ChecksumMismatchError(
+            "Checksum mismatch for package {}: expected {} {}, got {}".format(
+                package_uuid, hasher.name, checksum, hasher.hexdigest()
+            )
+        )
+
+
+def open_download(amclient, package_uuid, start=0):
+    """Open a streaming download response for a package.
+
+    The caller is responsible for closing the response.
+
+    :param amclient: AMClient object instance
+    :param package_uuid: Package UUID (str)
+    :param start: Byte offset to request the package from (int)
+
+    :returns: requests.Response with an unread body
+    """
+    headers = auth_headers(amclient)
+    if start:
+        headers["Range"] = "bytes={}-".format(start)
+    # Times the wait for the response headers; the body is read later.
+    with metrics.timed("download_package"):
+        response = session(amclient).get(
+            package_url(amclient, package_uuid, "download"),
+            headers=headers,
+            stream=True,
+        )
+    # Let urllib3 undo any transfer encoding so readers see the tar bytes.
+    response.raw.decode_content = True
+    return response
+
+
+def open_extracted_file(amclient, package_uuid, relative_path):
+    """Open a streaming response for a single file inside a package.
+
+    The caller is responsible for closing the response.
+
+    :param amclient: AMClient object instance
+    :param package_uuid: Package UUID (str)
+    :param relative_path: Path to the file, starting with the package name (str)
+
+    :returns: requests.Response with an unread body
+    """
+    with metrics.timed("extract_file"):
+        return session(amclient).get(
+            package_url(amclient, package_uuid, "extract_file"),
+            params={"relative_path_to_file": relative_path},
+            headers=auth_headers(amclient),
+            stream=True,
+        )
+
+
+def package_contents(amclient, package_uuid):
+    """Return the relative paths of the files the Storage Service has
+    recorded for a package.
+
+    Not every package has its contents recorded, in which case the list is
+    empty.
+
+    :param amclient: AMClient object instance
+    :param package_uuid: Package UUID (str)
+
+    :returns: List of relative file paths
+
+    :raises DownloadError: If the Storage Service's answer isn't JSON, e.g. a
+        login page from a proxy in front of it
+    """
+    response = session(amclient).get(
+        package_url(amclient, package_uuid, "contents"),
+        headers=auth_headers(amclient),
+    )
+    if response.status_code != 200:
+        return []
+    try:
+        files = response.json().get("files", [])
+    except ValueError as err:
+        raise DownloadError(
+            "Invalid contents listing for package {}: {}".format(package_uuid, err)
+        )
+    paths = []
+    for entry in files:
+        path = entry.get("path") or entry.get("relative_path")
+        if path:
+            paths.append(path)
+    return paths
+
+
+def iter_packages(amclient, params, page_size=PAGE_SIZE):
+    """Yield packages from the Storage Service package listing, page by page.
+
+    :param amclient: AMClient object instance
+    :param params: Filter parameters, e.g. {"package_type": "DIP"} (dict)
+    :param page_size: Number of packages requested per page (int)
+
+    :returns: Generator of package dictionaries
+
+    :raises requests.HTTPError: If the Storage Service rejects a request
+    """
+    base_url = amclient.ss_url.rstrip("/")
+    url = "{}/api/v2/file/".format(base_url)
+    params = dict(params, limit=page_size)
+    while url:
+        with metrics.timed("list_packages"):
+            response = session(amclient).get(
+                url,
+                params=params,
+                headers=auth_headers(amclient),
+            )
+        response.raise_for_status()
+        page = response.json()
+        for package in page["objects"]:
+            yield package
+        next_path = page["meta"].get("next")
+        # The next link already carries the filter parameters.
+        url = "{}{}".format(base_url, next_path) if next_path else None
+        params = None
+
+
+def aip2dips(amclient, aip_uuid):
+    """Get all DIPs created from an AIP.
+
+    Like AMClient.aip2dips, this lists every DIP and matches on the AIP UUID
+    that ends each DIP's current_path, but over the shared HTTP session.
+
+    :param amclient: AMClient object instance
+    :param aip_uuid: AIP UUID (str)
+
+    :returns: List of DIP dictionaries
+
+    :raises requests.RequestException: If the listing cannot be fetched
+    """
+    return [
+        dip
+        for dip in iter_packages(amclient, {"package_type": "DIP"})
+        if dip["current_path"].rstrip("/").endswith(aip_uuid)
+    ]
+
+
+def _hash_file(path, hasher):
+    """Feed an existing file into a hash and return its size."""
+    size = 0
+    with open(path, "rb") as existing:
+        for chunk in iter(lambda: existing.read(CHUNK_SIZE), b""):
+            if hasher is not None:
+                hasher.update(chunk)
+            size += len(chunk)
+    return size
+
+
+def _range_total(response):
+    """Return the total size from a Content-Range header, if present."""
+    content_range = response.headers.get("Content-Range", "")
+    _, _, total = content_range.rpartition("/")
+    return int(total) if total.isdigit() else None
+
+
+def resumable_download(
+    amclient,
+    package_uuid,
+    destination,
+    checksum=None,
+    checksum_algorithm=None,
+    attempts=DOWNLOAD_ATTEMPTS,
+):
+    """Download a package to a file, resuming after dropped connections.
+
+    Data is written to ``destination + PARTIAL_SUFFIX`` and hashed as it
+    arrives. Interrupted transfers are resumed with HTTP Range requests, from
+    an earlier run's partial file too. If the server ignores the Range header,
+    or the partial file is longer than the package, the download restarts
+    from zero. The file is only moved to its final name once the checksum
+    has been verified.
+
+    :param amclient: AMClient object instance
+    :param package_uuid: Package UUID (str)
+    :param destination: Path to write the package to (str)
+    :param checksum: Expected hex digest, if known (str)
+    :param checksum_algorithm: hashlib name of the checksum algorithm (str)
+    :param attempts: Number of connection attempts in a row that make no
+        progress before giving up (int)
+
+    :returns: Number of bytes downloaded in this call (int)
+
+    :raises DownloadError: If the download cannot be completed or verified
+    """
+    partial_path = destination + PARTIAL_SUFFIX
+    hasher = new_hasher(checksum_algorithm) if checksum_algorithm else None
+
+    offset = 0
+    if os.path.exists(partial_path):
+        offset = _hash_file(partial_path, hasher)
+        if offset:
+            print("Resuming download of package {} at {} bytes".format(package_uuid, offset))
+
+    downloaded = 0
+    delay = RETRY_DELAY
+    failures = 0
+    while True:
+        attempt_offset = offset
+        try:
+            with open_download(amclient, package_uuid, start=offset) as response:
+                if response.status_code == 416 and _range_total(response) == offset:
+                    # An earlier run already fetched every byte.
+                    break
+                if response.status_code == 416 and offset:
+                    # The partial file is longer than the package, e.g. one
+                    # stored again since; resuming it can never succeed.
+                    print(
+                        "Warning: Partial download is larger than package {}; "
+                        "restarting download".format(package_uuid)
+                    )
+                    os.remove(partial_path)
+                    offset = 0
+                    hasher = new_hasher(checksum_algorithm) if checksum_algorithm else None
+                    continue
+                if response.status_code == 200 and offset:
+                    print("Warning: Storage Service ignored resume request; restarting download")
+                    offset = attempt_offset = 0
+                    hasher = new_hasher(checksum_algorithm) if checksum_algorithm else None
+                elif response.status_code not in (200, 206):
+                    raise DownloadError(
+                        "Unable to download package {} (HTTP {})".format(
+                            package_uuid, response.status_code
+                        )
+                    )
+
+                with open(partial_path, "ab" if offset else "wb") as partial:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        partial.write(chunk)
+                        if hasher is not None:
+                            hasher.update(chunk)
+                        offset += len(chunk)
+                        downloaded += len(chunk)
+            break
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        ) as err:
+            if offset > attempt_offset:
+                # Only attempts that fetch nothing count towards giving up.
+                failures = 0
+                delay = RETRY_DELAY
+            failures += 1
+            if failures == attempts:
+                raise DownloadError(
+                    "Download of package {} failed after {} attempts without progress: {}".format(
+                        package_uuid, attempts, err
+                    )
+                )
+            print(
+                "Warning: Download interrupted at {} bytes ({}); retrying in {}s".format(
+                    offset, err, delay
+                )
+            )
+            time.sleep(delay)
+            delay *= 2
+
+    try:
+        verify_checksum(hasher, checksum, package_uuid)
+    except ChecksumMismatchError:
+        # Resuming from corrupt data can never succeed, so start over next time.
+        os.remove(partial_path)
+        raise
+
+    os.replace(partial_path, destination)
+    metrics.count("storage_service_bytes", downloaded)
+    return downloaded
+
+
+class CountingReader:
+    """File-like wrapper that counts, and optionally hashes, the bytes read."""
+
+    def __init__(self, fileobj, hasher=None):
+        self._fileobj = fileobj
+        self.hasher = hasher
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        self.bytes_read += len(data)
+        if self.hasher is not None:
+            self.hasher.update(data)
+        return data
@@ -0,0 +1,683 @@
+"""Ways of copying a local DIP directory to the AtoM server over SSH.
+
+Recursive SCP waits for the server to acknowledge every file and directory,
+so a DIP of many small files spends most of its time on round trips through
+the jump host. The tar transfer instead streams the whole DIP as one tar
+archive into a remote `tar -x`, optionally gzipped on the fly. Files whose
+format is already compressed are sent in a separate, uncompressed stream so
+no CPU is wasted on them.
+
+The SFTP transfer opens several SFTP channels on the same SSH transport and
+spreads the files across them, splitting large files into parts that are
+written concurrently at their offsets, so one slow channel window no longer
+caps the throughput of the whole copy.
+
+pull_package skips the local connection entirely by having the AtoM server
+download a package from the Storage Service itself.
+
+For reruns, delta_sync compares the DIP with what an earlier run left in the
+remote staging directory, by size and then SHA-256, so only missing or
+changed files need to be sent.
+"""
+import concurrent.futures
+import gzip
+import hashlib
+import os
+import queue
+import shlex
+import tarfile
+import threading
+import time
+
+from paramiko import SFTPClient
+from scp import SCPClient
+
+from dip_mungers import metrics
+from dip_mungers.arguments import DEFAULT_SFTP_CHANNELS
+
+CHUNK_SIZE = 64 * 1024
+COMPRESS_LEVEL = 6
+
+# Files larger than this are split into parts of SFTP_PART_SIZE bytes, each
+# written by whichever SFTP channel is free.
+SFTP_SPLIT_SIZE = 64 * 1024 ** 2
+SFTP_PART_SIZE = 16 * 1024 ** 2
+SFTP_READ_SIZE = 1024 ** 2
+
+DEFAULT_HASH_WORKERS = os.cpu_count() or 4
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Extensions of formats that gzip cannot usefully shrink further.
+COMPRESSED_EXTENSIONS = frozenset(
+    (
+        ".7z", ".avi", ".bz2", ".docx", ".flac", ".gif", ".gz", ".jp2", ".jpeg",
+        ".jpg", ".m4a", ".m4v", ".mkv", ".mov", ".mp3", ".mp4", ".mpeg", ".mpg",
+        ".oga", ".ogg", ".ogv", ".pdf", ".png", ".pptx", ".rar", ".tgz", ".webm",
+        ".webp", ".xlsx", ".xz", ".zip",
+    )
+)
+
+
+# Commands the AtoM server checks pulled packages with, by hashlib name.
+REMOTE_CHECKSUM_COMMANDS = {
+    "md5": "md5sum",
+    "sha1": "sha1sum",
+    "sha224": "sha224sum",
+    "sha256": "sha256sum",
+    "sha384": "sha384sum",
+    "sha512": "sha512sum",
+}
+
+
+class TransferError(Exception):
+    pass
+
+
+class ChannelWriter:
+    """File-like object writing to a paramiko channel and counting bytes."""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.bytes_written = 0
+
+    def write(self, data):
+        # Blocks while the channel window is full, so this times flow control.
+        with metrics.timed("ssh_channel_write"):
+            self.channel.sendall(data)
+        self.bytes_written += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def is_compressed(path):
+    """Return whether a file's format is already compressed.
+
+    :param path: File path (str)
+
+    :returns: bool
+    """
+    return os.path.splitext(path)[1].lower() in COMPRESSED_EXTENSIONS
+
+
+def walk_dip(local_dip_path):
+    """List the directories and files of a DIP, relative to its root.
+
+    :param local_dip_path: Path to local DIP (str)
+
+    :returns: Tuple of (directory list, file list), in walk order
+    """
+    directories = []
+    files = []
+    for root, dirnames, filenames in os.walk(local_dip_path):
+        dirnames.sort()
+        relative_root = os.path.relpath(root, local_dip_path)
+        for dirname in dirnames:
+            directories.append(os.path.normpath(os.path.join(relative_root, dirname)))
+        for filename in sorted(filenames):
+            files.append(os.path.normpath(os.path.join(relative_root, filename)))
+    return directories, files
+
+
+def report_throughput(label, sent_bytes, seconds, payload_bytes=None):
+    """Print how much a transfer sent and how fast, and count the bytes.
+
+    The bytes are added to the "<label>_bytes" metrics counter, e.g.
+    "tar_bytes", and the payload to "<label>_payload_bytes".
+
+    :param label: What was transferred (str)
+    :param sent_bytes: Bytes sent over the connection (int)
+    :param seconds: Transfer duration (float)
+    :param payload_bytes: Size of the files sent, if it differs (int)
+    """
+    counter = label.lower().replace(" ", "_")
+    metrics.count("{}_bytes".format(counter), sent_bytes)
+    if payload_bytes is not None:
+        metrics.count("{}_payload_bytes".format(counter), payload_bytes)
+    megabytes = sent_bytes / 1024 ** 2
+    detail = ""
+    if payload_bytes is not None and payload_bytes != sent_bytes:
+        detail = " ({:.1f} MB of files)".format(payload_bytes / 1024 ** 2)
+    print(
+        "{} sent {:.1f} MB{} in {:.1f}s ({:.1f} MB/s)".format(
+            label, megabytes, detail, seconds, megabytes / max(seconds, 0.001)
+        )
+    )
+
+
+def scp_transfer(ssh_client, local_dip_path, remote_dip_path, sanitize=None):
+    """Copy a DIP with recursive SCP.
+
+    :param ssh_client: Connected paramiko SSHClient to the AtoM server
+    :param local_dip_path: Path to local DIP (str)
+    :param remote_dip_path: Remote directory to copy the DIP to (str)
+    :param sanitize: Remote path sanitizer passed to SCPClient
+
+    :raises scp.SCPException: If the copy fails
+    """
+    _, files = walk_dip(local_dip_path)
+    total_size = sum(os.path.getsize(os.path.join(local_dip_path, f)) for f in files)
+
+    start_time = time.monotonic()
+    with SCPClient(ssh_client.get_transport(), sanitize=sanitize) as scp:
+        scp.put(local_dip_path, remote_dip_path, recursive=True)
+    report_throughput("SCP", total_size, time.monotonic() - start_time)
+
+
+def _remote_tar(transport, remote_dir, compress, fill):
+    """Open a remote `tar -x` into remote_dir and write an archive to it.
+
+    :param fill: Function adding members to the open tarfile.TarFile and
+        returning the bytes of file data it added
+
+    :returns: Tuple of (bytes sent, bytes of file data)
+
+    :raises TransferError: If the remote tar fails
+    """
+    command = "mkdir -p {0} && tar -x{1}f - -C {0}".format(
+        shlex.quote(remote_dir), "z" if compress else ""
+    )
+    channel = transport.open_session()
+    try:
+        channel.exec_command(command)
+        writer = ChannelWriter(channel)
+
+        output = writer
+        if compress:
+            output = gzip.GzipFile(
+                fileobj=writer, mode="wb", compresslevel=COMPRESS_LEVEL
+            )
+        with tarfile.open(fileobj=output, mode="w|", bufsize=CHUNK_SIZE) as archive:
+            payload_bytes = fill(archive)
+        if compress:
+            output.close()
+
+        channel.shutdown_write()
+        errors = channel.makefile_stderr("rb").read().decode("utf-8", "replace")
+        status = channel.recv_exit_status()
+    finally:
+        channel.close()
+
+    if status != 0:
+        raise TransferError(
+            "remote tar exited with status {}: {}".format(status, errors.strip())
+        )
+    return writer.bytes_written, payload_bytes
+
+
+def _send_tar(transport, local_dip_path, remote_dip_path, directories, files, compress):
+    """Stream one tar archive of the given entries into a remote `tar -x`.
+
+    :returns: Tuple of (bytes sent, bytes of file data)
+    """
+
+    def _fill(archive):
+        payload_bytes = 0
+        for directory in directories:
+            archive.add(
+                os.path.join(local_dip_path, directory), directory, recursive=False
+            )
+        for relative_path in files:
+            path = os.path.join(local_dip_path, relative_path)
+            archive.add(path, relative_path, recursive=False)
+            payload_bytes += os.path.getsize(path)
+        return payload_bytes
+
+    return _remote_tar(transport, remote_dip_path, compress, _fill)
+
+
+def stream_tar(ssh_client, remote_dir, fill, compress=False):
+    """Stream a tar archive built on the fly into a remote `tar -x`.
+
+    Nothing is buffered beyond tarfile's block and the channel window, so
+    fill can copy members from a source of any size.
+
+    :param ssh_client: Connected paramiko SSHClient to the AtoM server
+    :param remote_dir: Remote directory to extract into (str)
+    :param fill: Function adding members to the open tarfile.TarFile and
+        returning the bytes of file data it added
+    :param compress: gzip the archive in transit (bool)
+
+    :returns: Tuple of (bytes sent, bytes of file data)
+
+    :raises TransferError: If the remote tar fails
+    """
+    return _remote_tar(ssh_client.get_transport(), remote_dir, compress, fill)
+
+
+def tar_transfer(
+    ssh_client, local_dip_path, remote_dip_path, compress=False, files=None
+):
+    """Copy a DIP by streaming it as tar archives into a remote `tar -x`.
+
+    With compress, files in already compressed formats are sent in a second,
+    uncompressed archive after the gzipped one.
+
+    :param ssh_client: Connected paramiko SSHClient to the AtoM server
+    :param local_dip_path: Path to local DIP (str)
+    :param remote_dip_path: Remote directory to extract the DIP to (str)
+    :param compress: gzip compressible files in transit (bool)
+    :param files: Relative paths of the files to send, or None for all (list)
+
+    :raises TransferError: If the remote tar fails
+    """
+    transport = ssh_client.get_transport()
+    directories, all_files = walk_dip(local_dip_path)
+    if files is None:
+        files = all_files
+
+    streams = [(directories, files, False)]
+    if compress:
+        compressible = [f for f in files if not is_compressed(f)]
+        precompressed = [f for f in files if is_compressed(f)]
+        streams = [(directories, compressible, True), ([], precompressed, False)]
+
+    sent_bytes = 0
+    payload_bytes = 0
+    start_time = time.monotonic()
+    for stream_directories, stream_files, stream_compress in streams:
+        if not stream_files and not stream_directories:
+            continue
+        sent, payload = _send_tar(
+            transport,
+            local_dip_path,
+            remote_dip_path,
+            stream_directories,
+            stream_files,
+            stream_compress,
+        )
+        sent_bytes += sent
+        payload_bytes += payload
+    report_throughput("tar", sent_bytes, time.monotonic() - start_time, payload_bytes)
+
+
+def _remote_path(remote_dip_path, relative_path):
+    return "/".join((remote_dip_path.rstrip("/"), relative_path.replace(os.sep, "/")))
+
+
+def _sftp_mkdir(sftp, path):
+    try:
+        sftp.mkdir(path)
+    except OSError:
+        # SFTP servers report an existing directory as a generic failure.
+        try:
+            sftp.stat(path)
+        except OSError:
+            raise TransferError("Unable to create remote directory {}".format(path))
+
+
+def _sftp_write_part(sftp, local_path, remote_path, offset, length):
+    """Write length bytes of a local file at offset into an existing remote file."""
+    with open(local_path, "rb") as source, sftp.open(remote_path, "r+") as target:
+        target.set_pipelined(True)
+        source.seek(offset)
+        target.seek(offset)
+        remaining = length
+        while remaining > 0:
+            data = source.read(min(SFTP_READ_SIZE, remaining))
+            if not data:
+                raise TransferError("{} changed during upload".format(local_path))
+            target.write(data)
+            remaining -= len(data)
+
+
+def sftp_transfer(
+    ssh_client,
+    local_dip_path,
+    remote_dip_path,
+    channels=DEFAULT_SFTP_CHANNELS,
+    files=None,
+):
+    """Copy a DIP over several SFTP channels of one SSH transport.
+
+    Remote file sizes are checked once everything has been written.
+
+    :param ssh_client: Connected paramiko SSHClient to the AtoM server
+    :param local_dip_path: Path to local DIP (str)
+    :param remote_dip_path: Remote directory to copy the DIP to (str)
+    :param channels: Number of SFTP channels to open (int)
+    :param files: Relative paths of the files to send, or None for all (list)
+
+    :raises TransferError: If a file cannot be written or has the wrong size
+    """
+    transport = ssh_client.get_transport()
+    directories, all_files = walk_dip(local_dip_path)
+    if files is None:
+        files = all_files
+    sizes = {
+        relative_path: os.path.getsize(os.path.join(local_dip_path, relative_path))
+        for relative_path in files
+    }
+
+    clients = queue.Queue()
+    opened = []
+    try:
+        for _ in range(channels):
+            sftp = SFTPClient.from_transport(transport)
+            opened.append(sftp)
+            clients.put(sftp)
+
+        def _with_client(function, *args):
+            sftp = clients.get()
+            try:
+                return function(sftp, *args)
+            except OSError as err:
+                raise TransferError("SFTP error for {}: {}".format(args[0], err))
+            finally:
+                clients.put(sftp)
+
+        sftp = opened[0]
+        _sftp_mkdir(sftp, remote_dip_path.rstrip("/"))
+        for directory in directories:
+            _sftp_mkdir(sftp, _remote_path(remote_dip_path, directory))
+
+        # Largest work first, so big files do not end up alone at the end.
+        parts = []
+        for relative_path in sorted(files, key=sizes.get, reverse=True):
+            local_path = os.path.join(local_dip_path, relative_path)
+            remote_path = _remote_path(remote_dip_path, relative_path)
+            size = sizes[relative_path]
+            if size <= SFTP_SPLIT_SIZE:
+                parts.append((local_path, remote_path, None, size))
+                continue
+            # Parts are written into the file in place, so it must exist first.
+            sftp.open(remote_path, "w").close()
+            for offset in range(0, size, SFTP_PART_SIZE):
+                parts.append(
+                    (local_path, remote_path, offset, min(SFTP_PART_SIZE, size - offset))
+                )
+
+        def _send(sftp, local_path, remote_path, offset, length):
+            if offset is None:
+                sftp.put(local_path, remote_path, confirm=False)
+            else:
+                _sftp_write_part(sftp, local_path, remote_path, offset, length)
+
+        def _remote_size(sftp, remote_path):
+            return sftp.stat(remote_path).st_size
+
+        start_time = time.monotonic()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=channels) as executor:
+            for future in [executor.submit(_with_client, _send, *part) for part in parts]:
+                future.result()
+            elapsed = time.monotonic() - start_time
+
+            remote_paths = [_remote_path(remote_dip_path, f) for f in files]
+            remote_sizes = executor.map(
+                lambda path: _with_client(_remote_size, path), remote_paths
+            )
+            mismatched = [
+                relative_path
+                for relative_path, remote_size in zip(files, remote_sizes)
+                if remote_size != sizes[relative_path]
+            ]
+    finally:
+        for sftp in opened:
+            sftp.close()
+
+    if mismatched:
+        raise TransferError(
+            "{} files have the wrong size on the server, e.g. {}".format(
+                len(mismatched), mismatched[0]
+            )
+        )
+    report_throughput("SFTP", sum(sizes.values()), elapsed)
+
+
+def run_command(ssh_client, command, stdin_data=None):
+    """Run a remote command to completion, collecting its output.
+
+    :param ssh_client: Connected paramiko SSHClient
+    :param command: Shell command (str)
+    :param stdin_data: Bytes to send to the command's standard input
+
+    :returns: Tuple of (exit status, stdout bytes, stderr bytes)
+    """
+    channel = ssh_client.get_transport().open_session()
+    try:
+        channel.exec_command(command)
+        stderr = []
+
+        def _send_stdin():
+            if stdin_data:
+                channel.sendall(stdin_data)
+            channel.shutdown_write()
+
+        def _read_stderr():
+            stderr.append(channel.makefile_stderr("rb").read())
+
+        # Feed and drain the command concurrently, so neither side can fill
+        # the channel window and stall the other.
+        threads = [
+            threading.Thread(target=_send_stdin, daemon=True),
+            threading.Thread(target=_read_stderr, daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        stdout = channel.makefile("rb").read()
+        for thread in threads:
+            thread.join()
+        status = channel.recv_exit_status()
+    finally:
+        channel.close()
+    return status, stdout, b"".join(stderr)
+
+
+def _sha256(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def remote_file_sizes(ssh_client, remote_dip_path):
+    """List the files in a remote directory with their sizes.
+
+    :param ssh_client: Connected paramiko SSHClient to the AtoM server
+    :param remote_dip_path: Remote directory (str)
+
+    :returns: Dictionary of relative path to size; empty if the directory
+        does not exist
+    """
+    command = "cd {} 2>/dev/null && find . -type f -printf '%s %P\\0' || true".format(
+        shlex.quote(remote_dip_path)
+    )
+    status, stdout, stderr = run_command(ssh_client, command)
+    if status != 0:
+        raise TransferError(
+            "Unable to list {}: {}".format(remote_dip_path, stderr.decode("utf-8", "replace"))
+        )
+    sizes = {}
+    for entry in stdout.decode("utf-8", "surrogateescape").split("\0"):
+        if entry:
+            size, _, relative_path = entry.partition(" ")
+            sizes[relative_path] = int(size)
+    return sizes
+
+
+def remote_checksums(ssh_client, remote_dip_path, relative_paths):
+    """Compute the SHA-256 of remote files, in the given order.
+
+    :param ssh_client: Connected paramiko SSHClient to the AtoM server
+    :param remote_dip_path: Remote directory (str)
+    :param relative_paths: Paths of the files, relative to it (list)
+
+    :returns: Dictionary of relative path to hex digest, omitting files that
+        could not be hashed
+    """
+    if not relative_paths:
+        return {}
+    # sha256sum reports results in input order, so lines are matched to
+    # paths by position. Names containing newlines would break that; they
+    # are left out and treated as changed.
+    hashable = [path for path in relative_paths if "\n" not in path]
+    command = "cd {} && xargs -0 sha256sum --".format(shlex.quote(remote_dip_path))
+    stdin_data = "\0".join(hashable).encode("utf-8", "surrogateescape") + b"\0"
+    status, stdout, _ = run_command(ssh_client, command, stdin_data)
+    if status != 0:
+        return {}
+    lines = stdout.decode("utf-8", "surrogateescape").splitlines()
+    if len(lines) != len(hashable):
+        return {}
+    # sha256sum prefixes the line with a backslash when it escapes the name.
+    return {path: line.lstrip("\\")[:64] for path, line in zip(hashable, lines)}
+
+
+def delta_sync(ssh_client, local_dip_path, remote_dip_path, workers=DEFAULT_HASH_WORKERS):
+    """Work out which files of a DIP the remote staging directory lacks.
+
+    Remote files with the same size as the local file are compared by
+    SHA-256; the local files are hashed in a thread pool while the server
+    hashes its copies.
+
+    :param ssh_client: Connected paramiko SSHClient to the AtoM server
+    :param local_dip_path: Path to local DIP (str)
+    :param remote_dip_path: Remote staging directory (str)
+    :param workers: Number of local hashing threads (int)
+
+    :returns: Tuple of (relative paths to send, remote relative paths that
+        are not in the DIP)
+    """
+    _, files = walk_dip(local_dip_path)
+    remote_sizes = remote_file_sizes(ssh_client, remote_dip_path)
+    local_files = {f.replace(os.sep, "/"): f for f in files}
+
+    candidates = [
+        remote_path
+        for remote_path, local_path in local_files.items()
+        if remote_sizes.get(remote_path)
+        == os.path.getsize(os.path.join(local_dip_path, local_path))
+    ]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        local_digests = executor.map(
+            lambda path: _sha256(os.path.join(local_dip_path, local_files[path])),
+            candidates,
+        )
+        remote_digests = remote_checksums(ssh_client, remote_dip_path, candidates)
+        unchanged = {
+            path
+            for path, digest in zip(candidates, local_digests)
+            if remote_digests.get(path) == digest
+        }
+
+    to_send = [
+        local_path
+        for remote_path, local_path in local_files.items()
+        if remote_path not in unchanged
+    ]
+    stale = sorted(set(remote_sizes) - set(local_files))
+    return to_send, stale
+
+
+def remove_remote_files(ssh_client, remote_dip_path, relative_paths):
+    """Delete files from a remote directory.
+
+    :param ssh_client: Connected paramiko SSHClient to the AtoM server
+    :param remote_dip_path: Remote directory (str)
+    :param relative_paths: Paths of the files, relative to it (list)
+
+    :raises TransferError: If the files cannot be removed
+    """
+    if not relative_paths:
+        return
+    command = "cd {} && xargs -0 rm -f --".format(shlex.quote(remote_dip_path))
+    stdin_data = "\0".join(relative_paths).encode("utf-8", "surrogateescape") + b"\0"
+    status, _, stderr = run_command(ssh_client, command, stdin_data)
+    if status != 0:
+        raise TransferError(
+            "Unable to remove stale files: {}".format(stderr.decode("utf-8", "replace"))
+        )
+
+
+def clear_remote_dir(ssh_client, remote_dip_path):
+    """Delete a remote directory, if it exists, so a copy starts afresh.
+
+    A recursive scp into an existing directory nests the copy inside it, and
+    tar extracts over whatever is already there, so a copy left by an
+    earlier run must be removed first unless it is being reused.
+
+    :param ssh_client: Connected paramiko SSHClient to the AtoM server
+    :param remote_dip_path: Remote directory (str)
+
+    :raises TransferError: If the directory cannot be removed
+    """
+    command = "rm -rf -- {}".format(shlex.quote(remote_dip_path.rstrip("/")))
+    status, _, stderr = run_command(ssh_client, command)
+    if status != 0:
+        raise TransferError(
+            "Unable to remove earlier remote copy: {}".format(
+                stderr.decode("utf-8", "replace")
+            )
+        )
+
+
+def _curl_config_value(value):
+    return '"{}"'.format(value.replace("\\", "\\\\").replace('"', '\\"'))
+
+
+def pull_package(
+    ssh_client, url, headers, remote_dip_path, checksum_algorithm=None, checksum=None
+):
+    """Have the AtoM server download a package tarball and extract it.
+
+    The server runs curl against the URL itself, so the data never crosses
+    the local connection. The request headers, which carry the Storage
+    Service credentials, reach curl as a config file on its stdin, so they
+    don't appear in the server's process list or on its disk. The tarball is
+    downloaded next to remote_dip_path, checked against the checksum if one
+    is given, and extracted without its top-level directory.
+
+    :param ssh_client: Connected paramiko SSHClient to the AtoM server
+    :param url: Package download URL (str)
+    :param headers: HTTP headers for the request (dict)
+    :param remote_dip_path: Remote directory to extract the package into (str)
+    :param checksum_algorithm: hashlib name of the checksum algorithm (str)
+    :param checksum: Expected tarball checksum, or None to skip checking (str)
+
+    :returns: Bytes downloaded by the server (int)
+
+    :raises TransferError: If the download, checksum or extraction fails
+    """
+    remote_dip_path = remote_dip_path.rstrip("/")
+    check = ""
+    if checksum and checksum_algorithm in REMOTE_CHECKSUM_COMMANDS:
+        check = (
+            " && {{ echo {} | {} --check --status"
+            " || {{ echo 'checksum mismatch' >&2; exit 1; }}; }}"
+        ).format(
+            shlex.quote("{}  ".format(checksum)) + '"$tmp"',
+            REMOTE_CHECKSUM_COMMANDS[checksum_algorithm],
+        )
+    elif checksum:
+        print(
+            "Warning: Server can't check {} checksums; skipping verification".format(
+                checksum_algorithm
+            )
+        )
+    command = (
+        'mkdir -p {dip} && tmp=$(mktemp {dip}.pull.XXXXXX) && trap \'rm -f "$tmp"\' EXIT'
+        ' && curl --fail --silent --show-error --config - --output "$tmp"'
+        '{check} && stat -c %s "$tmp"'
+        ' && tar -xf "$tmp" -C {dip} --strip-components=1'
+    ).format(dip=shlex.quote(remote_dip_path), check=check)
+
+    config_lines = ["url = {}".format(_curl_config_value(url))]
+    for name, value in sorted(headers.items()):
+        config_lines.append(
+            "header = {}".format(_curl_config_value("{}: {}".format(name, value)))
+        )
+    status, stdout, stderr = run_command(
+        ssh_client, command, "\n".join(config_lines).encode("utf-8") + b"\n"
+    )
+    if status != 0:
+        raise TransferError(
+            "server download exited with status {}: {}".format(
+                status, stderr.decode("utf-8", "replace").strip()
+            )
+        )
+    try:
+        return int(stdout.split()[0])
+    except (IndexError, ValueError):
+        return 0
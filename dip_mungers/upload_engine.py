@@ -0,0 +1,166 @@
+"""Concurrent request runner with adaptive concurrency.
+
+Requests run on a pool of worker threads, but the number allowed in flight
+at once is set by an AdaptiveLimiter: it grows by roughly one per round of
+successful requests while latency stays near the best seen recently, and is
+halved whenever the server signals overload. Overloaded requests are retried
+after a backoff that honours the server's Retry-After header.
+"""
+import concurrent.futures
+import random
+import threading
+import time
+
+# Latency above this multiple of the best smoothed latency counts as
+# unhealthy, and stops the limit from growing.
+LATENCY_TOLERANCE = 2.0
+
+# Weight of the newest sample in the smoothed latency.
+LATENCY_SMOOTHING = 0.2
+
+# Weight of the smoothed latency in the best latency when it is slower, so
+# that one early fast response, e.g. before AtoM warmed up to a steady load,
+# doesn't keep the limit at its floor after the next overload.
+BEST_LATENCY_DRIFT = 0.01
+
+DEFAULT_ATTEMPTS = 5
+
+# Seconds before the first retry of a request; doubled on each further retry
+# and capped at MAX_BACKOFF.
+INITIAL_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+
+UPLOADED = "uploaded"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+# Items submitted ahead of the ones in flight, per allowed request. Keeps the
+# worker pool busy without reading a whole item iterable into memory.
+SUBMIT_AHEAD = 4
+
+
+class RetryableError(Exception):
+    """Raised by a request function when the request should be retried.
+
+    :param retry_after: Seconds the server asked us to wait, if any (float)
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdaptiveLimiter:
+    """Semaphore whose limit grows on healthy latency and halves on errors."""
+
+    def __init__(self, max_limit, initial_limit=2):
+        self.max_limit = max_limit
+        self.limit = float(min(initial_limit, max_limit))
+        self.in_flight = 0
+        self.best_latency = None
+        self.smoothed_latency = None
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def record_success(self, latency):
+        with self._condition:
+            if self.smoothed_latency is None:
+                self.smoothed_latency = latency
+            else:
+                self.smoothed_latency += LATENCY_SMOOTHING * (
+                    latency - self.smoothed_latency
+                )
+            if self.best_latency is None or self.smoothed_latency < self.best_latency:
+                self.best_latency = self.smoothed_latency
+            else:
+                self.best_latency += BEST_LATENCY_DRIFT * (
+                    self.smoothed_latency - self.best_latency
+                )
+
+            if self.smoothed_latency <= self.best_latency * LATENCY_TOLERANCE:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+                self._condition.notify_all()
+
+    def record_overload(self):
+        with self._condition:
+            self.limit = max(1.0, self.limit / 2)
+
+
+def _backoff(attempt, retry_after):
+    if retry_after is not None:
+        return retry_after
+    delay = min(MAX_BACKOFF, INITIAL_BACKOFF * 2 ** (attempt - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def run(items, request, max_in_flight, attempts=DEFAULT_ATTEMPTS):
+    """Call request(item) for every item with adaptive concurrency.
+
+    request should raise RetryableError for overload and transient failures;
+    any other exception fails the item straight away.
+
+    :param items: Items to process, consumed lazily (iterable)
+    :param request: Callable performing one request for an item
+    :param max_in_flight: Upper bound on concurrent requests (int)
+    :param attempts: Attempts per item before giving up (int)
+
+    :returns: List of result dictionaries, in item order, with keys
+        "item", "status" (UPLOADED or FAILED), "attempts", "latency" and
+        "error"
+    """
+    limiter = AdaptiveLimiter(max_in_flight)
+
+    def _process(item):
+        result = {
+            "item": item,
+            "status": FAILED,
+            "attempts": 0,
+            "latency": None,
+            "error": None,
+        }
+        for attempt in range(1, attempts + 1):
+            result["attempts"] = attempt
+            limiter.acquire()
+            start_time = time.monotonic()
+            try:
+                request(item)
+            except RetryableError as err:
+                limiter.release()
+                limiter.record_overload()
+                result["error"] = str(err)
+                if attempt < attempts:
+                    time.sleep(_backoff(attempt, err.retry_after))
+                continue
+            except Exception as err:
+                limiter.release()
+                result["error"] = str(err)
+                return result
+            latency = time.monotonic() - start_time
+            limiter.release()
+            limiter.record_success(latency)
+            result.update(status=UPLOADED, latency=latency, error=None)
+            return result
+        return result
+
+    results = []
+    pending = set()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        for item in items:
+            if len(pending) >= max_in_flight * SUBMIT_AHEAD:
+                _, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+            future = executor.submit(_process, item)
+            results.append(future)
+            pending.add(future)
+    return [future.result() for future in results]
@@ -0,0 +1,73 @@
+"""Per-DIP journal of the digital objects dip-metadata has created in AtoM.
+
+Each successful upload is committed to a SQLite file as soon as AtoM
+confirms it, so a rerun after a crash or a failed request only sends the
+rows that are still missing instead of duplicating the ones that made it.
+Entries are scoped by AtoM URL, so development and production runs are
+tracked separately.
+"""
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    atom_url TEXT NOT NULL,
+    file_uuid TEXT NOT NULL,
+    slug TEXT NOT NULL,
+    uploaded_at REAL NOT NULL,
+    source TEXT NOT NULL,
+    PRIMARY KEY (atom_url, file_uuid, slug)
+);
+"""
+
+# Value of the source column.
+UPLOADED = "uploaded"
+
+
+class UploadJournal:
+    """Thread-safe record of (file UUID, parent slug) pairs done per AtoM."""
+
+    def __init__(self, path, atom_url):
+        """
+        :param path: Path to the journal file, created if missing (str)
+        :param atom_url: AtoM URL the uploads are sent to (str)
+        """
+        self.path = path
+        self.atom_url = atom_url
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # WAL keeps per-row commits cheap without risking the journal.
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def completed(self):
+        """Return the pairs already recorded for this AtoM.
+
+        :returns: Set of (file UUID, slug) tuples
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT file_uuid, slug FROM uploads WHERE atom_url = ?",
+                (self.atom_url,),
+            ).fetchall()
+        return set(rows)
+
+    def record(self, file_uuid, slug):
+        """Record a digital object as created in AtoM.
+
+        :param file_uuid: File UUID (str)
+        :param slug: Parent description slug (str)
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO uploads "
+                "(atom_url, file_uuid, slug, uploaded_at, source) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self.atom_url, file_uuid, slug, time.time(), UPLOADED),
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
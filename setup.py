@@ -16,11 +16,13 @@ setup(
     author_email="axfelix@gmail.com",
     license="MIT",
     version="0.1.0",
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks", "benchmarks.*"]),
     install_requires=requirements,
     entry_points={
         "console_scripts": [
+            "dip-mungers=dip_mungers.cli:main",
             "dip-metadata=dip_mungers.dip_metadata:main",
+            "dip-pipeline=dip_mungers.dip_pipeline:main",
             "dip-retrieve=dip_mungers.dip_retrieve:main",
             "dip-upload=dip_mungers.dip_upload:main",
         ]
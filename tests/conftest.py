@@ -0,0 +1,34 @@
+import logging
+
+import paramiko
+import pytest
+
+from benchmarks.ssh_server import SSHServer
+
+# The SSH server's transports log dropped connections as errors when a test
+# disconnects; that is expected here.
+logging.getLogger("paramiko").addHandler(logging.NullHandler())
+
+
+@pytest.fixture
+def ssh_server(tmp_path):
+    server = SSHServer(str(tmp_path / "server")).start()
+    (tmp_path / "server" / "home" / "benchmark").mkdir(parents=True)
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def ssh_client(ssh_server):
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    client.connect(
+        "127.0.0.1",
+        port=ssh_server.port,
+        username="benchmark",
+        password="benchmark",
+        allow_agent=False,
+        look_for_keys=False,
+    )
+    yield client
+    client.close()
@@ -0,0 +1,83 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+# Modules that take most of a command's import time; none is needed to
+# answer --help or report a usage error.
+HEAVY_MODULES = ("paramiko", "requests", "lxml", "amclient", "agentarchives", "metsrw")
+
+# Generous, so the test only fails when heavy imports creep back in.
+STARTUP_BUDGET_SECONDS = 1.0
+
+# Runs dip-mungers, then reports what it imported and whether it parsed
+# the config file, even when argparse exits.
+RUNNER = """
+import json, sys
+from dip_mungers import cli, config
+try:
+    cli.main(sys.argv[1:])
+except SystemExit as exit:
+    status = exit.code
+else:
+    status = 0
+json.dump(
+    {
+        "status": status,
+        "modules": sorted(name.split(".")[0] for name in sys.modules),
+        "config_read": config._config is not None,
+    },
+    sys.stderr,
+)
+"""
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run_cli(tmp_path, *args):
+    env = dict(os.environ, HOME=str(tmp_path))
+    env["PYTHONPATH"] = os.pathsep.join(
+        [REPO_ROOT] + ([os.environ["PYTHONPATH"]] if os.environ.get("PYTHONPATH") else [])
+    )
+    start_time = time.monotonic()
+    process = subprocess.run(
+        [sys.executable, "-c", RUNNER] + list(args),
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    seconds = time.monotonic() - start_time
+    # argparse writes usage errors to stderr ahead of the report.
+    report = json.loads(process.stderr[process.stderr.rindex('{"status"'):])
+    return report, process.stdout, seconds
+
+
+@pytest.mark.parametrize(
+    "args, status",
+    [
+        (["--help"], 0),
+        (["upload", "--help"], 0),
+        (["retrieve", "--help"], 0),
+        (["upload", "--channels", "0", "dip"], 2),
+        (["retrieve"], 2),
+    ],
+)
+def test_help_and_usage_errors_start_fast(tmp_path, args, status):
+    # HOME has no ~/.dip-mungers, so reading it would fail the command too.
+    report, _, seconds = _run_cli(tmp_path, *args)
+
+    assert report["status"] == status
+    assert not report["config_read"]
+    assert not set(HEAVY_MODULES) & set(report["modules"])
+    assert seconds < STARTUP_BUDGET_SECONDS
+
+
+def test_help_lists_subcommands(tmp_path):
+    _, output, _ = _run_cli(tmp_path, "--help")
+
+    for name in ("retrieve", "metadata", "upload", "pipeline"):
+        assert name in output
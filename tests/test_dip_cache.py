@@ -0,0 +1,63 @@
+import os
+import sqlite3
+import stat
+
+from dip_mungers import dip_cache
+from dip_mungers.dip_cache import DIPCache
+
+
+def _make_dip(root):
+    objects = root / "dip" / "objects"
+    objects.mkdir(parents=True)
+    (objects / "a.jpg").write_bytes(b"a" * 1000)
+    (objects / "b.jpg").write_bytes(b"b" * 1000)
+    return str(root / "dip")
+
+
+def test_store_leaves_source_writable_and_unshared(tmp_path):
+    source = _make_dip(tmp_path)
+    cache = DIPCache(str(tmp_path / "cache"), 1024 ** 2)
+
+    assert cache.store("dip-uuid", "checksum", source)
+
+    for name in ("a.jpg", "b.jpg"):
+        path = os.path.join(source, "objects", name)
+        assert os.stat(path).st_mode & stat.S_IWUSR
+        assert os.stat(path).st_nlink == 1
+
+
+def test_checkout_recreates_stored_dip(tmp_path):
+    source = _make_dip(tmp_path)
+    cache = DIPCache(str(tmp_path / "cache"), 1024 ** 2)
+    cache.store("dip-uuid", "checksum", source)
+
+    destination = str(tmp_path / "checkout")
+    assert cache.checkout("dip-uuid", "checksum", destination)
+    with open(os.path.join(destination, "objects", "a.jpg"), "rb") as checked_out:
+        assert checked_out.read() == b"a" * 1000
+    assert not cache.checkout("dip-uuid", "other checksum", str(tmp_path / "miss"))
+
+
+def test_index_connections_are_closed(tmp_path, monkeypatch):
+    connections = []
+
+    class Connection(sqlite3.Connection):
+        closed = False
+
+        def close(self):
+            self.closed = True
+            super().close()
+
+    original_connect = sqlite3.connect
+
+    def connect(*args, **kwargs):
+        connections.append(original_connect(*args, factory=Connection, **kwargs))
+        return connections[-1]
+
+    monkeypatch.setattr(dip_cache.sqlite3, "connect", connect)
+    source = _make_dip(tmp_path)
+    cache = DIPCache(str(tmp_path / "cache"), 1500)
+    cache.store("dip-uuid", "checksum", source)
+    cache.checkout("dip-uuid", "checksum", str(tmp_path / "checkout"))
+
+    assert connections and all(conn.closed for conn in connections)
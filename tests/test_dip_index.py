@@ -0,0 +1,39 @@
+import sqlite3
+
+from dip_mungers import dip_index
+from dip_mungers.dip_index import DIPIndex
+
+AIP_UUID = "11111111-2222-3333-4444-555555555555"
+
+
+def test_index_connections_are_closed(tmp_path, monkeypatch):
+    connections = []
+
+    class Connection(sqlite3.Connection):
+        closed = False
+
+        def close(self):
+            self.closed = True
+            super().close()
+
+    original_connect = sqlite3.connect
+
+    def connect(*args, **kwargs):
+        connections.append(original_connect(*args, factory=Connection, **kwargs))
+        return connections[-1]
+
+    def iter_packages(amclient, params):
+        yield {
+            "uuid": "dip-uuid",
+            "current_path": "dips/{}/".format(AIP_UUID),
+            "status": "UPLOADED",
+            "stored_date": "2026-01-01T00:00:00",
+        }
+
+    monkeypatch.setattr(dip_index.sqlite3, "connect", connect)
+    monkeypatch.setattr(dip_index.storage_service, "iter_packages", iter_packages)
+    index = DIPIndex(str(tmp_path / "index.sqlite"))
+
+    assert index.refresh(None) == 1
+    assert [dip["uuid"] for dip in index.aip2dips(AIP_UUID)] == ["dip-uuid"]
+    assert connections and all(conn.closed for conn in connections)
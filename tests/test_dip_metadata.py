@@ -0,0 +1,94 @@
+import argparse
+import glob
+import os
+
+import pytest
+from agentarchives.atom.client import AtomClient
+
+from benchmarks.fake_atom import FakeAtom
+from benchmarks.synthetic import make_dip
+from dip_mungers import dip_metadata, http_session, upload_engine
+from dip_mungers.upload_journal import UploadJournal
+
+
+@pytest.fixture
+def atom():
+    atom = FakeAtom(latency=0).start()
+    yield atom
+    atom.stop()
+
+
+def _row(filename, file_uuid, slug="parent"):
+    return {
+        "filename": filename,
+        "slug": slug,
+        "file_uuid": file_uuid,
+        "error": None,
+        "payload": {"information_object_slug": slug, "title": filename, "file_uuid": file_uuid},
+    }
+
+
+def test_reconcile_does_not_journal_title_matches(tmp_path, monkeypatch, atom):
+    monkeypatch.setattr(dip_metadata, "JOURNAL_DIRECTORY", str(tmp_path))
+    client = AtomClient(atom.url, "key")
+    # An earlier upload of one of two different files both named a.jpg.
+    client.add_digital_object("parent", title="a.jpg", file_uuid="uuid-1")
+    rows = [_row("a.jpg", "uuid-1"), _row("a.jpg", "uuid-2"), _row("b.jpg", "uuid-3")]
+    args = argparse.Namespace(no_journal=False, reconcile=True, max_in_flight=2)
+
+    results = dip_metadata.apply_plan(client, {"dip": "dip"}, rows, atom.url, args)
+
+    statuses = {result["file_uuid"]: result["status"] for result in results}
+    assert statuses == {
+        "uuid-1": dip_metadata.POSSIBLY_UPLOADED,
+        "uuid-2": dip_metadata.POSSIBLY_UPLOADED,
+        "uuid-3": upload_engine.UPLOADED,
+    }
+    journal = UploadJournal(str(tmp_path / "dip.sqlite"), atom.url)
+    assert journal.completed() == {("uuid-3", "parent")}
+    journal.close()
+
+
+@pytest.mark.parametrize("fault", [502, "stall"])
+def test_upload_is_not_retried_once_atom_may_have_created_it(tmp_path, monkeypatch, fault):
+    monkeypatch.setattr(dip_metadata, "JOURNAL_DIRECTORY", str(tmp_path))
+    atom = FakeAtom(latency=0, after_create=[fault], stall_seconds=1.0).start()
+    try:
+        client = AtomClient(atom.url, "key")
+        http_session.use_session(client, http_session.PooledSession(read_timeout=0.2))
+        args = argparse.Namespace(no_journal=False, reconcile=False, max_in_flight=2)
+
+        results = dip_metadata.apply_plan(
+            client, {"dip": "dip"}, [_row("a.jpg", "uuid-1")], atom.url, args
+        )
+
+        assert [result["status"] for result in results] == [upload_engine.FAILED]
+        assert results[0]["attempts"] == 1
+        assert atom.created == 1
+        journal = UploadJournal(str(tmp_path / "dip.sqlite"), atom.url)
+        assert journal.completed() == set()
+        journal.close()
+    finally:
+        atom.stop()
+
+
+def test_plan_dir_reports_failed_dip_and_continues(tmp_path, monkeypatch, capsys):
+    good, _, _ = make_dip(str(tmp_path), 3, mean_kb=1, seed=0, name="good")
+    bad, _, _ = make_dip(str(tmp_path), 3, mean_kb=1, seed=1, name="bad")
+    # A CSV file saved in another encoding.
+    with open(glob.glob(os.path.join(bad, "objects", "*.csv"))[0], "ab") as csv_file:
+        csv_file.write(b"\xe9t\xe9.jpg,parent\n")
+    monkeypatch.setattr(dip_metadata, "load_config", lambda uploading=True: None)
+    plan_dir = tmp_path / "plans"
+    parser = dip_metadata._make_parser()
+    args = parser.parse_args(
+        ["--no-mets-cache", "--plan-dir", str(plan_dir), "--plan-workers", "1", bad, good]
+    )
+
+    with pytest.raises(SystemExit) as exit_info:
+        dip_metadata.run(parser, args)
+
+    assert exit_info.value.code == 1
+    assert os.listdir(str(plan_dir)) == [os.path.basename(good) + ".jsonl"]
+    output = capsys.readouterr().out
+    assert "Error planning {}: ".format(bad) in output
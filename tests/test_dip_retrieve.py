@@ -0,0 +1,31 @@
+import os
+import tarfile
+
+import pytest
+
+from benchmarks.synthetic import make_dip
+from dip_mungers import dip_retrieve, storage_service
+
+
+def test_truncated_tarball_is_reported_and_cleaned_up(tmp_path, monkeypatch):
+    dip_path, _, _ = make_dip(str(tmp_path / "source"), objects=4, mean_kb=64)
+    dip_basename = os.path.basename(dip_path)
+    tar_path = str(tmp_path / "package.tar")
+    with tarfile.open(tar_path, "w") as dip_tar:
+        dip_tar.add(dip_path, arcname=dip_basename)
+    with open(tar_path, "rb") as package:
+        data = package.read()
+
+    def resumable_download(amclient, package_uuid, destination, **kwargs):
+        # Cut off in the middle of an object file.
+        with open(destination, "wb") as partial:
+            partial.write(data[: len(data) // 2 + 100])
+        return len(data) // 2 + 100
+
+    monkeypatch.setattr(storage_service, "resumable_download", resumable_download)
+    target_dir = tmp_path / "target"
+    target_dir.mkdir()
+
+    with pytest.raises(dip_retrieve.DIPRetrievalError, match="dip-uuid"):
+        dip_retrieve.download_dip(None, "dip-uuid", dip_basename, str(target_dir))
+    assert os.listdir(str(target_dir)) == []
@@ -0,0 +1,116 @@
+import argparse
+import os
+
+import pytest
+
+from benchmarks.synthetic import make_dip
+from dip_mungers import dip_upload
+
+
+def _args(**kwargs):
+    defaults = dict(
+        delta=False, pull=False, transfer="scp", compress=False, channels=2, shards=1
+    )
+    defaults.update(kwargs)
+    return argparse.Namespace(**defaults)
+
+
+def test_copy_replaces_remote_copy_left_by_earlier_run(tmp_path, ssh_server, ssh_client):
+    dip_path, _, _ = make_dip(str(tmp_path / "local"), objects=3, mean_kb=4)
+    dip_name = os.path.basename(dip_path)
+    remote_dip_path = "/home/benchmark/{}/".format(dip_name)
+    server_copy = os.path.join(ssh_server.root, "home", "benchmark", dip_name)
+
+    assert dip_upload.copy_dip(ssh_client, _args(), dip_path, remote_dip_path)
+    with open(os.path.join(server_copy, "stale.txt"), "w") as stale:
+        stale.write("left by an earlier run")
+    assert dip_upload.copy_dip(ssh_client, _args(), dip_path, remote_dip_path)
+
+    assert sorted(os.listdir(server_copy)) == sorted(os.listdir(dip_path))
+
+
+def test_delta_copy_keeps_remote_copy(tmp_path, ssh_server, ssh_client):
+    dip_path, _, _ = make_dip(str(tmp_path / "local"), objects=3, mean_kb=4)
+    dip_name = os.path.basename(dip_path)
+    remote_dip_path = "/home/benchmark/{}/".format(dip_name)
+    args = _args(transfer="tar")
+
+    assert dip_upload.copy_dip(ssh_client, args, dip_path, remote_dip_path)
+    first_run_commands = len(ssh_server.commands)
+    args.delta = True
+    assert dip_upload.copy_dip(ssh_client, args, dip_path, remote_dip_path)
+
+    assert not any(
+        command.startswith("rm -rf")
+        for command in ssh_server.commands[first_run_commands:]
+    )
+
+
+def test_reuses_remote_copy():
+    assert not dip_upload.reuses_remote_copy(_args())
+    assert not dip_upload.reuses_remote_copy(_args(transfer="tar", pull=True))
+    assert dip_upload.reuses_remote_copy(_args(transfer="tar"))
+    assert dip_upload.reuses_remote_copy(_args(transfer="sftp"))
+    assert dip_upload.reuses_remote_copy(_args(shards=2))
+
+
+def _upload_args(dip_paths):
+    return _args(dip_path=dip_paths, max_staged=2, import_log=None)
+
+
+def test_upload_dips_continues_after_copy_raises(monkeypatch):
+    def copy_dip(target, args, local_dip_path, remote_dip_path, amclient=None):
+        if local_dip_path.endswith("first"):
+            raise OSError("SSH session not active")
+        return True
+
+    imported = []
+
+    def import_dip(target, password, args, server_name, local_dip_path, *rest):
+        imported.append(local_dip_path)
+        return 0
+
+    monkeypatch.setattr(dip_upload, "copy_dip", copy_dip)
+    monkeypatch.setattr(dip_upload, "import_dip", import_dip)
+    monkeypatch.setattr(dip_upload, "remove_remote_dip", lambda target, path: None)
+
+    args = _upload_args(["/dips/first", "/dips/second"])
+    assert not dip_upload.upload_dips(None, None, args, "atom")
+    assert imported == ["/dips/second"]
+
+
+def test_upload_dips_continues_after_import_raises(monkeypatch, capsys):
+    imported = []
+
+    def import_dip(target, password, args, server_name, local_dip_path, *rest):
+        imported.append(local_dip_path)
+        if local_dip_path.endswith("first"):
+            raise EOFError("channel closed")
+        return 0
+
+    monkeypatch.setattr(dip_upload, "copy_dip", lambda *args: True)
+    monkeypatch.setattr(dip_upload, "import_dip", import_dip)
+    monkeypatch.setattr(dip_upload, "remove_remote_dip", lambda target, path: None)
+
+    # One staging slot, so the second DIP is only copied once the failed
+    # import has released it.
+    args = _upload_args(["/dips/first", "/dips/second"])
+    args.max_staged = 1
+    assert not dip_upload.upload_dips(None, None, args, "atom")
+    assert imported == ["/dips/first", "/dips/second"]
+    output = capsys.readouterr().out
+    assert "Error importing first: channel closed" in output
+    assert "first: import failed" in output
+    assert "second: imported" in output
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_upload_dips_returns_when_copier_stops(monkeypatch):
+    def copy_dip(target, args, local_dip_path, remote_dip_path, amclient=None):
+        # Not an Exception, so it ends the copier thread.
+        raise SystemExit(1)
+
+    monkeypatch.setattr(dip_upload, "copy_dip", copy_dip)
+
+    args = _upload_args(["/dips/first", "/dips/second", "/dips/third"])
+    assert not dip_upload.upload_dips(None, None, args, "atom")
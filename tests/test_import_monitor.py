@@ -0,0 +1,96 @@
+import threading
+
+from dip_mungers import import_monitor
+
+
+class FakeChannel:
+    """Channel playing sudo on a host whose sudoers set requiretty."""
+
+    def __init__(self):
+        self.pty = False
+        self.sent = []
+        self._stdout = []
+        self._stderr = []
+        self._password = threading.Event()
+        self._status = 1
+
+    def get_pty(self):
+        self.pty = True
+
+    def exec_command(self, command):
+        if not self.pty:
+            self._stderr.append(b"sudo: sorry, you must have a tty to run sudo\n")
+            return
+        self._stdout.append(import_monitor.SUDO_PROMPT.encode("utf-8"))
+        self._stdout.append(None)
+        self._stdout.append(b"Importing a.jpg\r\nDone\r\n")
+        self._status = 0
+
+    def recv(self, size):
+        if self._stdout and self._stdout[0] is None:
+            # Wait for the password before carrying on.
+            assert self._password.wait(5)
+            self._stdout.pop(0)
+        return self._stdout.pop(0) if self._stdout else b""
+
+    def recv_stderr(self, size):
+        return self._stderr.pop(0) if self._stderr else b""
+
+    def sendall(self, data):
+        self.sent.append(data)
+        self._password.set()
+
+    def recv_exit_status(self):
+        return self._status
+
+    def close(self):
+        pass
+
+
+class FakeClient:
+    def __init__(self):
+        self.channels = []
+
+    def get_transport(self):
+        return self
+
+    def open_session(self):
+        self.channels.append(FakeChannel())
+        return self.channels[-1]
+
+
+def test_run_import_reruns_on_pty_when_sudo_requires_tty():
+    client = FakeClient()
+    lines = []
+
+    status = import_monitor.run_import(
+        client,
+        import_monitor.sudo_command("import"),
+        "secret",
+        lambda stream, text: lines.append((stream, text)),
+    )
+
+    assert status == 0
+    assert [channel.pty for channel in client.channels] == [False, True]
+    assert client.channels[1].sent == [b"secret\n"]
+    assert lines == [("stdout", "Importing a.jpg"), ("stdout", "Done")]
+
+
+def test_run_import_reports_other_sudo_failures():
+    client = FakeClient()
+    lines = []
+
+    def exec_command(command):
+        channel._stderr.append(b"sudo: 3 incorrect password attempts\n")
+
+    channel = FakeChannel()
+    channel.exec_command = exec_command
+    client.open_session = lambda: client.channels.append(channel) or channel
+
+    status = import_monitor.run_import(
+        client, "sudo import", "secret", lambda stream, text: lines.append((stream, text))
+    )
+
+    assert status == 1
+    assert len(client.channels) == 1
+    assert lines == [("stderr", "sudo: 3 incorrect password attempts")]
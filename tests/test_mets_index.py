@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+from dip_mungers import dip_metadata, mets_index
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Original and preservation files plus a metadata file have PREMIS objects;
+# notes.txt only has rights metadata and readme.md no amdSec at all.
+INDEXED = {
+    "1b4a1a0e-2b0a-4c0b-8fd1-3a1bd8b1a1f1": "letter 1911-04-02.tif",
+    "2c5b2b1f-3c1b-4d1c-9fe2-4b2ce9c2b2f2": "letter 1911-04-02 & reply.pdf",
+    "4e7d4d3b-5e3d-4f3e-8b14-6d4e1b4d4d14": (
+        "letter 1911-04-02-4e7d4d3b-5e3d-4f3e-8b14-6d4e1b4d4d14.tif"
+    ),
+    "5f8e5e4c-6f4e-4a4f-9c25-7e5f2c5e5e25": "directory_tree.txt",
+}
+
+
+def _summary(records):
+    return {
+        file_uuid: (record.label, record.properties())
+        for file_uuid, record in records.items()
+    }
+
+
+@pytest.mark.parametrize("mets_name", ["METS.premis2.xml", "METS.premis3.xml"])
+def test_stream_index_matches_metsrw(mets_name):
+    metspath = os.path.join(FIXTURES, mets_name)
+
+    streamed = _summary(mets_index.read_index(metspath))
+    parsed = _summary(dip_metadata.read_file_records(metspath, "metsrw"))
+
+    assert streamed == parsed
+    assert {file_uuid: label for file_uuid, (label, _) in streamed.items()} == INDEXED
+    assert streamed["1b4a1a0e-2b0a-4c0b-8fd1-3a1bd8b1a1f1"][1] == {
+        "size": "2871540",
+        "format_name": "Tagged Image File Format",
+        "format_version": "6",
+        "format_registry_name": "PRONOM",
+        "format_registry_key": "fmt/353",
+    }
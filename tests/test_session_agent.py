@@ -0,0 +1,36 @@
+import os
+import stat
+import types
+
+import pytest
+
+from dip_mungers import session_agent
+
+
+def _target():
+    return types.SimpleNamespace(get_transport=lambda: None)
+
+
+def test_agent_makes_loose_socket_directory_private(tmp_path):
+    directory = tmp_path / "agent"
+    directory.mkdir(mode=0o755)
+    os.chmod(str(directory), 0o755)
+    path = str(directory / "user@host.sock")
+
+    server = session_agent.AgentServer(path, _target(), None, 60)
+    server.server_close()
+
+    assert stat.S_IMODE(os.stat(str(directory)).st_mode) == 0o700
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_agent_refuses_directory_of_another_user(tmp_path, monkeypatch):
+    directory = tmp_path / "agent"
+    directory.mkdir(mode=0o700)
+    uid = os.stat(str(directory)).st_uid
+    monkeypatch.setattr(session_agent.os, "getuid", lambda: uid + 1)
+
+    with pytest.raises(session_agent.AgentError, match="another user"):
+        session_agent.AgentServer(str(directory / "user@host.sock"), _target(), None, 60)
+
+    assert not os.path.exists(str(directory / "user@host.sock"))
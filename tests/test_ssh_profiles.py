@@ -0,0 +1,32 @@
+from dip_mungers import ssh_profiles
+
+
+class _Client:
+    closed = False
+
+    def __init__(self, profile):
+        self.profile = profile
+
+    def close(self):
+        self.closed = True
+
+
+def test_calibrate_skips_profiles_that_fail_to_send(monkeypatch, capsys):
+    clients = []
+
+    def connect(profile):
+        clients.append(_Client(profile))
+        return clients[-1]
+
+    def time_upload(client, size):
+        if client.profile == "compressed":
+            raise EOFError("channel closed")
+        return {"default": 2.0, "fast-gcm": 1.0}[client.profile]
+
+    monkeypatch.setattr(ssh_profiles, "time_upload", time_upload)
+
+    timings = ssh_profiles.calibrate(connect, ["compressed", "default", "fast-gcm"], 1024)
+
+    assert timings == [("fast-gcm", 1.0), ("default", 2.0)]
+    assert all(client.closed for client in clients)
+    assert "Unable to send with profile compressed: channel closed" in capsys.readouterr().out
@@ -0,0 +1,159 @@
+import os
+import shutil
+import types
+
+import pytest
+
+from benchmarks.fake_storage_service import FakeStorageService
+from benchmarks.synthetic import make_dip
+from dip_mungers import storage_service
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage_service, "RETRY_DELAY", 0)
+    service = FakeStorageService(str(tmp_path)).start()
+    yield service
+    service.stop()
+
+
+@pytest.fixture
+def package(tmp_path, service):
+    dip_path, _, _ = make_dip(str(tmp_path / "dips"), objects=8, mean_kb=128)
+    return service.packages[service.add_dip(dip_path)]
+
+
+def _amclient(service):
+    return types.SimpleNamespace(ss_url=service.url, ss_user_name="user", ss_api_key="key")
+
+
+def _download(service, package, destination, **kwargs):
+    return storage_service.resumable_download(
+        _amclient(service),
+        package["package"]["uuid"],
+        destination,
+        checksum=package["package"]["checksum"],
+        checksum_algorithm="sha256",
+        **kwargs
+    )
+
+
+def _read(path):
+    with open(path, "rb") as package_file:
+        return package_file.read()
+
+
+def _range_starts(service):
+    return [int(value[len("bytes="):-1]) for value in service.ranges if value]
+
+
+def test_resumes_after_dropped_connections(tmp_path, service, package):
+    size = package["package"]["size"]
+    # Bytes after the last whole chunk before a drop are fetched again.
+    service.drop_after = 2 * storage_service.CHUNK_SIZE + 100
+    destination = str(tmp_path / "package.tar")
+
+    assert _download(service, package, destination) == size
+    assert _read(destination) == _read(package["tar_path"])
+    assert service.drops >= 2
+    starts = _range_starts(service)
+    assert len(starts) == service.drops
+    assert starts == sorted(set(starts)) and starts[0] > 0
+    assert not os.path.exists(destination + storage_service.PARTIAL_SUFFIX)
+
+
+def test_resumes_from_partial_file_of_earlier_run(tmp_path, service, package):
+    size = package["package"]["size"]
+    service.drop_after = size // 2
+    destination = str(tmp_path / "package.tar")
+    partial_path = destination + storage_service.PARTIAL_SUFFIX
+
+    with pytest.raises(storage_service.DownloadError, match="after 1 attempts"):
+        _download(service, package, destination, attempts=1)
+    kept = os.path.getsize(partial_path)
+    assert 0 < kept <= service.drop_after
+    assert not os.path.exists(destination)
+
+    service.drop_after = None
+    assert _download(service, package, destination) == size - kept
+    assert _range_starts(service) == [kept]
+    assert _read(destination) == _read(package["tar_path"])
+
+
+def test_complete_partial_file_is_verified_without_download(tmp_path, service, package):
+    destination = str(tmp_path / "package.tar")
+    shutil.copy(package["tar_path"], destination + storage_service.PARTIAL_SUFFIX)
+
+    # The server answers 416 for a range starting at the end of the package.
+    assert _download(service, package, destination) == 0
+    assert _read(destination) == _read(package["tar_path"])
+
+
+def test_gives_up_after_attempts_without_progress(tmp_path, service, package):
+    # Less than a chunk per connection, so nothing is ever kept.
+    service.drop_after = storage_service.CHUNK_SIZE // 2
+    destination = str(tmp_path / "package.tar")
+
+    with pytest.raises(storage_service.DownloadError, match="after 3 attempts"):
+        _download(service, package, destination, attempts=3)
+    assert service.drops == 3
+    assert not os.path.exists(destination)
+
+
+def test_keeps_retrying_while_making_progress(tmp_path, service, package):
+    service.drop_after = storage_service.CHUNK_SIZE + 100
+    destination = str(tmp_path / "package.tar")
+
+    _download(service, package, destination, attempts=2)
+    assert service.drops > 2
+    assert _read(destination) == _read(package["tar_path"])
+
+
+def test_corrupt_partial_file_is_discarded(tmp_path, service, package):
+    destination = str(tmp_path / "package.tar")
+    partial_path = destination + storage_service.PARTIAL_SUFFIX
+    with open(partial_path, "wb") as partial:
+        partial.write(b"not the package")
+
+    with pytest.raises(storage_service.ChecksumMismatchError):
+        _download(service, package, destination)
+    assert not os.path.exists(partial_path)
+
+
+def test_oversized_partial_file_is_discarded(tmp_path, service, package):
+    destination = str(tmp_path / "package.tar")
+    partial_path = destination + storage_service.PARTIAL_SUFFIX
+    # Left by an earlier download of a larger package stored under this UUID.
+    with open(partial_path, "wb") as partial:
+        partial.write(_read(package["tar_path"]) + b"\0" * 1024)
+
+    size = package["package"]["size"]
+    assert _download(service, package, destination) == size
+    assert _range_starts(service) == [size + 1024]
+    assert service.ranges[-1] is None
+    assert _read(destination) == _read(package["tar_path"])
+
+
+def test_package_contents_lists_files(service, package):
+    paths = storage_service.package_contents(
+        _amclient(service), package["package"]["uuid"]
+    )
+
+    assert paths == package["contents"]
+
+
+def test_package_contents_rejects_invalid_json(service, monkeypatch):
+    class Response:
+        status_code = 200
+
+        def json(self):
+            raise ValueError("Expecting value: line 1 column 1 (char 0)")
+
+    monkeypatch.setattr(
+        storage_service,
+        "session",
+        lambda amclient: types.SimpleNamespace(get=lambda *args, **kwargs: Response()),
+    )
+
+    with pytest.raises(storage_service.DownloadError, match="package-uuid"):
+        storage_service.package_contents(_amclient(service), "package-uuid")
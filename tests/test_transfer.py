@@ -0,0 +1,112 @@
+import hashlib
+import os
+
+import pytest
+
+from benchmarks.synthetic import make_dip
+from dip_mungers import transfer
+
+REMOTE_DIP_PATH = "/home/benchmark/dip/"
+
+
+@pytest.fixture
+def dip_path(tmp_path):
+    dip_path, _, _ = make_dip(str(tmp_path / "local"), objects=6, mean_kb=32)
+    # Beside the synthetic DIP's JPEGs, METS and CSV: a compressible file
+    # in a subdirectory, a name with spaces and an empty directory.
+    transcripts = os.path.join(dip_path, "objects", "transcripts")
+    os.makedirs(transcripts)
+    with open(os.path.join(transcripts, "letter one & two.txt"), "w") as text:
+        text.write("Dear Sir,\n" * 5000)
+    os.makedirs(os.path.join(dip_path, "objects", "empty"))
+    return dip_path
+
+
+def _remote_root(ssh_server):
+    return os.path.join(ssh_server.root, REMOTE_DIP_PATH.strip("/"))
+
+
+def _tree(root):
+    """Return a DIP's directories and each file's contents, by relative path."""
+    directories = set()
+    files = {}
+    for path, dirnames, filenames in os.walk(root):
+        for dirname in dirnames:
+            directories.add(os.path.relpath(os.path.join(path, dirname), root))
+        for filename in filenames:
+            file_path = os.path.join(path, filename)
+            with open(file_path, "rb") as source:
+                files[os.path.relpath(file_path, root)] = source.read()
+    return directories, files
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_tar_transfer_copies_identical_tree(ssh_server, ssh_client, dip_path, compress):
+    transfer.tar_transfer(ssh_client, dip_path, REMOTE_DIP_PATH, compress=compress)
+
+    assert _tree(_remote_root(ssh_server)) == _tree(dip_path)
+    tar_commands = [command for command in ssh_server.commands if "tar -x" in command]
+    if compress:
+        # Compressible files are gzipped, the JPEGs sent as they are.
+        assert [" -xzf " in command for command in tar_commands] == [True, False]
+    else:
+        assert len(tar_commands) == 1
+
+
+def test_sftp_transfer_copies_identical_tree(ssh_server, ssh_client, dip_path, monkeypatch):
+    # Small enough that the larger files are sent in parts on several channels.
+    monkeypatch.setattr(transfer, "SFTP_SPLIT_SIZE", 16 * 1024)
+    monkeypatch.setattr(transfer, "SFTP_PART_SIZE", 8 * 1024)
+
+    transfer.sftp_transfer(ssh_client, dip_path, REMOTE_DIP_PATH, channels=3)
+
+    assert _tree(_remote_root(ssh_server)) == _tree(dip_path)
+
+
+def test_remote_checksums_match_local_files(ssh_server, ssh_client, dip_path):
+    transfer.tar_transfer(ssh_client, dip_path, REMOTE_DIP_PATH)
+    _, files = transfer.walk_dip(dip_path)
+
+    checksums = transfer.remote_checksums(ssh_client, REMOTE_DIP_PATH, files)
+
+    for relative_path in files:
+        with open(os.path.join(dip_path, relative_path), "rb") as source:
+            assert checksums[relative_path] == hashlib.sha256(source.read()).hexdigest()
+
+
+def test_delta_sync_sends_only_changed_files(ssh_server, ssh_client, dip_path):
+    transfer.tar_transfer(ssh_client, dip_path, REMOTE_DIP_PATH)
+    remote_root = _remote_root(ssh_server)
+    objects = sorted(
+        name for name in os.listdir(os.path.join(dip_path, "objects")) if name.endswith(".jpg")
+    )
+    # Same size, different contents; a different size; a new file; and a
+    # file that is only on the server.
+    same_size = os.path.join("objects", objects[0])
+    with open(os.path.join(dip_path, same_size), "r+b") as changed:
+        changed.write(b"\xff" * 16)
+    resized = os.path.join("objects", objects[1])
+    with open(os.path.join(dip_path, resized), "ab") as changed:
+        changed.write(b"more")
+    added = os.path.join("objects", "transcripts", "new.txt")
+    with open(os.path.join(dip_path, added), "w") as new:
+        new.write("new")
+    removed = os.path.join("objects", objects[2])
+    os.remove(os.path.join(dip_path, removed))
+    _, files = transfer.walk_dip(dip_path)
+    unchanged = set(files) - {same_size, resized, added}
+    ctimes = {
+        path: os.stat(os.path.join(remote_root, path)).st_ctime_ns for path in unchanged
+    }
+
+    to_send, stale = transfer.delta_sync(ssh_client, dip_path, REMOTE_DIP_PATH)
+
+    assert sorted(to_send) == sorted([same_size, resized, added])
+    assert stale == [removed]
+
+    transfer.remove_remote_files(ssh_client, REMOTE_DIP_PATH, stale)
+    transfer.tar_transfer(ssh_client, dip_path, REMOTE_DIP_PATH, files=to_send)
+    assert _tree(remote_root) == _tree(dip_path)
+    assert {
+        path: os.stat(os.path.join(remote_root, path)).st_ctime_ns for path in unchanged
+    } == ctimes
@@ -0,0 +1,74 @@
+import threading
+import time
+
+from dip_mungers import upload_engine
+from dip_mungers.upload_engine import AdaptiveLimiter, RetryableError
+
+
+def test_limiter_halves_on_overload_and_recovers():
+    limiter = AdaptiveLimiter(8)
+    for _ in range(50):
+        limiter.record_success(0.01)
+    assert limiter.limit == 8
+
+    limiter.record_overload()
+    limiter.record_overload()
+    assert limiter.limit == 2
+
+    for _ in range(50):
+        limiter.record_success(0.01)
+    assert limiter.limit == 8
+
+
+def test_limiter_does_not_grow_while_latency_is_unhealthy():
+    limiter = AdaptiveLimiter(8)
+    limiter.record_success(0.01)
+    grown = limiter.limit
+    for _ in range(20):
+        limiter.record_success(1.0)
+    assert limiter.limit == grown
+
+
+def test_limiter_recovers_when_latency_settles_above_first_sample():
+    limiter = AdaptiveLimiter(8)
+    limiter.record_success(0.01)
+    limiter.record_overload()
+    assert int(limiter.limit) == 1
+
+    for _ in range(500):
+        limiter.record_success(0.05)
+    assert limiter.limit == 8
+
+
+def test_run_backs_off_on_429_and_recovers(monkeypatch):
+    limits = []
+
+    class RecordingLimiter(AdaptiveLimiter):
+        def record_success(self, latency):
+            super().record_success(latency)
+            limits.append(("success", self.limit))
+
+        def record_overload(self):
+            super().record_overload()
+            limits.append(("overload", self.limit))
+
+    monkeypatch.setattr(upload_engine, "AdaptiveLimiter", RecordingLimiter)
+    throttled = set(range(100, 110))
+    lock = threading.Lock()
+
+    def request(item):
+        time.sleep(0.002)
+        with lock:
+            if item in throttled:
+                throttled.discard(item)
+                raise RetryableError("429 Too Many Requests", retry_after=0)
+
+    results = upload_engine.run(range(300), request, 8)
+
+    assert all(result["status"] == upload_engine.UPLOADED for result in results)
+    overloads = [index for index, (kind, _) in enumerate(limits) if kind == "overload"]
+    assert overloads
+    peak_before = max(limit for _, limit in limits[: overloads[0]])
+    lowest = min(limit for _, limit in limits[overloads[0] :])
+    assert lowest < peak_before
+    assert limits[-1][1] > lowest